@@ -42,6 +42,18 @@ active_sessions_counter = meter.create_up_down_counter(
     unit="1"
 )
 
+scheduler_queue_depth = meter.create_up_down_counter(
+    name="mcp.scheduler.queue_depth",
+    description="Number of commands waiting for admission by the scheduler",
+    unit="1"
+)
+
+scheduler_wait_time = meter.create_histogram(
+    name="mcp.scheduler.wait_time",
+    description="Time commands spent queued before admission",
+    unit="s"
+)
+
 def get_meter():
     """Get the MCP meter."""
     return meter 
\ No newline at end of file
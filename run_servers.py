@@ -10,7 +10,8 @@ import sys
 
 def run_core_server():
     """Run the core MCP server on port 7443."""
-    from server.core import mcp
+    from server.core import mcp, startup
+    startup()
     uvicorn.run(mcp.sse_app, host="0.0.0.0", port=7443)
 
 def run_llm_server():
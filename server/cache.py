@@ -0,0 +1,96 @@
+"""
+Result cache for idempotent commands.
+
+Entries are keyed on the parsed argv, the working directory, the environment
+variables that commonly change a command's output, and the mtime/size of any
+input paths the caller declares. Entries expire after their TTL and the least
+recently used entry is evicted once the cache is full.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+# Environment variables included in every cache key
+CACHE_ENV_VARS = ("PATH", "HOME", "USER", "LANG", "LC_ALL", "TZ",
+                  "GIT_DIR", "GIT_WORK_TREE", "VIRTUAL_ENV", "PYTHONPATH")
+
+
+def fingerprint(path: str) -> tuple:
+    """Identify the current state of an input path by mtime and size."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+class CommandCache:
+    """Thread-safe TTL + LRU cache of completed command results."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(argv: List[str], cwd: str, env: Mapping[str, str],
+            inputs: Iterable[str] = (), limits: Optional[Mapping[str, float]] = None) -> tuple:
+        """Build the cache key for a command invocation.
+
+        Resource limits are part of the key: a command may behave differently
+        under them.
+        """
+        return (
+            tuple(argv),
+            cwd,
+            tuple((name, env.get(name)) for name in CACHE_ENV_VARS),
+            tuple(fingerprint(os.path.join(cwd, path)) for path in inputs),
+            tuple(sorted((name, float(value)) for name, value in (limits or {}).items()))
+        )
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Return a copy of a live cached result, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: tuple, result: Dict[str, Any], ttl: float) -> None:
+        """Store a result for ``ttl`` seconds."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
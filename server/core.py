@@ -1,4 +1,4 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 import os
 import platform
 import subprocess
@@ -10,8 +10,9 @@ import glob
 import stat
 import shutil
 import threading
-import queue
 import json
+import base64
+import logging
 from typing import Dict, List, Optional, Union, Any
 from datetime import datetime
 import socket
@@ -22,7 +23,7 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.semconv.resource import ResourceAttributes
-from functools import wraps
+from functools import partial, wraps
 from opentelemetry.metrics import get_meter_provider, set_meter_provider
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
@@ -39,16 +40,96 @@ import psutil
 from opentelemetry.sdk.metrics._internal.measurement import Measurement
 import asyncio
 import metrics
+from server.cache import CommandCache
+from server.forkserver import DEFAULT_PRELOAD, ForkedProcess, ForkServer
+from server.gitobjects import LOG_PAGE_SIZE, GitError, ObjectReaderPool, path_log
+from server.gitstatus import GitStatusCache
+from server.journal import JournaledProcess, SessionJournal, SpoolFollower, read_status, start_durable
+from server.pipeline import PipelineProcess, split_pipeline, start_pipeline
+from server.policy import MATCH_KINDS, CommandPolicy
+from server.procgroup import group_members, signal_group, terminate_group
+from server.procstats import ProcessTreeStats
+from server.projection import OutputProjection, projection_info
+from server.scheduler import CommandScheduler, Ticket
+from server.sessions import Session, SessionRegistry
+from server.shell import PtyShell, ShellBusyError
+from server.limits import (
+    AccountedProcess, CgroupSubtree, preexec_limits, rlimit_settings, rusage_dict,
+    validate_limits
+)
+from server.output import (
+    ChangeNotifier, OutputBuffer, OutputMultiplexer, DEFAULT_MEMORY_CAP, decode_output
+)
 # import yaml
 
+logger = logging.getLogger(__name__)
+
 # Initialize the MCP server
 mcp = FastMCP("Terminal Command Runner MCP", port=7443, log_level="DEBUG")
 
 # Global variables for process management
-session_lock = threading.Lock()
-active_sessions = {}
-blacklisted_commands = set(['rm -rf /', 'mkfs'])
+# Guards shells, reaper state and lazy setup; command sessions have their own locks
+session_lock = threading.RLock()
+active_sessions = SessionRegistry()
+# Durable sessions, kept on disk so a restarted server can reattach to them
+session_journal = SessionJournal(
+    os.environ.get("MCP_SESSION_JOURNAL")
+    or os.path.join(tempfile.gettempdir(), f"mcp-sessions-{os.getuid()}")
+)
+spool_follower = SpoolFollower()
+# Deny rules match parsed argv; as a set it holds the deny rules' text
+command_policy = CommandPolicy(deny=['rm -rf /', 'mkfs*'])
+blacklisted_commands = command_policy
 output_queues = {}
+output_multiplexer = OutputMultiplexer()
+# Bytes of each session stream kept in memory before spilling to disk
+output_memory_cap = int(os.environ.get("MCP_OUTPUT_MEMORY_CAP", DEFAULT_MEMORY_CAP))
+command_cache = CommandCache(int(os.environ.get("MCP_COMMAND_CACHE_SIZE", 256)))
+# Admission control: commands beyond the budget wait in per-client queues
+command_scheduler = CommandScheduler(
+    int(os.environ.get("MCP_MAX_CONCURRENT_COMMANDS", 64)),
+    observe_depth=lambda delta, priority: scheduler_queue_depth.add(delta, {"priority": priority}),
+    observe_wait=lambda seconds, priority: scheduler_wait_time.record(seconds, {"priority": priority})
+)
+# cgroup v2 sub-tree for commands run with limits, detected on first use
+cgroup_subtree = None
+_cgroup_detected = False
+# Exited sessions keep their output this long before the reaper evicts them
+SESSION_GRACE_PERIOD = float(os.environ.get("MCP_SESSION_GRACE_PERIOD", 300))
+SESSION_REAP_INTERVAL = float(os.environ.get("MCP_SESSION_REAP_INTERVAL", 5))
+# Error of a command that exited without a readable exit status
+LOST_STATUS_ERROR = "Command exited but its exit status was lost"
+# Persistent PTY shells by shell pid, closed after this many idle seconds
+shell_sessions = {}
+SHELL_IDLE_TIMEOUT = float(os.environ.get("MCP_SHELL_IDLE_TIMEOUT", 1800))
+# Warm interpreter that run_python forks from, started on first use
+python_forkserver = ForkServer(output_multiplexer, [
+    name.strip() for name in os.environ.get("MCP_FORKSERVER_PRELOAD", ",".join(DEFAULT_PRELOAD)).split(",")
+    if name.strip()
+])
+# Long-lived git cat-file processes per repository, closed by the reaper when idle
+git_readers = ObjectReaderPool(float(os.environ.get("MCP_GIT_READER_IDLE_TIMEOUT", 300)))
+# git status output per repository, invalidated by inotify events on the work tree
+git_status_cache = GitStatusCache(
+    accelerate=os.environ.get("MCP_GIT_STATUS_ACCELERATE", "").lower() in ("1", "true", "yes"),
+    idle_timeout=git_readers.idle_timeout
+)
+reaper_stats = {
+    'sweeps': 0,
+    'evicted': 0,
+    'orphaned': 0,
+    'reclaimed_memory_bytes': 0,
+    'reclaimed_spill_bytes': 0,
+    'shells_closed': 0,
+    'git_readers_closed': 0,
+    'git_status_evicted': 0,
+    'last_sweep': None
+}
+_session_reaper = None
+# Seconds between exit checks while long-polling a session without exit notifications
+EXIT_POLL_INTERVAL = 0.25
+# How captured output is returned: decoded text, or the raw bytes in base64
+OUTPUT_ENCODINGS = ("text", "base64")
 
 # Global variables for debug state management
 debug_sessions = {}
@@ -116,6 +197,22 @@ if not is_test_mode and enable_telemetry:
         unit="1"
     )
 
+    command_cache_hits = meter.create_counter(
+        name="mcp.command_cache.hits",
+        description="Number of execute_command results served from the cache",
+        unit="1"
+    )
+
+    command_cache_misses = meter.create_counter(
+        name="mcp.command_cache.misses",
+        description="Number of cacheable execute_command calls that missed the cache",
+        unit="1"
+    )
+
+    # Scheduler instruments live on the shared meter in metrics.py
+    scheduler_queue_depth = metrics.scheduler_queue_depth
+    scheduler_wait_time = metrics.scheduler_wait_time
+
     # Create a counter for active sessions
     active_sessions_counter = meter.create_up_down_counter(
         name="mcp.sessions.active",
@@ -154,14 +251,13 @@ else:
     tool_duration = meter
     tool_calls = meter
     tool_errors = meter
+    command_cache_hits = meter
+    command_cache_misses = meter
+    scheduler_queue_depth = meter
+    scheduler_wait_time = meter
     active_sessions_counter = meter
     memory_usage = meter
 
-def update_active_sessions_metric():
-    """Update the active sessions metric."""
-    with session_lock:
-        active_sessions_counter.add(len(active_sessions))
-
 def trace_tool(func):
     """Decorator to add tracing to MCP tools"""
     @wraps(func)
@@ -327,6 +423,26 @@ def get_metrics_info() -> Dict[str, Any]:
                     'description': tool_errors.description,
                     'unit': tool_errors.unit
                 },
+                'command_cache_hits': {
+                    'name': command_cache_hits.name,
+                    'description': command_cache_hits.description,
+                    'unit': command_cache_hits.unit
+                },
+                'command_cache_misses': {
+                    'name': command_cache_misses.name,
+                    'description': command_cache_misses.description,
+                    'unit': command_cache_misses.unit
+                },
+                'scheduler_queue_depth': {
+                    'name': scheduler_queue_depth.name,
+                    'description': scheduler_queue_depth.description,
+                    'unit': scheduler_queue_depth.unit
+                },
+                'scheduler_wait_time': {
+                    'name': scheduler_wait_time.name,
+                    'description': scheduler_wait_time.description,
+                    'unit': scheduler_wait_time.unit
+                },
                 'active_sessions': {
                     'name': active_sessions_counter.name,
                     'description': active_sessions_counter.description,
@@ -370,7 +486,9 @@ def configure_metrics(exporter_endpoint: str = None) -> Dict[str, Any]:
             meter = get_meter_provider().get_meter("mcp-server")
             
             # Recreate metrics with new meter
-            global tool_duration, tool_calls, tool_errors, active_sessions, memory_usage
+            global tool_duration, tool_calls, tool_errors, active_sessions_counter, memory_usage
+            global command_cache_hits, command_cache_misses
+            global scheduler_queue_depth, scheduler_wait_time
             tool_duration = meter.create_histogram(
                 name="mcp.tool.duration",
                 description="Duration of MCP tool execution",
@@ -386,11 +504,32 @@ def configure_metrics(exporter_endpoint: str = None) -> Dict[str, Any]:
                 description="Number of MCP tool errors",
                 unit="1"
             )
-            active_sessions = meter.create_up_down_counter(
+            command_cache_hits = meter.create_counter(
+                name="mcp.command_cache.hits",
+                description="Number of execute_command results served from the cache",
+                unit="1"
+            )
+            command_cache_misses = meter.create_counter(
+                name="mcp.command_cache.misses",
+                description="Number of cacheable execute_command calls that missed the cache",
+                unit="1"
+            )
+            scheduler_queue_depth = meter.create_up_down_counter(
+                name="mcp.scheduler.queue_depth",
+                description="Number of commands waiting for admission by the scheduler",
+                unit="1"
+            )
+            scheduler_wait_time = meter.create_histogram(
+                name="mcp.scheduler.wait_time",
+                description="Time commands spent queued before admission",
+                unit="s"
+            )
+            active_sessions_counter = meter.create_up_down_counter(
                 name="mcp.sessions.active",
                 description="Number of active MCP sessions",
                 unit="1"
             )
+            active_sessions_counter.add(len(active_sessions))
             memory_usage = meter.create_observable_gauge(
                 name="mcp.system.memory_usage",
                 description="Memory usage of the MCP server",
@@ -436,15 +575,12 @@ def is_command_safe(cmd: str) -> bool:
     """Check if a command is safe to execute"""
     if not cmd.strip():
         return False
-    for blocked in blacklisted_commands:
-        if blocked in cmd:
-            return False
-    return True
+    return command_policy.check(cmd) is None
 
 # Terminal Tools
 
-def execute_command(command: str, timeout: int = 10, allow_background: bool = True) -> dict:
-    """Execute a command with timeout and output capture."""
+def _validate_command(command: str) -> Optional[Dict[str, Any]]:
+    """Return an error response if a command must not be run, else None."""
     if not command or not isinstance(command, str):
         return {
             "status": "error",
@@ -464,134 +600,789 @@ def execute_command(command: str, timeout: int = 10, allow_background: bool = Tr
             "stdout": "",
             "stderr": "Command was blocked for security reasons"
         }
+    return None
+
+def _register_session(pid: int, session: Session) -> None:
+    replaced = active_sessions.add(pid, session)
+    if replaced is None:
+        active_sessions_counter.add(1)
+    elif replaced is not session:
+        # The pid was reused while its previous session was kept for late readers
+        _release_session(replaced)
+        replaced.notifier.notify()
+    _ensure_session_reaper()
+
+def _remove_session(pid: int, session: Session = None) -> bool:
+    """Unregister a pid's session (only if it is still session, when given)."""
+    if not active_sessions.remove(pid, session):
+        return False
+    active_sessions_counter.add(-1)
+    return True
+
+def _new_session(process, command: str) -> Session:
+    notifier = ChangeNotifier()
+    return Session(
+        process,
+        command,
+        notifier,
+        OutputBuffer(output_memory_cap, on_change=notifier.notify),
+        OutputBuffer(output_memory_cap, on_change=notifier.notify)
+    )
+
+def _read_streams(session: Session, full: bool = False, since: Dict[str, int] = None,
+                  max_bytes: int = None, encoding: str = "text",
+                  lines: bool = True, projection: OutputProjection = None) -> Dict[str, Any]:
+    """Read stdout and stderr of a session.
+    
+    Without a cursor the session's default reader is advanced (all history
+    with full). With since, output is read from the given byte offsets and
+    nothing is consumed, so any number of readers can follow the session.
+    With encoding="base64" the raw bytes are returned undecoded. With a
+    projection, only the lines it keeps are read and returned (max_bytes is
+    then part of the projection).
+    
+    Returns:
+        Dictionary with stdout, stderr, the next cursor and (with lines) the
+        line number of each stream, whether output remains beyond the cursor
+        and, with a projection, what it dropped
+    """
+    binary = encoding == "base64"
+    result = {"cursor": {}, "lines": {}, "more": False}
+    dropped = {}
+    for name in ("stdout", "stderr"):
+        buf = getattr(session, f"{name}_buffer")
+        if projection is not None:
+            start = since.get(name, 0) if since is not None else 0 if full else buf.drained
+            data, cursor, dropped[name] = projection.apply(buf, start)
+            if since is None:
+                buf.consume(cursor)
+            output = data if binary else decode_output(data)
+        elif since is not None:
+            read = buf.read_bytes if binary else buf.read_text
+            output, cursor = read(since.get(name, 0), max_bytes)
+        elif binary:
+            output = buf.history_bytes() if full else buf.drain_bytes(max_bytes)
+            cursor = buf.drained
+        else:
+            output = buf.history() if full else buf.drain(max_bytes)
+            cursor = buf.drained
+        result[name] = base64.b64encode(output).decode("ascii") if binary else output
+        result["cursor"][name] = cursor
+        if lines:
+            result["lines"][name] = buf.line_at(cursor)
+        result["more"] = result["more"] or cursor < buf.size or not buf.closed
+    if projection is not None:
+        result["projection"] = projection_info(dropped)
+    return result
+
+def _release_session(session: Session) -> None:
+    _close_stdin(session)
+    session.stdout_buffer.release()
+    session.stderr_buffer.release()
+    if session.wall_timer:
+        session.wall_timer.cancel()
+    if session.cgroup and session.process.returncode is not None:
+        # Keep the figures before the cgroup's files disappear
+        _session_usage(session)
+        CgroupSubtree.remove(session.cgroup)
+    if session.journal_entry is not None and session.process.returncode is not None:
+        session_journal.remove(session.journal_entry)
+
+def _close_stdin(session: Session) -> None:
+    """Close a session's stdin pipe, signalling EOF to the command."""
+    with session.lock:
+        stdin, session.stdin = session.stdin, None
+    if stdin is not None:
+        try:
+            stdin.close()
+        except OSError:
+            pass
 
+def _session_usage(session: Session) -> Dict[str, Any]:
+    """Resource usage of an exited session's process, and any limit it hit.
+    
+    Returns an empty dictionary while the process is running.
+    """
+    if session.usage is not None:
+        return session.usage
+    process = session.process
+    if process.returncode is None:
+        return {}
+    
+    usage = {"rusage": rusage_dict(process.rusage) if process.rusage else None}
+    if isinstance(process, (PipelineProcess, JournaledProcess)):
+        usage["pipestatus"] = process.pipestatus
+    elif session.journal_entry is not None:
+        status = read_status(session.journal_entry["status"])
+        usage["pipestatus"] = status["pipestatus"] if status else None
+    if getattr(process, "lost", False):
+        # Reaped elsewhere, or killed before reporting: the exit code is unknown
+        usage["lost"] = True
+    limits = session.limits
+    exceeded = session.limit_exceeded
+    if session.cgroup:
+        usage["cgroup"] = CgroupSubtree.stats(session.cgroup)
+        if usage["cgroup"].get("oom_kills"):
+            exceeded = exceeded or "memory_bytes"
+    if "cpu_seconds" in limits and process.rusage:
+        # SIGXCPU comes only from RLIMIT_CPU; SIGKILL follows at the hard limit
+        cpu_time = process.rusage.ru_utime + process.rusage.ru_stime
+        if process.returncode == -signal.SIGXCPU or (
+                process.returncode == -signal.SIGKILL and cpu_time >= int(limits["cpu_seconds"])):
+            exceeded = exceeded or "cpu_seconds"
+    if exceeded:
+        usage["limit_exceeded"] = exceeded
+    session.usage = usage
+    return usage
+
+def _command_result(session: Session, status: str, pid: Optional[int],
+                    exit_code: Optional[int], complete: bool, runtime: float = None,
+                    error: str = None, encoding: str = "text",
+                    projection: OutputProjection = None) -> Dict[str, Any]:
+    """Build an execute_command response, draining the session's buffers."""
+    streams = _read_streams(session, encoding=encoding, lines=False, projection=projection)
+    result = {
+        "status": status,
+        "pid": pid,
+        "runtime": runtime if runtime is not None else time.time() - session.start_time,
+        "exit_code": exit_code,
+        "stdout": streams["stdout"],
+        "stderr": streams["stderr"],
+        "complete": complete,
+        "cursor": streams["cursor"],
+        "rusage": None
+    }
+    if encoding != "text":
+        result["encoding"] = encoding
+    if "projection" in streams:
+        result["projection"] = streams["projection"]
+    result.update(_session_usage(session))
+    if result.get("lost"):
+        result["exit_code"] = None
+        error = error or LOST_STATUS_ERROR
+    if result.get("limit_exceeded"):
+        error = error or f"Command exceeded its {result['limit_exceeded']} limit"
+    if complete:
+        _release_session(session)
+    if error:
+        result["error"] = error
+    return result
+
+def _cached_result(command: str, cache_ttl: float, cache_inputs: Optional[List[str]],
+                   limits: Optional[Dict[str, float]] = None) -> tuple:
+    """Look a command up in the result cache when caching was requested.
+    
+    Returns the cache key (None when not caching) and the cached result, if any.
+    """
+    if not cache_ttl or cache_ttl <= 0:
+        return None, None
     try:
-        # Split command into args while preserving quoted strings
-        args = shlex.split(command)
-        
-        # Create output queues
-        stdout_queue = queue.Queue()
-        stderr_queue = queue.Queue()
-        
-        # Start process
-        process = subprocess.Popen(
-            args,
+        stages = split_pipeline(command)
+        argv = stages[0] if len(stages) == 1 else [tuple(stage) for stage in stages]
+        key = command_cache.key(argv, os.getcwd(), os.environ, cache_inputs or [], limits)
+    except ValueError:
+        return None, None
+    result = command_cache.get(key)
+    if result is None:
+        command_cache_misses.add(1, {"tool": "execute_command"})
+        return key, None
+    command_cache_hits.add(1, {"tool": "execute_command"})
+    result["cached"] = True
+    return key, result
+
+def _store_result(key: Optional[tuple], result: Dict[str, Any], cache_ttl: float) -> None:
+    # Only results of commands that ran to completion are worth replaying; a
+    # command killed by a signal or a limit may well succeed next time
+    if (key is not None and result.get("complete") and result.get("exit_code") is not None
+            and result["exit_code"] >= 0 and not result.get("limit_exceeded")):
+        command_cache.put(key, result, cache_ttl)
+
+def execute_command(command: str, timeout: int = 10, allow_background: bool = True,
+                    cache_ttl: float = 0, cache_inputs: List[str] = None,
+                    limits: Dict[str, float] = None, client: str = None,
+                    priority: str = "interactive", encoding: str = "text",
+                    open_stdin: bool = False, tail: int = None, head: int = None,
+                    grep: str = None, max_bytes: int = None, durable: bool = False) -> dict:
+    """Execute a command with timeout and output capture.
+    
+    With cache_ttl, the result of a completed command is reused for identical
+    invocations (same argv, cwd, relevant environment and input file
+    fingerprints) for that many seconds. limits caps the command's
+    cpu_seconds, memory_bytes, open_files and wall_time.
+    
+    The command waits for admission by the scheduler as part of its timeout;
+    if it is still queued when the timeout ends it is returned as queued.
+    With encoding="base64", stdout and stderr are the raw bytes in base64.
+    With open_stdin, the command's stdin is a pipe fed by write_input;
+    otherwise it reads from /dev/null. tail, head, grep and max_bytes project
+    the output server-side (see OutputProjection). A durable command is
+    journaled and survives a server restart (see reattach_sessions).
+    """
+    error = (_validate_command(command) or _validate_pipeline(command)
+             or _validate_limits(limits) or _validate_encoding(encoding)
+             or _validate_durable(durable, open_stdin))
+    if error:
+        return error
+    try:
+        projection = OutputProjection.from_params(head, tail, grep, max_bytes)
+    except ValueError as e:
+        return _execution_error(str(e))
+    
+    # Cached results hold the full decoded text and never involve input
+    cacheable = encoding == "text" and not open_stdin and projection is None
+    cache_key, cached = _cached_result(command, cache_ttl if cacheable else 0, cache_inputs,
+                                       limits)
+    if cached is not None:
+        return cached
+    
+    try:
+        ticket = command_scheduler.submit(command, client or "default", priority)
+    except ValueError as e:
+        return _execution_error(str(e))
+    if not _wait_for_admission(ticket, timeout):
+        result = _leave_queue(ticket, allow_background, limits, open_stdin=open_stdin,
+                              durable=durable)
+        if result is not None:
+            return result
+    
+    remaining = max(0, timeout - ticket.wait_time)
+    result = _execute_command(command, remaining, allow_background, limits, ticket, encoding,
+                              open_stdin, projection, durable)
+    _store_result(cache_key, result, cache_ttl)
+    return result
+
+def _validate_pipeline(command: str) -> Optional[Dict[str, Any]]:
+    """Reject malformed pipelines and pipelines with a blocked stage."""
+    try:
+        stages = split_pipeline(command)
+    except ValueError as e:
+        return _execution_error(str(e))
+    if len(stages) > 1:
+        for stage in stages:
+            error = _validate_command(shlex.join(stage))
+            if error:
+                return error
+    return None
+
+def _validate_durable(durable: bool, open_stdin: bool) -> Optional[Dict[str, Any]]:
+    if durable and open_stdin:
+        # A restarted server could not write to the old stdin pipe
+        return _execution_error("durable commands cannot have open_stdin")
+    return None
+
+def _execution_error(error: str) -> Dict[str, Any]:
+    return {
+        "status": "error",
+        "error": error,
+        "pid": None,
+        "exit_code": 1,
+        "stdout": "",
+        "stderr": error
+    }
+
+def _validate_limits(limits: Optional[Dict[str, float]]) -> Optional[Dict[str, Any]]:
+    error = validate_limits(limits)
+    return _execution_error(error) if error else None
+
+def _validate_encoding(encoding: str) -> Optional[Dict[str, Any]]:
+    if encoding in OUTPUT_ENCODINGS:
+        return None
+    return _execution_error(
+        f"Unknown encoding '{encoding}' (expected one of {', '.join(OUTPUT_ENCODINGS)})"
+    )
+
+def _client_id(ctx: Optional[Context]) -> str:
+    """Scheduler queue for a request: the MCP client id, else its connection."""
+    if ctx is None:
+        return "default"
+    try:
+        return ctx.client_id or f"session-{id(ctx.session)}"
+    except ValueError:
+        # Called outside of a request
+        return "default"
+
+def _wait_for_admission(ticket: Ticket, timeout: float) -> bool:
+    """Wait up to timeout seconds for the scheduler to admit a command."""
+    deadline = time.time() + timeout
+    while True:
+        version = ticket.notifier.version
+        if ticket.admitted:
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        ticket.notifier.wait(version, remaining)
+
+async def _wait_for_admission_async(ticket: Ticket, timeout: float) -> bool:
+    """Event-loop friendly variant of _wait_for_admission.
+    
+    A cancelled wait (the client went away) gives up the ticket's place in the
+    queue, or its slot if it was admitted meanwhile, before re-raising.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            version = ticket.notifier.version
+            if ticket.admitted:
+                return True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            await ticket.notifier.wait_async(version, remaining)
+    except asyncio.CancelledError:
+        if not command_scheduler.cancel(ticket):
+            command_scheduler.release(ticket, "cancelled")
+        raise
+
+def _leave_queue(ticket: Ticket, allow_background: bool, limits: Optional[Dict[str, float]],
+                 spawn=None, open_stdin: bool = False,
+                 durable: bool = False) -> Optional[Dict[str, Any]]:
+    """Stop waiting for admission once the caller's timeout has passed.
+    
+    Background-capable commands stay queued and are started by the scheduler
+    when admitted; others are dropped from the queue. Returns None when the
+    command was admitted in the meantime and should run after all.
+    """
+    if allow_background:
+        start = partial(_start_queued, limits=limits, spawn=spawn, open_stdin=open_stdin,
+                        durable=durable)
+        if command_scheduler.detach(ticket, start):
+            return _queued_result(ticket)
+    elif command_scheduler.cancel(ticket):
+        result = _execution_error("Command timed out waiting for admission")
+        result["queue_wait"] = ticket.wait_time
+        return result
+    return None
+
+def _queued_result(ticket: Ticket) -> Dict[str, Any]:
+    return {
+        "status": "queued",
+        "ticket": ticket.id,
+        "position": command_scheduler.position(ticket),
+        "priority": ticket.priority,
+        "queue_wait": ticket.wait_time,
+        "pid": None,
+        "exit_code": None,
+        "stdout": "",
+        "stderr": "",
+        "complete": False
+    }
+
+def _start_queued(ticket: Ticket, limits: Optional[Dict[str, float]], spawn=None,
+                  open_stdin: bool = False, durable: bool = False) -> None:
+    """Start a command that was left queued, from the thread that admitted it."""
+    try:
+        _start_session(ticket.command, limits, ticket, spawn, open_stdin, durable)
+    except Exception as e:
+        ticket.error = str(e)
+
+def _command_cgroup(limits: Optional[Dict[str, float]]) -> Optional[str]:
+    """Create a cgroup for a limited command when a cgroup v2 sub-tree is writable."""
+    global cgroup_subtree, _cgroup_detected
+    if not limits:
+        return None
+    with session_lock:
+        if not _cgroup_detected:
+            cgroup_subtree = CgroupSubtree.detect()
+            _cgroup_detected = True
+    return cgroup_subtree.create(limits) if cgroup_subtree else None
+
+def _spawn(stages: List[List[str]], limits: Optional[Dict[str, float]], cgroup: Optional[str],
+           stdin=subprocess.DEVNULL) -> Union[AccountedProcess, PipelineProcess]:
+    procs_fd = CgroupSubtree.open_procs(cgroup) if cgroup else None
+    try:
+        if len(stages) > 1:
+            return start_pipeline(stages, preexec_limits(limits, procs_fd), stdin)
+        return AccountedProcess(subprocess.Popen(
+            stages[0],
+            stdin=stdin,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
+            bufsize=0,
+            start_new_session=True,
+            preexec_fn=preexec_limits(limits, procs_fd)
+        ))
+    except Exception:
+        if cgroup:
+            CgroupSubtree.remove(cgroup)
+        raise
+    finally:
+        if procs_fd is not None:
+            os.close(procs_fd)
+
+def _spawn_durable(entry: Dict[str, Any], stages: List[List[str]],
+                   limits: Optional[Dict[str, float]], cgroup: Optional[str]) -> AccountedProcess:
+    procs_fd = CgroupSubtree.open_procs(cgroup) if cgroup else None
+    try:
+        return AccountedProcess(start_durable(entry, stages, preexec_limits(limits, procs_fd)))
+    except Exception:
+        if cgroup:
+            CgroupSubtree.remove(cgroup)
+        session_journal.remove(entry)
+        raise
+    finally:
+        if procs_fd is not None:
+            os.close(procs_fd)
+
+def _start_session(command: str, limits: Optional[Dict[str, float]] = None,
+                   ticket: Optional[Ticket] = None, spawn=None,
+                   open_stdin: bool = False, durable: bool = False) -> Session:
+    """Spawn a command under its limits and register it as a session.
+    
+    Both pipes and the process exit are watched by the shared multiplexer
+    thread, which reaps the process with wait4 as soon as it exits. The
+    scheduler slot held by ticket is given back on exit.
+    
+    Args:
+        spawn: Called with limits instead of running command directly; returns
+            a process that reports its own exit (see server.forkserver)
+        open_stdin: Connect the command's stdin to a pipe for write_input
+        durable: Run the command under spool_runner with its output in
+            journaled spool files, so it can be reattached after a restart
+    """
+    scheduler = command_scheduler
+    cgroup = None
+    entry = None
+    try:
+        if spawn is not None:
+            process = spawn(limits)
+        elif durable:
+            stages = split_pipeline(command)
+            cgroup = _command_cgroup(limits)
+            entry = session_journal.create(command)
+            process = _spawn_durable(entry, stages, limits, cgroup)
+        else:
+            # Split into pipeline stages while preserving quoted strings
+            stages = split_pipeline(command)
+            cgroup = _command_cgroup(limits)
+            stdin = subprocess.PIPE if open_stdin else subprocess.DEVNULL
+            process = _spawn(stages, limits, cgroup, stdin)
+    except Exception:
+        if ticket is not None:
+            scheduler.release(ticket, "failed")
+        raise
+    if ticket is not None:
+        ticket.state = "running"
+    
+    session = _new_session(process, command)
+    session.limits = limits or {}
+    session.cgroup = cgroup
+    # Every command leads its own process group (pipelines share the first stage's)
+    session.pgid = process.pids[0] if isinstance(process, PipelineProcess) else process.pid
+    if process.stdin is not None:
+        os.set_blocking(process.stdin.fileno(), False)
+        session.stdin = process.stdin
+        session.stdin_lock = threading.Lock()
+    if entry is not None:
+        _journal_session(session, entry)
+    else:
+        session.output_closed = start_output_capture(
+            process, session.stdout_buffer, session.stderr_buffer
         )
-        
+    
+    def exited():
+        if ticket is not None:
+            scheduler.release(ticket)
+        session.notifier.notify()
+    
+    def on_exit():
+        process.poll()
+        session.notifier.notify()
+    
+    process.on_exit = exited
+    if isinstance(process, ForkedProcess):
+        # The forkserver reports the exit itself
+        session.exit_watched = True
+    else:
+        pids = process.pids if isinstance(process, PipelineProcess) else [process.pid]
+        session.exit_watched = all(
+            [output_multiplexer.watch_exit(pid, on_exit) for pid in pids]
+        )
+    if limits and "wall_time" in limits:
+        timer = threading.Timer(limits["wall_time"], _enforce_wall_time, (session,))
+        timer.daemon = True
+        timer.start()
+        session.wall_timer = timer
+    _register_session(process.pid, session)
+    if ticket is not None:
+        # Published only now, so queue_status never hands out a pid read_output
+        # does not know yet
+        ticket.pid = process.pid
+    return session
+
+def _journal_session(session: Session, entry: Dict[str, Any]) -> None:
+    """Record a durable session in the journal and follow its spool files."""
+    process = session.process
+    try:
+        entry["create_time"] = psutil.Process(process.pid).create_time()
+    except psutil.Error:
+        entry["create_time"] = None
+    entry["pid"] = process.pid
+    session_journal.record(entry)
+    session.journal_entry = entry
+    session.output_closed = spool_follower.follow(
+        [(entry["stdout"], session.stdout_buffer), (entry["stderr"], session.stderr_buffer)],
+        lambda: process.returncode is not None
+    )
+
+def reattach_sessions() -> Dict[str, Any]:
+    """Register the durable sessions a previous server left in the journal.
+    
+    Commands that are still running are followed through their spool files
+    and polled for their status file; commands that exited meanwhile are
+    registered too, so their output and exit code can still be read once.
+    
+    Returns:
+        Dictionary with the number of sessions reattached while running and
+        of those found already exited
+    """
+    reattached = exited = 0
+    for entry in session_journal.entries():
+        if "pid" not in entry or entry["pid"] in active_sessions:
+            continue
+        process = JournaledProcess(entry)
+        session = _new_session(process, entry["command"])
+        session.start_time = entry["start_time"]
+        session.pgid = process.pid
+        session.journal_entry = entry
+        process.on_exit = session.notifier.notify
+        try:
+            session.output_closed = spool_follower.follow(
+                [(entry["stdout"], session.stdout_buffer),
+                 (entry["stderr"], session.stderr_buffer)],
+                lambda process=process: process.poll() is not None
+            )
+        except OSError:
+            # The spool files are gone; nothing is left to read
+            session_journal.remove(entry)
+            continue
+        if process.poll() is None:
+            reattached += 1
+        else:
+            exited += 1
+        _register_session(process.pid, session)
+    _ensure_session_reaper()
+    return {"status": "success", "reattached": reattached, "exited": exited}
+
+def _enforce_wall_time(session: Session) -> None:
+    if session.process.poll() is None:
+        session.limit_exceeded = "wall_time"
+        signal_group(session.pgid, signal.SIGKILL)
+        session.process.kill()
+
+def _terminate_session(session: Session, grace: float = 1.0) -> Dict[str, int]:
+    """Terminate a session's whole process group and wait for its process to exit.
+    
+    Returns:
+        Counts of processes signalled, reaped and still remaining (see
+        server.procgroup.terminate_group)
+    """
+    if session.process.poll() is not None and not group_members(session.pgid):
+        # Once the leader is reaped its pgid may be reused by an unrelated group
+        return {"signalled": 0, "reaped": 0, "remaining": 0}
+    teardown = terminate_group(session.pgid, grace)
+    process = session.process
+    if not _wait_for_exit(session, 1):
+        # Left the group (or no group support): signal it directly
+        process.kill()
+        process.wait()
+    return teardown
+
+def _wait_for_exit(session: Session, timeout: float) -> bool:
+    """Wait up to timeout seconds for a session's process to exit."""
+    deadline = time.time() + timeout
+    while True:
+        version = session.notifier.version
+        if session.process.poll() is not None:
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        session.notifier.wait(version, _wait_slice(session, remaining))
+
+async def _wait_for_exit_async(session: Session, timeout: float) -> bool:
+    """Event-loop friendly variant of _wait_for_exit."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        version = session.notifier.version
+        if session.process.poll() is not None:
+            return True
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await session.notifier.wait_async(version, _wait_slice(session, remaining))
+
+def _execute_command(command: str, timeout: int, allow_background: bool,
+                     limits: Dict[str, float] = None, ticket: Ticket = None,
+                     encoding: str = "text", open_stdin: bool = False,
+                     projection: OutputProjection = None, durable: bool = False) -> dict:
+    try:
+        session = _start_session(command, limits, ticket, open_stdin=open_stdin,
+                                 durable=durable)
+        process = session.process
         pid = process.pid
         
-        # Create reader thread event for signaling
-        stop_event = threading.Event()
-        
-        def reader_thread():
-            """Thread to read process output."""
-            try:
-                while not stop_event.is_set():
-                    # Read with timeout to allow checking stop_event
-                    stdout_line = process.stdout.readline()
-                    if stdout_line:
-                        stdout_queue.put(stdout_line)
-                    
-                    stderr_line = process.stderr.readline()
-                    if stderr_line:
-                        stderr_queue.put(stderr_line)
-                    
-                    # Check if process has finished
-                    if process.poll() is not None:
-                        break
-                    
-                    time.sleep(0.1)  # Prevent busy waiting
-            except Exception as e:
-                stderr_queue.put(f"Error reading output: {str(e)}")
-            finally:
-                # Ensure remaining output is read
-                for line in process.stdout:
-                    stdout_queue.put(line)
-                for line in process.stderr:
-                    stderr_queue.put(line)
-        
-        # Start reader thread
-        reader = threading.Thread(target=reader_thread)
-        reader.daemon = True
-        reader.start()
-        
-        # Store session info
-        with session_lock:
-            active_sessions[pid] = {
-                "process": process,
-                "command": command,
-                "start_time": time.time(),
-                "stdout_queue": stdout_queue,
-                "stderr_queue": stderr_queue,
-                "reader_thread": reader,
-                "stop_event": stop_event
-            }
-            update_active_sessions_metric()
-        
         # Wait for timeout
-        try:
-            process.wait(timeout=timeout)
-        except subprocess.TimeoutExpired:
+        if not _wait_for_exit(session, timeout):
             if not allow_background:
-                # Clean up if background not allowed
-                stop_event.set()
-                process.terminate()
-                try:
-                    process.wait(timeout=1)
-                except subprocess.TimeoutExpired:
-                    process.kill()
+                # Clean up the whole process tree if background not allowed
+                teardown = _terminate_session(session)
+                finish_output_capture(session)
+                _remove_session(pid)
                 
-                with session_lock:
-                    if pid in active_sessions:
-                        del active_sessions[pid]
-                        update_active_sessions_metric()
-                
-                return {
-                    "status": "error",
-                    "error": "Command timed out",
-                    "pid": None,
-                    "runtime": timeout,
-                    "exit_code": None,
-                    "stdout": "".join(read_queue_contents(stdout_queue)),
-                    "stderr": "".join(read_queue_contents(stderr_queue))
-                }
+                result = _command_result(session, "error", None, None, True, runtime=timeout,
+                                         error="Command timed out", encoding=encoding,
+                                         projection=projection)
+                result["reaped"] = teardown["reaped"]
+                return result
+            
+            # Process is running in background
+            return _command_result(session, "running", pid, None, False, encoding=encoding,
+                                   projection=projection)
         
         # Process completed within timeout
-        if process.returncode is not None:
-            stop_event.set()
-            reader.join(timeout=1)
-            
-            with session_lock:
-                if pid in active_sessions:
-                    del active_sessions[pid]
-                    update_active_sessions_metric()
-            
-            return {
-                "status": "success" if process.returncode == 0 else "error",
-                "pid": None,
-                "runtime": time.time() - active_sessions[pid]["start_time"],
-                "exit_code": process.returncode,
-                "stdout": "".join(read_queue_contents(stdout_queue)),
-                "stderr": "".join(read_queue_contents(stderr_queue)),
-                "complete": True
-            }
+        finish_output_capture(session)
+        _remove_session(pid)
         
-        # Process is running in background
+        return _command_result(
+            session, "success" if process.returncode == 0 else "error",
+            None, process.returncode, True, encoding=encoding, projection=projection
+        )
+    
+    except Exception as e:
         return {
-            "status": "running",
-            "pid": pid,
-            "runtime": time.time() - active_sessions[pid]["start_time"],
-            "exit_code": None,
-            "stdout": "".join(read_queue_contents(stdout_queue)),
-            "stderr": "".join(read_queue_contents(stderr_queue)),
-            "complete": False
+            "status": "error",
+            "error": str(e),
+            "pid": None,
+            "exit_code": 1,
+            "stdout": "",
+            "stderr": str(e)
         }
+
+@mcp.tool(name="execute_command")
+async def execute_command_async(command: str, timeout: int = 10, allow_background: bool = True,
+                                cache_ttl: float = 0, cache_inputs: List[str] = None,
+                                limits: Dict[str, float] = None, client: str = None,
+                                priority: str = "interactive", encoding: str = "text",
+                                open_stdin: bool = False, tail: int = None, head: int = None,
+                                grep: str = None, max_bytes: int = None,
+                                durable: bool = False, ctx: Context = None) -> Dict[str, Any]:
+    """
+    Execute a command with timeout and output capture without blocking the server
+    
+    Waiting for the command costs a coroutine rather than a worker thread, so many
+    slow commands can be in flight at once.
+    
+    Args:
+        command: Command line to execute (no shell); stages separated by an
+            unquoted "|" run as a pipeline connected by OS pipes, and only the
+            last stage's stdout (plus every stage's stderr) is captured
+        timeout: Seconds to wait before returning or backgrounding the command
+        allow_background: Keep the command running after the timeout
+        cache_ttl: Reuse the result of an identical completed invocation for
+            this many seconds (0 disables caching)
+        cache_inputs: Paths the command reads; their mtime and size are part
+            of the cache key
+        limits: Resource limits for the command: cpu_seconds, memory_bytes
+            (address space, and the cgroup memory cap when cgroups are
+            available), open_files and wall_time (seconds before it is killed,
+            even in the background)
+        client: Scheduler queue to wait in (defaults to the MCP client id or
+            connection); clients with waiting commands take turns
+        priority: Scheduler priority class, "interactive" or "batch"
+        encoding: "text" to decode output as UTF-8 (invalid bytes replaced), or
+            "base64" for the raw bytes of binary output
+        open_stdin: Give the command a stdin pipe that write_input feeds
+            (for REPLs and prompts); otherwise stdin is /dev/null
+        tail: Return only the last this many lines of each stream
+        head: Return only the first this many lines of each stream (with
+            tail, both ends are returned and the middle dropped)
+        grep: Return only lines matching this regular expression (applied
+            before head and tail), e.g. "error|warning"
+        max_bytes: Maximum bytes returned per stream, dropping whole lines
+        durable: Journal the command and spool its output to files, so it keeps
+            running and can be read again after the server restarts
+            (incompatible with open_stdin)
+    
+    Returns:
+        Dictionary with status, pid, exit code, stdout, stderr, completion flag
+        and, once the command has exited, its rusage. A command still waiting
+        for a slot when the timeout ends has status "queued", a ticket for
+        queue_status and its queue position. With tail, head, grep or
+        max_bytes, "projection" reports the lines and bytes dropped.
+    """
+    error = (_validate_command(command) or _validate_pipeline(command)
+             or _validate_limits(limits) or _validate_encoding(encoding)
+             or _validate_durable(durable, open_stdin))
+    if error:
+        return error
+    try:
+        projection = OutputProjection.from_params(head, tail, grep, max_bytes)
+    except ValueError as e:
+        return _execution_error(str(e))
+    
+    cacheable = encoding == "text" and not open_stdin and projection is None
+    cache_key, cached = _cached_result(command, cache_ttl if cacheable else 0, cache_inputs,
+                                       limits)
+    if cached is not None:
+        return cached
+    
+    try:
+        ticket = command_scheduler.submit(command, client or _client_id(ctx), priority)
+    except ValueError as e:
+        return _execution_error(str(e))
+    if not await _wait_for_admission_async(ticket, timeout):
+        result = _leave_queue(ticket, allow_background, limits, open_stdin=open_stdin,
+                              durable=durable)
+        if result is not None:
+            return result
+    
+    remaining = max(0, timeout - ticket.wait_time)
+    result = await _execute_command_async(command, remaining, allow_background, limits, ticket,
+                                          encoding=encoding, open_stdin=open_stdin,
+                                          projection=projection, durable=durable)
+    _store_result(cache_key, result, cache_ttl)
+    return result
+
+async def _execute_command_async(command: str, timeout: int, allow_background: bool,
+                                 limits: Dict[str, float] = None,
+                                 ticket: Ticket = None, spawn=None,
+                                 encoding: str = "text",
+                                 open_stdin: bool = False,
+                                 projection: OutputProjection = None,
+                                 durable: bool = False) -> Dict[str, Any]:
+    try:
+        # Spawning can block (forkserver start-up and replies), so keep it off the loop
+        session = await asyncio.to_thread(_start_session, command, limits, ticket, spawn,
+                                          open_stdin, durable)
+        process = session.process
+        pid = process.pid
         
+        if not await _wait_for_exit_async(session, timeout):
+            if not allow_background:
+                teardown = await asyncio.to_thread(_terminate_session, session)
+                await finish_output_capture_async(session)
+                _remove_session(pid)
+                
+                result = _command_result(session, "error", None, None, True, runtime=timeout,
+                                         error="Command timed out", encoding=encoding,
+                                         projection=projection)
+                result["reaped"] = teardown["reaped"]
+                return result
+            
+            return _command_result(session, "running", pid, None, False, encoding=encoding,
+                                   projection=projection)
+        
+        await finish_output_capture_async(session)
+        _remove_session(pid)
+        
+        return _command_result(
+            session, "success" if process.returncode == 0 else "error",
+            None, process.returncode, True, encoding=encoding, projection=projection
+        )
+    
     except Exception as e:
         return {
             "status": "error",
@@ -602,80 +1393,924 @@ def execute_command(command: str, timeout: int = 10, allow_background: bool = Tr
             "stderr": str(e)
         }
 
-def read_queue_contents(q: queue.Queue) -> List[str]:
-    """Read all available content from a queue without blocking."""
-    contents = []
+@mcp.tool()
+async def execute_commands(commands: List[str], max_parallel: int = 8, timeout: int = 10,
+                           allow_background: bool = False, cache_ttl: float = 0,
+                           limits: Dict[str, float] = None, client: str = None,
+                           priority: str = "batch", ctx: Context = None) -> Dict[str, Any]:
+    """
+    Execute several independent commands concurrently in one request
+    
+    Args:
+        commands: Command lines to execute
+        max_parallel: Maximum number of commands running at the same time
+        timeout: Per-command timeout in seconds
+        allow_background: Keep commands that outlive the timeout running
+        cache_ttl: Reuse results of identical completed commands for this many seconds
+        limits: Resource limits applied to each command (see execute_command)
+        client: Scheduler queue the commands wait in
+        priority: Scheduler priority class, "interactive" or "batch"
+    
+    Returns:
+        Dictionary with per-command results (in input order), aggregate wall
+        time and counts of commands that succeeded, failed and are still
+        pending (backgrounded or queued)
+    """
+    if not commands:
+        return {
+            'status': 'error',
+            'error': 'No commands provided'
+        }
+    
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+    client = client or _client_id(ctx)
+    
+    async def run(command: str) -> Dict[str, Any]:
+        async with semaphore:
+            start_time = time.time()
+            result = await execute_command_async(command, timeout, allow_background, cache_ttl,
+                                                 limits=limits, client=client, priority=priority)
+            result.setdefault("runtime", time.time() - start_time)
+            result["command"] = command
+            return result
+    
+    start_time = time.time()
+    results = await asyncio.gather(*(run(command) for command in commands))
+    # Backgrounded or still queued commands have not succeeded yet
+    pending = sum(1 for result in results if result["status"] in ("running", "queued"))
+    succeeded = sum(1 for result in results
+                    if result.get("complete") and result.get("exit_code") == 0)
+    failed = len(results) - succeeded - pending
+    
+    if failed:
+        status = 'error'
+    else:
+        status = 'running' if pending else 'success'
+    return {
+        'status': status,
+        'results': results,
+        'wall_time': time.time() - start_time,
+        'total_runtime': sum(result["runtime"] for result in results),
+        'succeeded': succeeded,
+        'failed': failed,
+        'pending': pending
+    }
+
+@mcp.tool()
+async def run_python(code: str = None, script: str = None, module: str = None,
+                     args: List[str] = None, timeout: int = 10, allow_background: bool = True,
+                     limits: Dict[str, float] = None, client: str = None,
+                     priority: str = "interactive", ctx: Context = None) -> Dict[str, Any]:
+    """
+    Run Python code, a script or a module in a process forked from a warm interpreter
+    
+    The forkserver has already started an interpreter and imported the modules
+    listed in MCP_FORKSERVER_PRELOAD, so the command skips that startup cost.
+    
+    Args:
+        code: Source to run, like python -c
+        script: Path of a script to run, like python script.py
+        module: Module to run, like python -m
+        args: Arguments passed to the code, script or module in sys.argv
+        timeout: Seconds to wait before returning or backgrounding the command
+        allow_background: Keep the command running after the timeout
+        limits: cpu_seconds, memory_bytes, open_files and wall_time (see
+            execute_command; memory is capped by address space only)
+        client: Scheduler queue to wait in
+        priority: Scheduler priority class, "interactive" or "batch"
+    
+    Returns:
+        Dictionary shaped like execute_command's result plus timing: spawn_ms
+        (time to get a forked process), cold_start_ms (time the forkserver took
+        to start and preload) and saved_ms (their difference)
+    """
+    targets = [(kind, target) for kind, target in
+               (("code", code), ("script", script), ("module", module)) if target is not None]
+    if len(targets) != 1:
+        return _execution_error("Exactly one of code, script or module is required")
+    kind, target = targets[0]
+    args = [str(arg) for arg in args or []]
+    argv = [sys.executable] + {"code": ["-c"], "script": [], "module": ["-m"]}[kind] + [target] + args
+    command = shlex.join(argv)
+    error = _validate_command(command) or _validate_limits(limits)
+    if error:
+        return error
+    
+    timing = {}
+    
+    def spawn(limits):
+        timing["warm"] = python_forkserver.running
+        start_time = time.perf_counter()
+        process = python_forkserver.spawn(kind, target, args, os.getcwd(), dict(os.environ),
+                                          rlimit_settings(limits) if limits else None)
+        timing["spawn_ms"] = (time.perf_counter() - start_time) * 1000
+        return process
+    
+    try:
+        ticket = command_scheduler.submit(command, client or _client_id(ctx), priority)
+    except ValueError as e:
+        return _execution_error(str(e))
+    if not await _wait_for_admission_async(ticket, timeout):
+        result = _leave_queue(ticket, allow_background, limits, spawn)
+        if result is not None:
+            return result
+    
+    remaining = max(0, timeout - ticket.wait_time)
+    result = await _execute_command_async(command, remaining, allow_background, limits,
+                                          ticket, spawn)
+    if "spawn_ms" in timing:
+        if not timing["warm"]:
+            # This request started the forkserver and paid for it
+            timing["spawn_ms"] = max(0.0, timing["spawn_ms"] - python_forkserver.cold_start * 1000)
+        timing["cold_start_ms"] = python_forkserver.cold_start * 1000
+        timing["saved_ms"] = timing["cold_start_ms"] - timing["spawn_ms"]
+        result["timing"] = timing
+    return result
+
+def start_output_capture(process, stdout_buffer: OutputBuffer,
+                         stderr_buffer: OutputBuffer) -> threading.Event:
+    """Register a process's pipes with the output multiplexer.
+    
+    Returns an event that is set once both pipes have reached EOF.
+    """
+    output_closed = threading.Event()
+    remaining = [2]
+    remaining_lock = threading.Lock()
+    
+    def attach(stream, target: OutputBuffer):
+        def on_close():
+            target.close()
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    output_closed.set()
+        
+        output_multiplexer.register(stream, target.append, on_close)
+    
+    attach(process.stdout, stdout_buffer)
+    attach(process.stderr, stderr_buffer)
+    return output_closed
+
+def finish_output_capture(session: Session, timeout: float = 1.0) -> None:
+    """Wait for a finished process's output to drain, then release its pipes.
+    
+    Pipes inherited by a still-running grandchild may never reach EOF, so they
+    are dropped after the timeout.
+    """
+    if session.output_closed.wait(timeout) or session.journal_entry is not None:
+        # Spool files are closed by the follower once the command has exited
+        return
+    output_multiplexer.discard(session.process.stdout)
+    output_multiplexer.discard(session.process.stderr)
+
+async def finish_output_capture_async(session: Session, timeout: float = 1.0) -> None:
+    """Event-loop friendly variant of finish_output_capture."""
+    if not session.output_closed.is_set():
+        await asyncio.to_thread(finish_output_capture, session, timeout)
+
+def _lookup_session(pid: int) -> Optional[Session]:
+    return active_sessions.get(pid)
+
+def _missing_session_result(pid: int) -> Dict[str, Any]:
+    return {
+        "status": "error",
+        "error": f"No active session for PID {pid}",
+        "pid": None,
+        "stdout": "",
+        "stderr": f"No active session found for PID {pid}",
+        "complete": True
+    }
+
+def _session_output(pid: int, session: Session, returncode: Optional[int],
+                    full: bool = False, since: Dict[str, int] = None,
+                    max_bytes: int = None, encoding: str = "text",
+                    projection: OutputProjection = None,
+                    process_stats: bool = False) -> Dict[str, Any]:
+    """Read a session's buffers into a read_output response.
+    
+    A session is complete once its process has exited and the reader has seen
+    all of its output. The default reader then removes the session; cursor
+    readers leave it in place for others.
+    """
+    streams = _read_streams(session, full, since, max_bytes, encoding, projection=projection)
+    complete = returncode is not None and not streams["more"]
+    if complete and since is None:
+        _remove_session(pid)
+        _release_session(session)
+    
+    if returncode is None:
+        status = "running"
+    else:
+        status = "success" if returncode == 0 else "error"
+    
+    result = {
+        "status": status,
+        "pid": None if complete else pid,
+        "stdout": streams["stdout"],
+        "stderr": streams["stderr"],
+        "exit_code": returncode,
+        "complete": complete,
+        "cursor": streams["cursor"],
+        "lines": streams["lines"],
+        "rusage": None
+    }
+    if encoding != "text":
+        result["encoding"] = encoding
+    if "projection" in streams:
+        result["projection"] = streams["projection"]
+    if process_stats:
+        result["process_stats"] = _process_stats(session) if returncode is None else None
+    result.update(_session_usage(session))
+    if result.get("lost"):
+        result["exit_code"] = None
+        result["error"] = LOST_STATUS_ERROR
+    return result
+
+def _process_stats(session: Session) -> Dict[str, Any]:
+    """Snapshot of a running session's process tree, reusing its psutil handles."""
+    with session.lock:
+        if session.process_stats is None:
+            process = session.process
+            roots = process.pids if isinstance(process, PipelineProcess) else [process.pid]
+            session.process_stats = ProcessTreeStats(roots)
+    return session.process_stats.snapshot()
+
+def _read_output_error(e: Exception) -> Dict[str, Any]:
+    return {
+        "status": "error",
+        "error": str(e),
+        "pid": None,
+        "stdout": "",
+        "stderr": str(e),
+        "complete": True
+    }
+
+def _has_unread_output(session: Session, since: Dict[str, int] = None) -> bool:
+    for name in ("stdout", "stderr"):
+        buf = getattr(session, f"{name}_buffer")
+        cursor = buf.drained if since is None else since.get(name, 0)
+        if cursor < buf.size:
+            return True
+    return False
+
+def _wait_slice(session: Session, remaining: float) -> float:
+    # Without exit notifications, wake up now and then to poll the process
+    return remaining if session.exit_watched else min(remaining, EXIT_POLL_INTERVAL)
+
+def read_output(pid: int, full: bool = False, since: Dict[str, int] = None,
+                max_bytes: int = None, wait: float = 0, encoding: str = "text",
+                tail: int = None, head: int = None, grep: str = None,
+                process_stats: bool = False) -> Dict[str, Any]:
+    """Read output from a running command session.
+    
+    With full=True the whole history of the session is returned instead of
+    only the output produced since the previous read. Passing the cursor from
+    a previous response as since reads from there without consuming output.
+    With wait, block up to that many seconds until there is new output or the
+    process exits. With encoding="base64" the raw bytes are returned. tail,
+    head and grep project the output as in execute_command, with max_bytes
+    capping the projected output. With process_stats, a running session's
+    response includes a resource snapshot of its process tree.
+    """
+    if encoding not in OUTPUT_ENCODINGS:
+        return _read_output_error(ValueError(f"Unknown encoding '{encoding}'"))
+    try:
+        projection = _read_projection(tail, head, grep, max_bytes)
+        session = _lookup_session(pid)
+        if session is None:
+            return _missing_session_result(pid)
+        
+        deadline = time.time() + wait
+        while True:
+            version = session.notifier.version
+            if session.process.poll() is not None or _has_unread_output(session, since):
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            session.notifier.wait(version, _wait_slice(session, remaining))
+        
+        # Check if process has completed
+        returncode = session.process.poll()
+        if returncode is not None:
+            # Process finished, let the remaining output drain
+            finish_output_capture(session)
+        
+        return _session_output(pid, session, returncode, full, since, max_bytes, encoding,
+                               projection, process_stats)
+        
+    except Exception as e:
+        return _read_output_error(e)
+
+def _read_projection(tail: Optional[int], head: Optional[int], grep: Optional[str],
+                     max_bytes: Optional[int]) -> Optional[OutputProjection]:
+    # Alone, max_bytes pages through the output rather than dropping any
+    if tail is None and head is None and not grep:
+        return None
+    return OutputProjection(head, tail, grep, max_bytes)
+
+async def _wait_for_session_change(session: Session, since: Dict[str, int],
+                                   deadline: float) -> None:
+    """Wait until a session has unread output, has exited or the deadline passes."""
+    loop = asyncio.get_running_loop()
     while True:
+        version = session.notifier.version
+        if session.process.poll() is not None or _has_unread_output(session, since):
+            return
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        await session.notifier.wait_async(version, _wait_slice(session, remaining))
+
+async def _stream_session_output(pid: int, session: Session, since: Dict[str, int],
+                                 max_bytes: int, deadline: float, ctx: Context) -> Dict[str, Any]:
+    """Push a session's output to the client until it completes or the deadline passes.
+    
+    Each chunk is sent as a log notification (logger session.<pid>.<stream>)
+    followed by a progress notification carrying the characters sent so far.
+    """
+    loop = asyncio.get_running_loop()
+    streamed = {"stdout": 0, "stderr": 0}
+    while True:
+        returncode = session.process.poll()
+        if returncode is not None:
+            await finish_output_capture_async(session)
+        
+        result = _session_output(pid, session, returncode, since=since, max_bytes=max_bytes)
+        sent = False
+        for name in ("stdout", "stderr"):
+            if result[name]:
+                await ctx.log("info", result[name], logger_name=f"session.{pid}.{name}")
+                streamed[name] += len(result[name])
+                result[name] = ""
+                sent = True
+        if sent:
+            await ctx.report_progress(streamed["stdout"] + streamed["stderr"])
+        if since is not None:
+            since = result["cursor"]
+        
+        if result["complete"] or loop.time() >= deadline:
+            result["streamed"] = streamed
+            return result
+        await _wait_for_session_change(session, since, deadline)
+
+@mcp.tool(name="read_output")
+async def read_output_async(pid: int, full: bool = False, since: Dict[str, int] = None,
+                            max_bytes: int = None, wait: float = 0, stream: bool = False,
+                            encoding: str = "text", tail: int = None, head: int = None,
+                            grep: str = None, process_stats: bool = False,
+                            ctx: Context = None) -> Dict[str, Any]:
+    """
+    Read output from a running command session
+    
+    Args:
+        pid: Process ID returned by execute_command
+        full: Return the whole output history instead of only new output
+        since: Cursor ({"stdout": offset, "stderr": offset}) from a previous
+            response; output is read from there and not consumed, so several
+            clients can follow the same session and retries are lossless
+        max_bytes: Maximum bytes returned per stream, cut at a line boundary
+        wait: Seconds to wait for new output or process exit before returning
+        stream: Push output as log and progress notifications until the
+            process completes or wait expires, instead of returning it
+        encoding: "text", or "base64" for the raw bytes (max_bytes then cuts
+            at exactly that many bytes rather than at a line boundary)
+        tail: Return only the last this many lines of each stream
+        head: Return only the first this many lines of each stream
+        grep: Return only lines matching this regular expression; with tail,
+            head or grep, max_bytes caps the returned output and the rest of
+            the read range is dropped rather than left for the next read
+        process_stats: Include a snapshot of the running process tree: CPU
+            percent since the previous snapshot, RSS, threads, open fds and
+            I/O counters, summed over its processes
+    
+    Returns:
+        Dictionary with status, stdout/stderr, exit code, completion flag, the
+        next cursor and the line number at that cursor, with tail, head or
+        grep the lines and bytes dropped ("projection"), and with
+        process_stats the snapshot (None once the process has exited)
+    """
+    if encoding not in OUTPUT_ENCODINGS:
+        return _read_output_error(ValueError(f"Unknown encoding '{encoding}'"))
+    try:
+        projection = _read_projection(tail, head, grep, max_bytes)
+        session = _lookup_session(pid)
+        if session is None:
+            return _missing_session_result(pid)
+        
+        deadline = asyncio.get_running_loop().time() + wait
+        if stream and ctx is not None:
+            return await _stream_session_output(pid, session, since, max_bytes, deadline, ctx)
+        
+        await _wait_for_session_change(session, since, deadline)
+        returncode = session.process.poll()
+        if returncode is not None:
+            await finish_output_capture_async(session)
+        
+        return _session_output(pid, session, returncode, full, since, max_bytes, encoding,
+                               projection, process_stats)
+        
+    except Exception as e:
+        return _read_output_error(e)
+
+@mcp.tool()
+async def write_input(pid: int, data: str = "", eof: bool = False, encoding: str = "text",
+                      timeout: float = 5) -> Dict[str, Any]:
+    """
+    Write to the stdin of a session started with open_stdin
+    
+    Writes never block the server: when the pipe is full the call waits up to
+    timeout seconds for the command to read, then reports what was written.
+    
+    Args:
+        pid: Process ID returned by execute_command
+        data: Input to send (include a trailing newline for line-based prompts)
+        eof: Close stdin after the data has been written
+        encoding: "text" (sent as UTF-8) or "base64" for raw bytes
+        timeout: Seconds to wait for room in the pipe
+    
+    Returns:
+        Dictionary with status, bytes written, bytes still pending and whether
+        stdin is still open
+    """
+    if encoding not in OUTPUT_ENCODINGS:
+        return {'status': 'error', 'error': f"Unknown encoding '{encoding}'"}
+    try:
+        payload = base64.b64decode(data, validate=True) if encoding == "base64" else data.encode()
+    except ValueError as e:
+        return {'status': 'error', 'error': f"Invalid base64 data: {e}"}
+    
+    session = _lookup_session(pid)
+    if session is None:
+        return {'status': 'error', 'error': f"No active session for PID {pid}"}
+    if session.stdin is None:
+        return {'status': 'error', 'error': f"Session {pid} has no open stdin"}
+    if not session.stdin_lock.acquire(blocking=False):
+        return {'status': 'error', 'error': f"Another write to session {pid} is in progress"}
+    try:
+        written = await _write_stdin(session, payload, timeout)
+    except OSError as e:
+        # EPIPE: the command exited or closed its end
+        _close_stdin(session)
+        return {'status': 'error', 'error': f"Cannot write to session {pid}: {e}",
+                'stdin_open': False}
+    finally:
+        session.stdin_lock.release()
+    
+    pending = len(payload) - written
+    if eof and not pending:
+        _close_stdin(session)
+    result = {
+        'status': 'success' if not pending else 'error',
+        'bytes_written': written,
+        'pending': pending,
+        'stdin_open': session.stdin is not None
+    }
+    if pending:
+        result['error'] = "Timed out waiting for the command to read its input"
+    return result
+
+@mcp.tool()
+async def force_terminate(pid: int, grace: float = 1.0) -> Dict[str, Any]:
+    """
+    Terminate a command session together with every process it started
+    
+    The session's process group gets SIGTERM, and SIGKILL after grace seconds
+    if anything survives. The session's output stays readable with read_output.
+    
+    Args:
+        pid: Process ID returned by execute_command
+        grace: Seconds between SIGTERM and SIGKILL
+    
+    Returns:
+        Dictionary with status, the exit code and how many processes were
+        signalled, reaped and are still remaining
+    """
+    session = _lookup_session(pid)
+    if session is None:
+        return {'status': 'error', 'error': f"No active session for PID {pid}"}
+    try:
+        teardown = await asyncio.to_thread(_terminate_session, session, grace)
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+    return {
+        'status': 'success',
+        'pid': pid,
+        'exit_code': None if getattr(session.process, "lost", False) else session.process.returncode,
+        **teardown
+    }
+
+async def _write_stdin(session: Session, payload: bytes, timeout: float) -> int:
+    """Write with non-blocking writes, awaiting writability when the pipe is full."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    stdin = session.stdin
+    view = memoryview(payload)
+    written = 0
+    while written < len(view):
+        if session.stdin is not stdin:
+            raise BrokenPipeError("stdin was closed")
+        try:
+            written += os.write(stdin.fileno(), view[written:])
+            continue
+        except BlockingIOError:
+            pass
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        ready = loop.create_future()
+        loop.add_writer(stdin.fileno(), lambda: ready.done() or ready.set_result(None))
         try:
-            contents.append(q.get_nowait())
-        except queue.Empty:
+            await asyncio.wait_for(ready, remaining)
+        except asyncio.TimeoutError:
             break
-    return contents
+        finally:
+            loop.remove_writer(stdin.fileno())
+    return written
 
 @mcp.tool()
-def read_output(pid: int) -> Dict[str, Any]:
-    """Read output from a running command session."""
+async def open_shell(cwd: str = None, env: Dict[str, str] = None, shell: str = None) -> Dict[str, Any]:
+    """
+    Start a persistent shell on a pseudo-terminal
+    
+    Working directory, exported variables and functions carry over between
+    shell_exec calls, and each call skips process startup.
+    
+    Args:
+        cwd: Initial working directory
+        env: Extra environment variables
+        shell: Shell executable (defaults to bash, else /bin/sh)
+    
+    Returns:
+        Dictionary with the shell_id to pass to shell_exec and close_shell
+    """
     try:
+        shell_session = PtyShell(output_multiplexer, output_memory_cap, shell, cwd, env)
+        # Flush anything the shell prints on startup
+        ready = await shell_session.run("true", timeout=5)
+        if ready["exit_code"] != 0:
+            shell_session.close()
+            return {
+                'status': 'error',
+                'error': ready.get('error', 'Shell failed to start'),
+                'output': ready['output']
+            }
         with session_lock:
-            if pid not in active_sessions:
-                return {
-                    "status": "error",
-                    "error": f"No active session for PID {pid}",
-                    "pid": None,
-                    "stdout": "",
-                    "stderr": f"No active session found for PID {pid}",
-                    "complete": True
-                }
-            
-            session = active_sessions[pid]
-            process = session["process"]
-            stdout_queue = session["stdout_queue"]
-            stderr_queue = session["stderr_queue"]
+            shell_sessions[shell_session.pid] = shell_session
+        _ensure_session_reaper()
+        return {
+            'status': 'success',
+            'shell_id': shell_session.pid,
+            'cwd': shell_session.cwd
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'error': str(e)
+        }
+
+@mcp.tool()
+async def shell_exec(shell_id: int, command: str, timeout: float = 10) -> Dict[str, Any]:
+    """
+    Run a command line in a persistent shell
+    
+    Args:
+        shell_id: Shell returned by open_shell
+        command: Command line, interpreted by the shell
+        timeout: Seconds before the command is interrupted with Ctrl-C
+    
+    Returns:
+        Dictionary with status, exit code, output (stdout and stderr
+        interleaved, as on a terminal) and the shell's working directory
+    """
+    error = _validate_command(command)
+    if error:
+        return error
+    
+    with session_lock:
+        shell_session = shell_sessions.get(shell_id)
+    if shell_session is None:
+        return {
+            'status': 'error',
+            'error': f"No open shell with id {shell_id}"
+        }
+    try:
+        return await shell_session.run(command, timeout)
+    except ShellBusyError as e:
+        return {
+            'status': 'error',
+            'error': str(e),
+            'shell_id': shell_id
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'error': str(e)
+        }
+
+@mcp.tool()
+def close_shell(shell_id: int) -> Dict[str, Any]:
+    """
+    Close a persistent shell and the processes started from it
+    
+    Args:
+        shell_id: Shell returned by open_shell
+    
+    Returns:
+        Dictionary with the shell's exit code and command count
+    """
+    with session_lock:
+        shell_session = shell_sessions.pop(shell_id, None)
+    if shell_session is None:
+        return {
+            'status': 'error',
+            'error': f"No open shell with id {shell_id}"
+        }
+    try:
+        return {
+            'status': 'success',
+            'shell_id': shell_id,
+            'exit_code': shell_session.close(),
+            'commands': shell_session.commands
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'error': str(e)
+        }
+
+def _reap_shells(now: float) -> int:
+    """Close shells that exited or sat idle past SHELL_IDLE_TIMEOUT."""
+    with session_lock:
+        expired = [
+            shell_id for shell_id, shell_session in shell_sessions.items()
+            if not shell_session.alive or now - shell_session.last_used >= SHELL_IDLE_TIMEOUT
+        ]
+        closing = [shell_sessions.pop(shell_id) for shell_id in expired]
+    for shell_session in closing:
+        shell_session.close(timeout=0.1)
+    return len(closing)
+
+def reap_sessions() -> Dict[str, Any]:
+    """Collect exited sessions and evict those past the grace period.
+    
+    Exited sessions keep their output for SESSION_GRACE_PERIOD seconds so
+    late readers can still fetch it, then the session and its buffers are
+    dropped.
+    
+    Returns:
+        Dictionary with the sessions and bytes reclaimed by this sweep
+    """
+    now = time.time()
+    sessions = active_sessions.items()
+    
+    expired = []
+    for pid, session in sessions:
+        if session.exit_time is None:
+            if session.process.poll() is not None:
+                session.exit_time = now
+                # Reaped behind our back, so its exit status and rusage are lost
+                session.orphaned = session.process.lost
+            continue
+        if not session.output_closed.is_set():
+            # A grandchild may hold the pipes open; stop waiting for EOF
+            finish_output_capture(session, timeout=0)
+        if now - session.exit_time >= SESSION_GRACE_PERIOD:
+            expired.append((pid, session))
+    
+    sweep = {'evicted': 0, 'orphaned': 0, 'reclaimed_memory_bytes': 0, 'reclaimed_spill_bytes': 0,
+             'shells_closed': _reap_shells(now), 'git_readers_closed': git_readers.evict_idle(),
+             'git_status_evicted': git_status_cache.evict_idle()}
+    for pid, session in expired:
+        if not _remove_session(pid, session):
+            continue
         
-        # Read available output
-        stdout = "".join(read_queue_contents(stdout_queue))
-        stderr = "".join(read_queue_contents(stderr_queue))
+        if session.orphaned:
+            sweep['orphaned'] += 1
+        for name in ("stdout_buffer", "stderr_buffer"):
+            sweep['reclaimed_memory_bytes'] += getattr(session, name).memory_bytes
+            sweep['reclaimed_spill_bytes'] += getattr(session, name).spilled
+        _release_session(session)
+        sweep['evicted'] += 1
+    
+    with session_lock:
+        for key, value in sweep.items():
+            reaper_stats[key] += value
+        reaper_stats['sweeps'] += 1
+        reaper_stats['last_sweep'] = now
+    return sweep
+
+def _session_reaper_loop() -> None:
+    while True:
+        time.sleep(SESSION_REAP_INTERVAL)
+        try:
+            reap_sessions()
+        except Exception as e:
+            print(f"Error reaping sessions: {e}")
+
+def _ensure_session_reaper() -> None:
+    global _session_reaper
+    # Checked without the lock first: this runs for every new session
+    if _session_reaper is not None and _session_reaper.is_alive():
+        return
+    with session_lock:
+        if _session_reaper is None or not _session_reaper.is_alive():
+            _session_reaper = threading.Thread(
+                target=_session_reaper_loop, name="mcp-session-reaper", daemon=True
+            )
+            _session_reaper.start()
+
+@mcp.tool()
+def session_stats() -> Dict[str, Any]:
+    """
+    Get command session counts and what the session reaper has reclaimed
+    
+    Returns:
+        Dictionary with running/exited session counts, buffered bytes and
+        cumulative reaper totals
+    """
+    try:
+        sessions = active_sessions.values()
+        with session_lock:
+            totals = dict(reaper_stats)
+            shells = len(shell_sessions)
         
-        # Check if process has completed
-        returncode = process.poll()
-        if returncode is not None:
-            # Process finished, clean up
-            session["stop_event"].set()
-            session["reader_thread"].join(timeout=1)
-            
-            with session_lock:
-                if pid in active_sessions:
-                    del active_sessions[pid]
-                    update_active_sessions_metric()
-            
+        exited = sum(1 for session in sessions if session.exit_time is not None)
+        return {
+            'status': 'success',
+            'sessions': {
+                'active': len(sessions),
+                'running': len(sessions) - exited,
+                'exited': exited
+            },
+            'shells': shells,
+            'forkserver': python_forkserver.stats(),
+            'git_readers': git_readers.stats(),
+            'git_status_cache': git_status_cache.stats(),
+            'buffered_memory_bytes': sum(
+                getattr(session, name).memory_bytes for session in sessions
+                for name in ("stdout_buffer", "stderr_buffer")
+            ),
+            'grace_period': SESSION_GRACE_PERIOD,
+            'reaper': totals
+        }
+    except Exception as e:
+        return {
+            'status': 'error',
+            'error': str(e)
+        }
+
+@mcp.tool()
+def queue_status(ticket: int = None) -> Dict[str, Any]:
+    """
+    Get the state of a queued command, or of the command scheduler
+    
+    Args:
+        ticket: Ticket returned with a "queued" execute_command result; omit
+            for scheduler-wide counts
+    
+    Returns:
+        Dictionary with the ticket's state, queue position and, once started,
+        the pid to pass to read_output; or the scheduler's budget and queue depths
+    """
+    try:
+        if ticket is None:
             return {
-                "status": "success" if returncode == 0 else "error",
-                "pid": None,
-                "stdout": stdout,
-                "stderr": stderr,
-                "exit_code": returncode,
-                "complete": True
+                'status': 'success',
+                'scheduler': command_scheduler.stats()
             }
         
-        # Process still running
+        entry = command_scheduler.get(ticket)
+        if entry is None:
+            return {
+                'status': 'error',
+                'error': f"No command with ticket {ticket}"
+            }
+        result = {
+            'status': 'success',
+            'ticket': entry.id,
+            'state': entry.state,
+            'command': entry.command,
+            'client': entry.client,
+            'priority': entry.priority,
+            'position': command_scheduler.position(entry),
+            'queue_wait': entry.wait_time,
+            'pid': entry.pid
+        }
+        if entry.error:
+            result['error'] = entry.error
+        return result
+    except Exception as e:
         return {
-            "status": "running",
-            "pid": pid,
-            "stdout": stdout,
-            "stderr": stderr,
-            "exit_code": None,
-            "complete": False
+            'status': 'error',
+            'error': str(e)
         }
-        
-    except Exception as e:
+
+@mcp.tool()
+def cancel_queued_command(ticket: int) -> Dict[str, Any]:
+    """
+    Remove a command from the scheduler queue before it starts
+    
+    Args:
+        ticket: Ticket returned with a "queued" execute_command result
+    
+    Returns:
+        Dictionary with the cancellation result
+    """
+    entry = command_scheduler.get(ticket)
+    if entry is None:
         return {
-            "status": "error",
-            "error": str(e),
-            "pid": None,
-            "stdout": "",
-            "stderr": str(e),
-            "complete": True
+            'status': 'error',
+            'error': f"No command with ticket {ticket}"
+        }
+    if not command_scheduler.cancel(entry):
+        return {
+            'status': 'error',
+            'error': f"Command with ticket {ticket} is already {entry.state}",
+            'pid': entry.pid
         }
+    return {
+        'status': 'success',
+        'ticket': ticket
+    }
+
+def _policy_update(changed: bool, rule: str, message: str) -> Dict[str, Any]:
+    return {
+        'status': 'success',
+        'success': True,
+        'changed': changed,
+        'rule': rule,
+        'message': message,
+        **command_policy.stats()
+    }
+
+def _validate_rule(rule: str, match: str) -> Optional[Dict[str, Any]]:
+    if not rule or not isinstance(rule, str) or not rule.strip():
+        return {'status': 'error', 'success': False, 'error': "Empty rule"}
+    if match not in MATCH_KINDS:
+        return {
+            'status': 'error',
+            'success': False,
+            'error': f"Unknown match kind '{match}' (expected one of {', '.join(MATCH_KINDS)})"
+        }
+    return None
+
+@mcp.tool()
+def block_command(command: str, match: str = "argv") -> Dict[str, Any]:
+    """
+    Add a deny rule to the command policy
+    
+    Argv rules are written like commands and block any command running that
+    program with at least the rule's flags and arguments, however they are
+    spelled: "rm -rf /" also blocks "/bin/rm -r -f //" and "sudo rm -fr /".
+    A trailing "*" on the program name matches any suffix ("mkfs*").
+    
+    Args:
+        command: The rule, e.g. "git push --force" or "shutdown"
+        match: "argv" (default), or "substring" to block any command
+              containing the text
+    
+    Returns:
+        Dictionary with status and the number of rules in the policy
+    """
+    error = _validate_rule(command, match)
+    if error:
+        return error
+    changed = command_policy.block(command, match)
+    return _policy_update(changed, command, "Rule added" if changed else "Rule already present")
+
+@mcp.tool()
+def allow_command(command: str, match: str = "argv") -> Dict[str, Any]:
+    """
+    Add an allow rule, exempting matching commands from the deny rules
+    
+    Args:
+        command: The rule, written like a block_command rule
+        match: "argv" (default) or "substring"
+    
+    Returns:
+        Dictionary with status and the number of rules in the policy
+    """
+    error = _validate_rule(command, match)
+    if error:
+        return error
+    changed = command_policy.allow(command, match)
+    return _policy_update(changed, command, "Rule added" if changed else "Rule already present")
+
+@mcp.tool()
+def unblock_command(command: str) -> Dict[str, Any]:
+    """
+    Remove a deny or allow rule from the command policy
+    
+    Args:
+        command: The rule exactly as it was added
+    
+    Returns:
+        Dictionary with status and the number of rules in the policy
+    """
+    if not command_policy.unblock(command):
+        return {'status': 'error', 'success': False, 'error': f"No rule '{command}'"}
+    return _policy_update(True, command, "Rule removed")
 
 @mcp.resource("debug://state")
 def debug_state() -> Dict[str, Any]:
@@ -848,9 +2483,20 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
     """
     Execute Git operations safely
     
+    log (without file) and show read objects through a long-lived git
+    cat-file process of the repository instead of starting git each time.
+    status is cached per repository until inotify reports a change to the
+    work tree or the git directory.
+    
     Args:
-        command: Git command to execute ('status', 'diff', 'log', 'branch', 'commit')
-        parameters: Additional parameters for the command
+        command: Git command to execute ('status', 'diff', 'log', 'show',
+            'branch', 'commit')
+        parameters: Additional parameters for the command; commit takes
+            message and files (any number of paths, staged by one git add);
+            log takes limit (commits per page, default 100), file and after
+            (the next_cursor of the previous page); show takes rev (default
+            HEAD), file (read the file as of rev) and encoding ("text" or
+            "base64")
     
     Returns:
         Dictionary with operation result
@@ -862,7 +2508,8 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
     allowed_commands = {
         'status': [],
         'diff': ['file', 'staged'],
-        'log': ['limit', 'file'],
+        'log': ['limit', 'file', 'after'],
+        'show': ['rev', 'file', 'encoding'],
         'branch': ['name', 'delete'],
         'commit': ['message', 'files']
     }
@@ -875,8 +2522,9 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
     
     try:
         if command == 'status':
-            result = subprocess.run(['git', 'status', '--porcelain'], 
-                                 capture_output=True, text=True, check=True)
+            # The reaper drops the watches of repositories left idle
+            _ensure_session_reaper()
+            output, cached = git_status_cache.status(os.getcwd())
             
             # Parse status output
             changes = {
@@ -885,7 +2533,7 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
                 'untracked': []
             }
             
-            for line in result.stdout.split('\n'):
+            for line in output.split('\n'):
                 if not line:
                     continue
                 status = line[:2]
@@ -900,7 +2548,8 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
                     
             return {
                 'status': 'success',
-                'changes': changes
+                'changes': changes,
+                'cached': cached
             }
             
         elif command == 'diff':
@@ -917,30 +2566,34 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
             }
             
         elif command == 'log':
-            cmd = ['git', 'log', '--pretty=format:%H|%an|%ad|%s']
-            if parameters.get('limit'):
-                cmd.append(f'-n{parameters["limit"]}')
+            limit = int(parameters.get('limit') or LOG_PAGE_SIZE)
+            if limit < 1:
+                return {'status': 'error', 'error': 'limit must be a positive integer'}
+            reader = _git_reader()
             if parameters.get('file'):
-                cmd.append(parameters['file'])
-                
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            
-            commits = []
-            for line in result.stdout.split('\n'):
-                if line:
-                    hash, author, date, message = line.split('|')
-                    commits.append({
-                        'hash': hash,
-                        'author': author,
-                        'date': date,
-                        'message': message
-                    })
-                    
+                # Path-limited history needs tree diffs, which git does best
+                head = reader.info('HEAD^{commit}')
+                if head is None:
+                    return {'status': 'error', 'error': 'Unknown revision: HEAD'}
+                commits, cursor = path_log(reader.repo, parameters['file'], limit,
+                                           parameters.get('after'), head.oid)
+            else:
+                commits, cursor = reader.log_page(limit, parameters.get('after'))
             return {
                 'status': 'success',
-                'commits': commits
+                'commits': [{
+                    'hash': commit['hash'],
+                    'author': commit['author'],
+                    'date': commit['date'],
+                    'message': commit['subject']
+                } for commit in commits],
+                'next_cursor': cursor
             }
             
+        elif command == 'show':
+            return _git_show(parameters.get('rev') or 'HEAD', parameters.get('file'),
+                             parameters.get('encoding', 'text'))
+            
         elif command == 'branch':
             if parameters.get('delete'):
                 if not parameters.get('name'):
@@ -962,18 +2615,26 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
                 return {'status': 'error', 'error': 'Commit message required'}
                 
             # Stage files if specified
-            if parameters.get('files'):
-                files = parameters['files'] if isinstance(parameters['files'], list) else [parameters['files']]
-                for file in files:
-                    subprocess.run(['git', 'add', file], check=True)
+            files = parameters.get('files') or []
+            if not isinstance(files, list):
+                files = [files]
+            started = time.perf_counter()
+            if files:
+                _git_stage(files)
+            staged = time.perf_counter()
             
-            # Create commit
-            result = subprocess.run(['git', 'commit', '-m', parameters['message']], 
+            # Create commit; the message goes through stdin like the paths
+            result = subprocess.run(['git', 'commit', '-F', '-'], input=parameters['message'],
                                  capture_output=True, text=True, check=True)
                                  
             return {
                 'status': 'success',
-                'message': result.stdout
+                'message': result.stdout,
+                'files_staged': len(files),
+                'timing': {
+                    'stage_seconds': staged - started,
+                    'commit_seconds': time.perf_counter() - staged
+                }
             }
             
     except subprocess.CalledProcessError as e:
@@ -987,6 +2648,49 @@ def git_operation(command: str, parameters: Dict[str, str] = None) -> Dict[str,
             'error': str(e)
         }
 
+def _git_stage(files: List[str]) -> None:
+    """Stage any number of pathspecs with a single git add.
+    
+    The pathspecs go NUL-separated through stdin rather than argv, so one
+    process and one index lock cycle cover the whole set and no argument
+    length limit applies.
+    """
+    subprocess.run(['git', 'add', '--pathspec-from-file=-', '--pathspec-file-nul'],
+                   input='\0'.join(files), capture_output=True, text=True, check=True)
+
+def _git_reader():
+    """The object reader of the repository around the working directory."""
+    # The reaper closes readers that sit idle
+    _ensure_session_reaper()
+    return git_readers.get(os.getcwd())
+
+def _git_show(rev: str, file: Optional[str], encoding: str) -> Dict[str, Any]:
+    error = _validate_encoding(encoding)
+    if error:
+        return {'status': 'error', 'error': error['error']}
+    spec = f"{rev}:{file}" if file else rev
+    reader = _git_reader()
+    obj = reader.read(spec)
+    if obj is None:
+        return {'status': 'error', 'error': f'Unknown object: {spec}'}
+    result = {
+        'status': 'success',
+        'object': obj.oid,
+        'type': obj.type,
+        'size': obj.size
+    }
+    if obj.type == 'commit':
+        commit = reader.commit(obj.oid)
+        result['commit'] = {key: commit[key] for key in (
+            'hash', 'tree', 'parents', 'author', 'author_email', 'date', 'committer',
+            'committer_email', 'subject', 'message'
+        )}
+    elif encoding == 'base64':
+        result['content'] = base64.b64encode(obj.data).decode('ascii')
+    else:
+        result['content'] = decode_output(obj.data)
+    return result
+
 # Development Tools
 
 @mcp.tool()
@@ -2055,6 +3759,17 @@ def _create_release(params: Dict[str, Any]) -> Dict[str, Any]:
                 "error": "Version is required"
             }
             
+        # A batch-check lookup is far cheaper than letting git tag fail
+        try:
+            tag_exists = git_readers.get(os.getcwd()).info(f"refs/tags/v{version}") is not None
+        except GitError:
+            tag_exists = False
+        if tag_exists:
+            return {
+                "status": "error",
+                "error": f"Tag v{version} already exists"
+            }
+            
         # Create git tag
         tag_cmd = ["git", "tag", "-a", f"v{version}", "-m", f"Release {version}"]
         tag_result = subprocess.run(tag_cmd, capture_output=True, text=True)
@@ -2103,19 +3818,13 @@ def _generate_changelog(params: Dict[str, Any]) -> Dict[str, Any]:
         since = params.get("since")
         until = params.get("until", "HEAD")
         
-        # Get git log
-        cmd = [
-            "git", "log",
-            "--pretty=format:%h %s",
-            f"{since}..{until}" if since else ""
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
+        # Walk since..until through the repository's cat-file reader
+        try:
+            commits = _git_reader().log(until, exclude=since)
+        except GitError as e:
             return {
                 "status": "error",
-                "error": f"Failed to get git log: {result.stderr}"
+                "error": f"Failed to get git log: {e}"
             }
             
         # Parse commits and categorize
@@ -2126,11 +3835,8 @@ def _generate_changelog(params: Dict[str, Any]) -> Dict[str, Any]:
             "other": []
         }
         
-        for line in result.stdout.split("\n"):
-            if not line:
-                continue
-                
-            hash, message = line.split(" ", 1)
+        for commit in commits:
+            hash, message = commit["hash"][:7], commit["subject"]
             
             if message.startswith("feat"):
                 changes["features"].append((hash, message))
@@ -2293,9 +3999,16 @@ def _analyze_style(code: str) -> Dict[str, Any]:
             "message": "Failed to analyze style"
         }
 
+def startup() -> None:
+    """Prepare a server process to serve: reattach the durable sessions of the previous one."""
+    result = reattach_sessions()
+    logger.info("Reattached %d running and %d exited durable sessions",
+                result["reattached"], result["exited"])
+
 def main():
     # Set up the server
     import uvicorn
+    startup()
     print("Starting server from MAIN")
     uvicorn.run(mcp.app, host="0.0.0.0", port=8000)
     # Only run the SSE transport when the script is run directly
@@ -2306,7 +4019,6 @@ def main():
     asyncio.run(add_metrics_to_tools())
     asyncio.run(add_tracing_to_tools())
     asyncio.run(add_profiling_to_tools())
-    update_active_sessions_metric()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,277 @@
+"""
+Warm forkserver for Python commands.
+
+A zygote interpreter (server/zygote.py) is started once with a set of
+preloaded modules. Each run_python request hands it a pair of output pipes
+and gets back the pid of a child forked from the warm interpreter, so
+commands skip interpreter startup and the preloaded imports. The zygote
+reaps its children and reports their exit status and rusage.
+"""
+
+import itertools
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from server.limits import LOST_RETURNCODE
+from server.output import OutputMultiplexer
+
+# Modules imported by the zygote before it starts forking
+DEFAULT_PRELOAD = ("json", "re", "pathlib", "subprocess", "collections", "itertools",
+                   "functools", "typing", "datetime", "dataclasses", "argparse", "logging")
+
+ZYGOTE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")
+
+# Seconds to wait for the zygote to start and to answer a request
+STARTUP_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 5.0
+
+
+class ForkServerError(RuntimeError):
+    """Raised when the zygote cannot be started or refuses a request."""
+
+
+class ForkedProcess:
+    """Popen-like handle of a process forked by the zygote.
+
+    The zygote, not this server, is the parent, so the exit status and rusage
+    arrive as messages; poll() only reports what has been received.
+    """
+
+    def __init__(self, pid: int, stdout_fd: int, stderr_fd: int, args: List[str]):
+        self.pid = pid
+        self.args = args
+        self.stdout = open(stdout_fd, "rb", buffering=0)
+        self.stderr = open(stderr_fd, "rb", buffering=0)
+        # Forked children read from /dev/null
+        self.stdin = None
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[resource.struct_rusage] = None
+        self.lost = False
+        self._on_exit: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+        self._exited = threading.Event()
+
+    @property
+    def on_exit(self) -> Optional[Callable[[], None]]:
+        return self._on_exit
+
+    @on_exit.setter
+    def on_exit(self, callback: Optional[Callable[[], None]]) -> None:
+        # The status may already have arrived; do not miss the exit
+        with self._lock:
+            self._on_exit = callback
+            fire = self._exited.is_set()
+        if fire and callback:
+            callback()
+
+    def _set_status(self, status: Optional[int], usage: Optional[list]) -> None:
+        """Record the exit reported by the zygote (status None when it was lost)."""
+        with self._lock:
+            if self._exited.is_set():
+                return
+            if status is None:
+                self.lost = True
+                self.returncode = LOST_RETURNCODE
+            else:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                self.rusage = resource.struct_rusage(usage)
+            self._exited.set()
+            callback = self._on_exit
+        if callback:
+            callback()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        if not self._exited.is_set():
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(15)
+
+    def kill(self) -> None:
+        self.send_signal(9)
+
+
+class ForkServer:
+    """Client side of the zygote: starts it, sends requests, routes replies."""
+
+    def __init__(self, multiplexer: OutputMultiplexer, preload: List[str] = None):
+        self.preload = list(DEFAULT_PRELOAD if preload is None else preload)
+        self.preloaded: List[str] = []
+        self.failed: List[str] = []
+        self.cold_start = None
+        self.requests = 0
+        self._multiplexer = multiplexer
+        self._process: Optional[subprocess.Popen] = None
+        self._control: Optional[socket.socket] = None
+        self._ids = itertools.count(1)
+        self._replies: Dict[int, list] = {}
+        self._children: Dict[int, ForkedProcess] = {}
+        # Exit reports that arrived before their pid's spawn reply was handled
+        self._early_exits: Dict[int, dict] = {}
+        self._ready = threading.Event()
+        self._lock = threading.RLock()
+        # Held while the zygote starts so concurrent callers wait for it
+        self._start_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return (self._control is not None and self._ready.is_set()
+                and self._process is not None and self._process.poll() is None)
+
+    def start(self) -> None:
+        """Start the zygote unless it is already running."""
+        with self._start_lock:
+            if self.running:
+                return
+            self.stop()
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self._ready = ready = threading.Event()
+            started = time.perf_counter()
+            try:
+                process = subprocess.Popen(
+                    [sys.executable, ZYGOTE_SCRIPT, str(theirs.fileno())] + self.preload,
+                    pass_fds=[theirs.fileno()],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    start_new_session=True
+                )
+            except Exception:
+                ours.close()
+                raise
+            finally:
+                theirs.close()
+            with self._lock:
+                self._process = process
+                self._control = ours
+            self._multiplexer.register(ours, self._on_message, lambda: self._on_close(ours))
+            if not ready.wait(STARTUP_TIMEOUT) or self._control is not ours:
+                self.stop()
+                raise ForkServerError("Forkserver did not start")
+            self.cold_start = time.perf_counter() - started
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._process is not None:
+                if self._process.poll() is None:
+                    self._process.kill()
+                self._process.wait()
+                self._process = None
+            if self._control is not None:
+                self._multiplexer.discard(self._control)
+                self._control = None
+
+    def spawn(self, kind: str, target: str, args: List[str], cwd: str,
+              env: Dict[str, str], rlimits: list = None) -> ForkedProcess:
+        """Fork a child from the zygote running code, a script or a module.
+
+        Raises:
+            ForkServerError: The zygote is unavailable or refused the request
+        """
+        self.start()
+        request_id = next(self._ids)
+        reply = [threading.Event(), None]
+        message = json.dumps({
+            "id": request_id,
+            "kind": kind,
+            "target": target,
+            "args": args,
+            "cwd": cwd,
+            "env": env,
+            "rlimits": [[which, soft, hard] for which, (soft, hard) in rlimits or []]
+        }).encode()
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            with self._lock:
+                self._replies[request_id] = reply
+                control = self._control
+            socket.send_fds(control, [message], [stdout_w, stderr_w])
+        except Exception as e:
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            self._replies.pop(request_id, None)
+            raise ForkServerError(f"Forkserver request failed: {e}")
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        if not reply[0].wait(REQUEST_TIMEOUT) or "pid" not in (reply[1] or {}):
+            self._replies.pop(request_id, None)
+            for fd in (stdout_r, stderr_r):
+                os.close(fd)
+            error = (reply[1] or {}).get("error", "no reply")
+            raise ForkServerError(f"Forkserver could not start the command: {error}")
+
+        self.requests += 1
+        child = ForkedProcess(reply[1]["pid"], stdout_r, stderr_r, [kind, target] + args)
+        with self._lock:
+            self._children[child.pid] = child
+            early = self._early_exits.pop(child.pid, None)
+        if early is not None:
+            self._on_exit_message(early)
+        return child
+
+    def _on_message(self, data: memoryview) -> None:
+        message = json.loads(bytes(data))
+        if "exit" in message:
+            self._on_exit_message(message)
+        elif message.get("ready"):
+            self.preloaded = message["preloaded"]
+            self.failed = message["failed"]
+            self._ready.set()
+        else:
+            reply = self._replies.pop(message.get("id"), None)
+            if reply is not None:
+                reply[1] = message
+                reply[0].set()
+
+    def _on_exit_message(self, message: dict) -> None:
+        with self._lock:
+            child = self._children.pop(message["exit"], None)
+            if child is None:
+                self._early_exits[message["exit"]] = message
+                return
+        child._set_status(message["status"], message["rusage"])
+
+    def _on_close(self, control: socket.socket) -> None:
+        # The zygote died: its children were reparented and can no longer be waited for
+        with self._lock:
+            if self._control is control:
+                self._control = None
+                # Wake a start() still waiting for the ready message
+                self._ready.set()
+            children, self._children = self._children, {}
+            self._early_exits.clear()
+        for child in children.values():
+            child._set_status(None, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self.running,
+            'pid': self._process.pid if self._process else None,
+            'preload': self.preload,
+            'preloaded': self.preloaded,
+            'failed': self.failed,
+            'cold_start_ms': self.cold_start * 1000 if self.cold_start is not None else None,
+            'requests': self.requests
+        }
@@ -0,0 +1,523 @@
+"""
+Long-lived git object readers.
+
+Every git process pays for its own startup and for opening the repository's
+packfiles and indexes, which dominates short reads on large repositories.
+An ObjectReader keeps `git cat-file --batch` (type, size and contents) and
+`git cat-file --batch-check` (type and size only) processes running for one
+repository and sends them object names one line at a time, so reading a
+commit, tree or blob is a round trip over a pipe. History is walked in the
+server by reading commit objects, and parsed commits are cached by object
+id since they never change. Readers are pooled by repository and closed
+once they sit idle.
+"""
+
+import collections
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+GIT = "git"
+
+# Seconds a repository's reader may sit unused before the pool closes it
+IDLE_TIMEOUT = 300.0
+
+# cat-file processes of each kind per repository; further requests wait
+MAX_PROCESSES = 2
+
+# Parsed commits kept per repository
+COMMIT_CACHE_SIZE = 4096
+
+# Commits per page of git_operation log when no limit is given
+LOG_PAGE_SIZE = 100
+
+# Fields of each commit streamed by path_log, NUL-separated
+LOG_FIELDS = ("%H", "%an", "%ad", "%s")
+LOG_FORMAT = "%x00".join(LOG_FIELDS)
+
+READ_SIZE = 65536
+
+
+class GitError(RuntimeError):
+    """Raised when git cannot be started or stops answering."""
+
+
+class GitObject:
+    """An object as reported by cat-file; data is None for --batch-check."""
+
+    __slots__ = ("oid", "type", "size", "data")
+
+    def __init__(self, oid: str, type: str, size: int, data: Optional[bytes] = None):
+        self.oid = oid
+        self.type = type
+        self.size = size
+        self.data = data
+
+
+def find_repository(path: str) -> Optional[str]:
+    """Top-level directory of the work tree containing path, found without running git."""
+    path = os.path.realpath(path)
+    while True:
+        # .git is a file in linked worktrees and submodules
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def format_date(timestamp: int, tz: str) -> str:
+    """A timestamp in git's default date format, in the committer's time zone."""
+    sign = -1 if tz.startswith("-") else 1
+    offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[3:5])) * sign
+    dt = datetime.fromtimestamp(timestamp, timezone(offset))
+    return f"{dt:%a %b} {dt.day} {dt:%H:%M:%S %Y} {tz}"
+
+
+def parse_commit(oid: str, data: bytes) -> Dict[str, Any]:
+    """Fields of a raw commit object.
+
+    subject is the first paragraph of the message on one line, as git log's %s.
+    """
+    header, _, message = data.partition(b"\n\n")
+    commit: Dict[str, Any] = {"hash": oid, "parents": []}
+    for line in header.decode("utf-8", errors="replace").split("\n"):
+        key, _, value = line.partition(" ")
+        if key == "tree":
+            commit["tree"] = value
+        elif key == "parent":
+            commit["parents"].append(value)
+        elif key in ("author", "committer"):
+            ident, timestamp, tz = value.rsplit(" ", 2)
+            name, _, email = ident.partition(" <")
+            commit[key] = name
+            commit[f"{key}_email"] = email.rstrip(">")
+            commit[f"{key}_time"] = int(timestamp)
+            commit[f"{key}_tz"] = tz
+    text = message.decode("utf-8", errors="replace")
+    commit["message"] = text
+    commit["subject"] = " ".join(text.split("\n\n", 1)[0].split("\n")).strip()
+    commit["date"] = format_date(commit.get("author_time", 0), commit.get("author_tz", "+0000"))
+    return commit
+
+
+class _CatFile:
+    """One cat-file process, answering one request at a time."""
+
+    def __init__(self, repo: str, check: bool):
+        self.process = subprocess.Popen(
+            [GIT, "cat-file", "--batch-check" if check else "--batch"],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        self.check = check
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def request(self, spec: str) -> Optional[GitObject]:
+        try:
+            self.process.stdin.write(spec.encode() + b"\n")
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+        except OSError as e:
+            raise GitError(f"git cat-file failed: {e}")
+        if not header.endswith(b"\n"):
+            raise GitError("git cat-file exited unexpectedly")
+        # "<name> missing" or "<name> ambiguous"; a found object is "<oid> <type> <size>"
+        if header.endswith((b" missing\n", b" ambiguous\n")):
+            return None
+        oid, kind, size = header.decode().split()
+        data = None
+        if not self.check:
+            data = self.process.stdout.read(int(size) + 1)
+            if len(data) != int(size) + 1:
+                raise GitError("git cat-file exited unexpectedly")
+            data = data[:-1]
+        return GitObject(oid, kind, int(size), data)
+
+    def close(self) -> None:
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class ObjectReader:
+    """cat-file processes of one repository, started on first use.
+
+    Requests are served by an idle process of the right kind; up to
+    max_processes of each kind run at once.
+    """
+
+    def __init__(self, repo: str, max_processes: int = MAX_PROCESSES):
+        self.repo = repo
+        self.max_processes = max_processes
+        self.last_used = time.monotonic()
+        self._idle: Dict[bool, List[_CatFile]] = {False: [], True: []}
+        self._started = {False: 0, True: 0}
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._commits: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+
+    @property
+    def processes(self) -> int:
+        with self._condition:
+            return self._started[False] + self._started[True]
+
+    def _acquire(self, check: bool) -> _CatFile:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise GitError(f"Object reader for {self.repo} is closed")
+                self._in_use += 1
+                if self._idle[check]:
+                    return self._idle[check].pop()
+                if self._started[check] < self.max_processes:
+                    self._started[check] += 1
+                    break
+                self._in_use -= 1
+                self._condition.wait()
+        try:
+            return _CatFile(self.repo, check)
+        except OSError as e:
+            self._release(None, check)
+            raise GitError(f"Cannot start git: {e}")
+
+    def _release(self, catfile: Optional[_CatFile], check: bool, healthy: bool = False) -> None:
+        with self._condition:
+            self._in_use -= 1
+            self.last_used = time.monotonic()
+            keep = healthy and not self._closed and catfile.alive
+            if keep:
+                self._idle[check].append(catfile)
+            else:
+                self._started[check] -= 1
+            self._condition.notify()
+        if catfile is not None and not keep:
+            catfile.close()
+
+    def _request(self, spec: str, check: bool) -> Optional[GitObject]:
+        if "\n" in spec:
+            raise ValueError("Object names cannot contain newlines")
+        catfile = self._acquire(check)
+        healthy = False
+        try:
+            result = catfile.request(spec)
+            healthy = True
+            return result
+        finally:
+            self._release(catfile, check, healthy)
+
+    def read(self, spec: str) -> Optional[GitObject]:
+        """Type, size and contents of an object (any name cat-file accepts,
+        e.g. "HEAD", "v1.0:README.md"); None when it does not exist."""
+        return self._request(spec, False)
+
+    def info(self, spec: str) -> Optional[GitObject]:
+        """Type and size of an object, without reading its contents."""
+        return self._request(spec, True)
+
+    def commit(self, spec: str) -> Optional[Dict[str, Any]]:
+        """Parsed commit that spec names (tags are peeled), or None."""
+        cached = self._commits.get(spec)
+        if cached is not None:
+            return cached
+        obj = self.read(f"{spec}^{{commit}}")
+        if obj is None:
+            return None
+        commit = parse_commit(obj.oid, obj.data)
+        with self._condition:
+            self._commits[obj.oid] = commit
+            self._commits.move_to_end(obj.oid)
+            while len(self._commits) > COMMIT_CACHE_SIZE:
+                self._commits.popitem(last=False)
+        return commit
+
+    def walk(self, tips: List[str], exclude: Optional[str] = None) -> "HistoryWalk":
+        """Lazy walk of the commits reachable from tips and not from exclude.
+
+        Raises:
+            GitError: a tip or exclude does not name a commit
+        """
+        return HistoryWalk(self, tips, exclude)
+
+    def log(self, start: str = "HEAD", limit: Optional[int] = None,
+            exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Commits reachable from start and not from exclude, newest first.
+
+        Raises:
+            GitError: start or exclude does not name a commit
+        """
+        return list(itertools.islice(self.walk([start], exclude), limit))
+
+    def log_page(self, limit: int, after: Optional[str] = None,
+                 start: str = "HEAD") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of history and the cursor of the next one.
+
+        Only the page's commits and the walk's frontier are held, so paging
+        through any length of history takes constant memory.
+
+        Args:
+            limit: Commits per page
+            after: Cursor returned with the previous page; the first page
+                starts at start
+
+        Returns:
+            The commits and the cursor for the next page (None after the
+            last page). The cursor is the frontier, followed by the
+            returned commits it could reach again (commits sharing a date).
+        """
+        if after:
+            tips, _, returned = after.partition(";")
+            walk = HistoryWalk(self, tips.split(","), done=returned.split(",") if returned else ())
+        else:
+            walk = self.walk([start])
+        commits = list(itertools.islice(walk, limit))
+        frontier = walk.frontier()
+        if not frontier:
+            return commits, None
+        # Returned commits the frontier may still reach. A commit is dated no
+        # later than its descendants, so only those dated no later than the
+        # newest commit left can be; normally that is just ties on its date
+        newest = walk.newest_time()
+        returned = [oid for oid in walk.done if self._time(oid) <= newest]
+        returned += [commit["hash"] for commit in commits
+                     if commit.get("committer_time", 0) <= newest]
+        return commits, ",".join(frontier) + (";" + ",".join(returned) if returned else "")
+
+    def _time(self, oid: str) -> int:
+        commit = self.commit(oid)
+        return commit.get("committer_time", 0) if commit else 0
+
+    def close_if_idle(self, cutoff: float) -> bool:
+        """Close the reader if it has not been used since cutoff (monotonic)."""
+        with self._condition:
+            if self._closed or self._in_use or self.last_used > cutoff:
+                return False
+        self.close()
+        return True
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            catfiles = self._idle[False] + self._idle[True]
+            self._idle = {False: [], True: []}
+            for catfile in catfiles:
+                self._started[catfile.check] -= 1
+            self._condition.notify_all()
+        for catfile in catfiles:
+            catfile.close()
+
+
+class HistoryWalk:
+    """Commits by descending commit date, as git log orders them.
+
+    The walk stops once every commit left to visit is reachable from
+    exclude. frontier() is the set of commits still to visit; with the
+    returned commits it may reach again passed as done, it is all that is
+    needed to resume the walk later.
+    """
+
+    def __init__(self, reader: ObjectReader, tips: List[str], exclude: Optional[str] = None,
+                 done: Iterable[str] = ()):
+        self._reader = reader
+        # Commits an earlier walk returned: their parents were visited then
+        self.done = frozenset(done)
+        self._heap = []
+        self._order = itertools.count()
+        # Object id -> reachable from exclude
+        self._uninteresting: Dict[str, bool] = {}
+        self._queued = set()
+        self._interesting = 0
+        if exclude is not None:
+            self._push(self._commit(exclude), True)
+        for tip in tips:
+            self._push(self._commit(tip), False)
+
+    def _commit(self, spec: str) -> Dict[str, Any]:
+        commit = self._reader.commit(spec)
+        if commit is None:
+            raise GitError(f"Unknown revision: {spec}")
+        return commit
+
+    def _push(self, commit: Dict[str, Any], hidden: bool) -> None:
+        oid = commit["hash"]
+        if oid in self.done and not hidden:
+            return
+        if oid in self._uninteresting:
+            if hidden and not self._uninteresting[oid]:
+                self._uninteresting[oid] = True
+                if oid in self._queued:
+                    self._interesting -= 1
+            return
+        self._uninteresting[oid] = hidden
+        self._queued.add(oid)
+        if not hidden:
+            self._interesting += 1
+        heapq.heappush(self._heap, (-commit.get("committer_time", 0), next(self._order), commit))
+
+    def __iter__(self) -> "HistoryWalk":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        while self._heap and self._interesting:
+            commit = heapq.heappop(self._heap)[2]
+            self._queued.discard(commit["hash"])
+            hidden = self._uninteresting[commit["hash"]]
+            for parent in commit["parents"]:
+                # Missing in shallow clones
+                parent_commit = self._reader.commit(parent)
+                if parent_commit is not None:
+                    self._push(parent_commit, hidden)
+            if not hidden:
+                self._interesting -= 1
+                return commit
+        raise StopIteration
+
+    def frontier(self) -> List[str]:
+        """Object ids of the commits the walk would visit next, newest first."""
+        if not self._interesting:
+            return []
+        return [entry[2]["hash"] for entry in sorted(self._heap)
+                if not self._uninteresting[entry[2]["hash"]]]
+
+    def newest_time(self) -> int:
+        """Commit time of the newest commit left to visit."""
+        return -self._heap[0][0] if self._heap else 0
+
+
+def iter_records(stream: BinaryIO, fields: int) -> Iterator[List[str]]:
+    """Records of a NUL-delimited stream (git's -z output), fields at a time.
+
+    The stream is read in chunks, so only the current record is held.
+    """
+    record: List[str] = []
+    partial = b""
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        tokens = (partial + chunk).split(b"\0")
+        partial = tokens.pop()
+        for token in tokens:
+            record.append(token.decode("utf-8", errors="replace"))
+            if len(record) == fields:
+                yield record
+                record = []
+    # git log -z ends the last record without a NUL
+    if partial:
+        record.append(partial.decode("utf-8", errors="replace"))
+    if len(record) == fields:
+        yield record
+
+
+def path_log(repo: str, path: str, limit: int, after: Optional[str] = None,
+             tip: str = "HEAD") -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of the history of a path, through a streamed git log -z.
+
+    Path-limited history needs tree diffs, which only git computes. The
+    cursor pins the tip (pass a commit id, so later commits do not shift
+    the pages) and counts the commits already returned.
+
+    Returns:
+        The commits and the cursor for the next page (None after the last page)
+    """
+    offset = 0
+    if after:
+        tip, _, skip = after.rpartition(":")
+        if not tip or not skip.isdigit():
+            raise GitError(f"Invalid cursor: {after}")
+        offset = int(skip)
+    process = subprocess.Popen(
+        [GIT, "log", "-z", f"--format={LOG_FORMAT}", f"--skip={offset}", f"-n{limit + 1}",
+         tip, "--", path],
+        cwd=repo,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    commits = []
+    try:
+        for oid, author, date, subject in iter_records(process.stdout, len(LOG_FIELDS)):
+            commits.append({"hash": oid, "author": author, "date": date, "subject": subject})
+    finally:
+        process.stdout.close()
+        error = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
+        if process.wait() != 0:
+            raise GitError(error.strip() or "git log failed")
+    if len(commits) <= limit:
+        return commits, None
+    return commits[:limit], f"{tip}:{offset + limit}"
+
+
+class ObjectReaderPool:
+    """ObjectReaders by repository, closed after idle_timeout seconds unused."""
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, max_processes: int = MAX_PROCESSES):
+        self.idle_timeout = idle_timeout
+        self.max_processes = max_processes
+        self._readers: Dict[str, ObjectReader] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str = ".") -> ObjectReader:
+        """The reader of the repository containing path.
+
+        Raises:
+            GitError: path is not inside a git work tree
+        """
+        repo = find_repository(path)
+        if repo is None:
+            raise GitError(f"Not a git repository: {os.path.abspath(path)}")
+        with self._lock:
+            reader = self._readers.get(repo)
+            if reader is None or reader._closed:
+                reader = self._readers[repo] = ObjectReader(repo, self.max_processes)
+            return reader
+
+    def evict_idle(self) -> int:
+        """Close readers idle past idle_timeout; returns how many were closed."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            readers = list(self._readers.items())
+        closed = 0
+        for repo, reader in readers:
+            if reader.close_if_idle(cutoff):
+                with self._lock:
+                    if self._readers.get(repo) is reader:
+                        del self._readers[repo]
+                closed += 1
+        return closed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            readers = list(self._readers.values())
+        return {
+            "repositories": len(readers),
+            "processes": sum(reader.processes for reader in readers)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            readers, self._readers = list(self._readers.values()), {}
+        for reader in readers:
+            reader.close()
+
+    def __len__(self) -> int:
+        return len(self._readers)
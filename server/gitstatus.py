@@ -0,0 +1,320 @@
+"""
+Watch-invalidated cache of `git status` output.
+
+git status stats every tracked file and reads every untracked directory, so
+on large trees each call costs a full scan even when nothing changed. The
+cache keeps the last output per repository and an inotify watch on each
+directory of the work tree (except ignored ones) and on the git directory;
+any event there invalidates the output, and an unchanged tree is answered
+by one non-blocking read of the inotify descriptor.
+
+git itself writes the index while computing status when it refreshes stat
+information, so events on the index only invalidate when the index's
+(inode, mtime, size) differs from what it was when the output was cached.
+Where inotify is unavailable, or the watch limit is reached, status simply
+runs every time.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from server import inotify
+from server.gitobjects import GIT, IDLE_TIMEOUT, GitError, find_repository
+
+_DIR_MASK = inotify.IN_CHANGES | inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW | inotify.IN_EXCL_UNLINK
+
+# Files whose change alters which paths are ignored, so the watches must be rebuilt
+_EXCLUDE_FILES = (".gitignore",)
+
+STATUS_ARGS = ("status", "--porcelain")
+
+
+def _index_state(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _git(repo: str, *args: str) -> str:
+    result = subprocess.run([GIT, *args], cwd=repo, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise GitError(result.stderr.strip() or f"git {args[0]} failed")
+    return result.stdout
+
+
+class WorktreeWatcher:
+    """inotify watches on a work tree's directories and its git directory.
+
+    Raises:
+        OSError: inotify is unavailable or the watch limit was reached
+    """
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        git_dir, common_dir = _git(
+            repo, "rev-parse", "--absolute-git-dir", "--git-common-dir"
+        ).splitlines()
+        self.git_dir = git_dir
+        self.common_dir = os.path.normpath(os.path.join(repo, common_dir))
+        self.index = os.path.join(git_dir, "index")
+        self.ignored = self._ignored_directories()
+        self._inotify = inotify.Inotify()
+        self._paths: Dict[int, str] = {}
+        self._git_wds: Set[int] = set()
+        try:
+            for path in {git_dir, self.common_dir, os.path.join(self.common_dir, "info")}:
+                self._watch(path, git=True)
+            self._watch_tree(os.path.join(self.common_dir, "refs"), git=True)
+            self._watch_tree(repo)
+        except OSError:
+            self.close()
+            raise
+
+    def _ignored_directories(self, *tops: str) -> Set[str]:
+        """Ignored directories that hold no tracked file; changes there never show.
+
+        Only directories below tops are listed when any are given.
+        """
+        pathspecs = [os.path.relpath(top, self.repo) for top in tops]
+        listed = _git(self.repo, "--literal-pathspecs", "ls-files", "--others", "--ignored",
+                      "--exclude-standard", "--directory", "-z", "--", *pathspecs)
+        candidates = "".join(f"{path}\0" for path in listed.split("\0") if path.endswith("/"))
+        if not candidates:
+            return set()
+        # ls-files also lists directories whose entries are all ignored; new
+        # files there would show, so keep only directories ignored themselves
+        result = subprocess.run([GIT, "check-ignore", "--stdin", "-z"], cwd=self.repo,
+                                input=candidates, capture_output=True, text=True)
+        if result.returncode not in (0, 1):
+            raise GitError(result.stderr.strip() or "git check-ignore failed")
+        return {os.path.join(self.repo, path.rstrip("/"))
+                for path in result.stdout.split("\0") if path}
+
+    @property
+    def watches(self) -> int:
+        return len(self._paths)
+
+    def _watch(self, path: str, git: bool = False) -> None:
+        try:
+            wd = self._inotify.add_watch(path, _DIR_MASK)
+        except (FileNotFoundError, NotADirectoryError):
+            # Removed or replaced since it was listed; its parent reports that
+            return
+        self._paths[wd] = path
+        if git:
+            self._git_wds.add(wd)
+
+    def _watch_tree(self, top: str, git: bool = False) -> None:
+        for root, dirs, _ in os.walk(top):
+            dirs[:] = [name for name in dirs
+                       if name != ".git" and os.path.join(root, name) not in self.ignored]
+            self._watch(root, git)
+
+    def changes(self) -> Tuple[bool, bool, bool]:
+        """Consume queued events.
+
+        Returns:
+            Whether something other than the index changed, whether the index
+            was written, and whether the watches must be rebuilt (ignore
+            rules changed, or events were lost)
+
+        Raises:
+            OSError: a new directory could not be watched (watch limit)
+            GitError: new directories could not be checked for ignore rules
+        """
+        changed = index_written = rebuild = False
+        created = []
+        for wd, mask, name in self._inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                changed = rebuild = True
+                continue
+            if mask & inotify.IN_IGNORED:
+                # The directory is gone; its parent reported the deletion
+                self._paths.pop(wd, None)
+                self._git_wds.discard(wd)
+                continue
+            parent = self._paths.get(wd)
+            if parent is None:
+                continue
+            if wd in self._git_wds:
+                if name in ("index", "index.lock"):
+                    index_written = True
+                elif name == "exclude":
+                    changed = rebuild = True
+                elif not name.endswith(".lock"):
+                    # Refs and HEAD are renamed into place from their .lock files
+                    changed = True
+                if mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self._watch_tree(os.path.join(parent, name), git=True)
+                continue
+            path = os.path.join(parent, name)
+            if name == ".git" or path in self.ignored:
+                continue
+            changed = True
+            if name in _EXCLUDE_FILES:
+                rebuild = True
+            if mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                created.append(path)
+        if created and not rebuild:
+            # Watch before the next status runs, so nothing created later is
+            # missed; new ignored directories (node_modules) are left out
+            self.ignored |= self._ignored_directories(*created)
+            for path in created:
+                if path not in self.ignored:
+                    self._watch_tree(path)
+        return changed, index_written, rebuild
+
+    def close(self) -> None:
+        self._inotify.close()
+
+
+class _RepoStatus:
+    __slots__ = ("repo", "watcher", "output", "index_state", "unwatchable", "last_used", "lock")
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.watcher: Optional[WorktreeWatcher] = None
+        self.output: Optional[str] = None
+        self.index_state = None
+        # Watching failed (no inotify, watch limit); status runs uncached
+        self.unwatchable = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class GitStatusCache:
+    """Per-repository `git status --porcelain` output, valid until the tree changes.
+
+    Args:
+        accelerate: Let status use and update the untracked cache (and the
+            fsmonitor hook, where the repository configures one). Otherwise
+            status runs with --no-optional-locks and never writes the index.
+        idle_timeout: Seconds after which an unused repository's watches are
+            dropped by evict_idle
+    """
+
+    def __init__(self, accelerate: bool = False, idle_timeout: float = IDLE_TIMEOUT):
+        self.accelerate = accelerate
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._repos: Dict[str, _RepoStatus] = {}
+        self._lock = threading.Lock()
+
+    def _command(self) -> List[str]:
+        if self.accelerate:
+            return [GIT, "-c", "core.untrackedCache=true", *STATUS_ARGS]
+        return [GIT, "--no-optional-locks", *STATUS_ARGS]
+
+    def status(self, path: str = ".") -> Tuple[str, bool]:
+        """Porcelain status of the repository containing path.
+
+        Concurrent callers for one repository share a single git run.
+
+        Returns:
+            The output and whether it came from the cache
+
+        Raises:
+            GitError: path is not in a work tree, or git status failed
+        """
+        repo = find_repository(path)
+        if repo is None:
+            raise GitError(f"Not a git repository: {os.path.abspath(path)}")
+        with self._lock:
+            entry = self._repos.get(repo)
+            if entry is None:
+                entry = self._repos[repo] = _RepoStatus(repo)
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            self._check(entry)
+            if entry.output is not None:
+                with self._lock:
+                    self.hits += 1
+                return entry.output, True
+
+            with self._lock:
+                self.misses += 1
+            before = _index_state(entry.watcher.index) if entry.watcher else None
+            result = subprocess.run(self._command(), cwd=repo, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise GitError(result.stderr.strip() or "git status failed")
+            if entry.watcher is not None:
+                after = _index_state(entry.watcher.index)
+                # Someone else may have staged changes while status ran
+                if before == after:
+                    entry.output = result.stdout
+                    entry.index_state = after
+            return result.stdout, False
+
+    def _check(self, entry: _RepoStatus) -> None:
+        """Drop entry's output if its tree changed; start watching if needed."""
+        watcher = entry.watcher
+        if watcher is not None:
+            try:
+                changed, index_written, rebuild = watcher.changes()
+            except (OSError, GitError):
+                # Events were consumed and new directories may be unwatched,
+                # so the output cannot be trusted any more
+                watcher.close()
+                entry.watcher = None
+                entry.output = None
+                entry.unwatchable = True
+                return
+            if index_written and _index_state(watcher.index) != entry.index_state:
+                changed = True
+            if rebuild:
+                watcher.close()
+                entry.watcher = watcher = None
+            if changed and entry.output is not None:
+                entry.output = None
+                with self._lock:
+                    self.invalidations += 1
+        if watcher is None and not entry.unwatchable:
+            entry.output = None
+            try:
+                entry.watcher = WorktreeWatcher(entry.repo)
+            except (OSError, GitError):
+                entry.unwatchable = True
+
+    def evict_idle(self) -> int:
+        """Drop the watches of repositories unused for idle_timeout seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [entry for entry in self._repos.values() if entry.last_used <= cutoff]
+            for entry in idle:
+                del self._repos[entry.repo]
+        for entry in idle:
+            with entry.lock:
+                if entry.watcher is not None:
+                    entry.watcher.close()
+                    entry.watcher = None
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self._repos.values())
+            lookups = self.hits + self.misses
+            return {
+                "repositories": len(entries),
+                "watches": sum(entry.watcher.watches for entry in entries if entry.watcher),
+                "unwatchable": sum(1 for entry in entries if entry.unwatchable),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            entries, self._repos = list(self._repos.values()), {}
+        for entry in entries:
+            with entry.lock:
+                if entry.watcher is not None:
+                    entry.watcher.close()
+                    entry.watcher = None
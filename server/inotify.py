@@ -0,0 +1,102 @@
+"""
+Minimal inotify binding.
+
+Linux-only, through ctypes, since the standard library has no file watching
+and the server avoids extra dependencies for it. The descriptor is
+non-blocking: read_events() returns whatever the kernel has queued and never
+waits, so callers can check for changes on demand without a thread.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Anything that changes what is in a directory or a file in it
+IN_CHANGES = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 65536
+
+_libc = None
+
+
+def _load() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if hasattr(libc, "inotify_init1"):
+            _libc = libc
+    return _libc
+
+
+def available() -> bool:
+    """Whether inotify can be used on this platform."""
+    try:
+        return _load() is not None
+    except OSError:
+        return False
+
+
+def _check(result: int, what: str) -> int:
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+    return result
+
+
+class Inotify:
+    """An inotify instance; wds map back to the paths they watch."""
+
+    def __init__(self):
+        if not available():
+            raise OSError("inotify is not available on this platform")
+        self.fd = _check(_libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC), "inotify_init1")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch path; raises OSError (ENOSPC once max_user_watches is reached)."""
+        return _check(_libc.inotify_add_watch(self.fd, os.fsencode(path), mask),
+                      f"inotify_add_watch({path})")
+
+    def remove_watch(self, wd: int) -> None:
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """Queued events as (wd, mask, name); empty when nothing happened."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
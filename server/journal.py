@@ -0,0 +1,265 @@
+"""
+On-disk journal of durable command sessions.
+
+A durable command writes its output to spool files instead of pipes to the
+server and runs under server/spool_runner.py, which records its exit status
+in a file. Each session's metadata (pid, command, start time, spool and
+status paths) is journaled as one small JSON file, so a restarted server can
+find the commands the previous one started, follow their spool files again
+and tell when they exit, even though it is not their parent.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+from server.limits import LOST_RETURNCODE
+from server.output import READ_CHUNK_SIZE, OutputBuffer
+
+SPOOL_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool_runner.py")
+
+# Seconds between checks of followed spool files for new output
+SPOOL_POLL_INTERVAL = 0.05
+
+
+class SessionJournal:
+    """Journal entries and spool files of durable sessions, in one directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def create(self, command: str) -> Dict[str, Any]:
+        """Allocate spool and status paths for a new durable session.
+
+        The entry is only written by record(), once the command has a pid.
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        base = os.path.join(self.directory, uuid.uuid4().hex)
+        return {
+            "id": os.path.basename(base),
+            "command": command,
+            "stdout": f"{base}.out",
+            "stderr": f"{base}.err",
+            "status": f"{base}.status",
+            "start_time": time.time()
+        }
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Write an entry atomically."""
+        path = os.path.join(self.directory, f"{entry['id']}.json")
+        temporary = f"{path}.tmp"
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(entry, f)
+        os.replace(temporary, path)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Every recorded entry; unreadable ones are skipped."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def remove(self, entry: Dict[str, Any]) -> None:
+        """Delete an entry with its spool and status files."""
+        paths = [os.path.join(self.directory, f"{entry['id']}.json"),
+                 entry["stdout"], entry["stderr"], entry["status"]]
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def start_durable(entry: Dict[str, Any], stages: List[List[str]],
+                  preexec_fn: Optional[Callable[[], None]] = None) -> subprocess.Popen:
+    """Start spool_runner for a pipeline, with its output going to the spool files.
+
+    The runner leads a new session, so it and its stages form one process
+    group that outlives the server.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+    stdout_fd = os.open(entry["stdout"], flags, 0o600)
+    try:
+        stderr_fd = os.open(entry["stderr"], flags, 0o600)
+        try:
+            return subprocess.Popen(
+                [sys.executable, SPOOL_RUNNER, entry["status"], json.dumps(stages)],
+                stdin=subprocess.DEVNULL,
+                stdout=stdout_fd,
+                stderr=stderr_fd,
+                start_new_session=True,
+                preexec_fn=preexec_fn
+            )
+        finally:
+            os.close(stderr_fd)
+    finally:
+        os.close(stdout_fd)
+
+
+def read_status(path: str) -> Optional[Dict[str, Any]]:
+    """The status spool_runner recorded, or None while the command runs."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class JournaledProcess:
+    """Popen-like handle of a durable command started by an earlier server.
+
+    The command is not our child, so its exit is learnt from the status file
+    spool_runner writes; a command that died without writing one (killed
+    with SIGKILL) is reported as lost.
+    """
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.pid = entry["pid"]
+        self.args = entry["command"]
+        self.stdin = self.stdout = self.stderr = None
+        self.returncode: Optional[int] = None
+        self.pipestatus: Optional[List[int]] = None
+        self.rusage: Optional[resource.struct_rusage] = None
+        self.lost = False
+        # Called once, from whichever thread notices the exit
+        self.on_exit: Optional[Callable[[], None]] = None
+        self._status_path = entry["status"]
+        self._create_time = entry.get("create_time")
+        self._lock = threading.Lock()
+
+    def _alive(self) -> bool:
+        try:
+            process = psutil.Process(self.pid)
+            # A different process may have been given the pid since
+            return (process.create_time() == self._create_time
+                    and process.status() != psutil.STATUS_ZOMBIE)
+        except psutil.Error:
+            return False
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+        status = read_status(self._status_path)
+        if status is None and self._alive():
+            return None
+        # The runner may have written its status just before exiting
+        status = status or read_status(self._status_path)
+        with self._lock:
+            exited = self.returncode is None
+            if exited:
+                if status is None:
+                    self.lost = True
+                    self.returncode = LOST_RETURNCODE
+                else:
+                    self.pipestatus = status["pipestatus"]
+                    self.rusage = resource.struct_rusage(status["rusage"])
+                    self.returncode = status["exit_code"]
+        if exited and self.on_exit:
+            self.on_exit()
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(SPOOL_POLL_INTERVAL)
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(15)
+
+    def kill(self) -> None:
+        self.send_signal(9)
+
+
+class SpoolFollower:
+    """One thread copying what durable commands append to their spool files
+    into their sessions' output buffers.
+
+    Regular files cannot be waited on with a selector, so followed files are
+    polled every SPOOL_POLL_INTERVAL seconds; the thread sleeps while there
+    is nothing to follow.
+    """
+
+    def __init__(self, interval: float = SPOOL_POLL_INTERVAL):
+        self.interval = interval
+        self._followed: List[Tuple[list, Callable[[], bool], threading.Event]] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def follow(self, streams: List[Tuple[str, OutputBuffer]],
+               finished: Callable[[], bool]) -> threading.Event:
+        """Follow spool files until finished() and everything written is read.
+
+        Returns an event set once the buffers have been closed.
+        """
+        files = [(open(path, "rb", buffering=0), buf) for path, buf in streams]
+        closed = threading.Event()
+        with self._condition:
+            self._followed.append((files, finished, closed))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="mcp-spool-follower", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return closed
+
+    @property
+    def followed(self) -> int:
+        return len(self._followed)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._followed:
+                    self._condition.wait()
+                followed = list(self._followed)
+            done = []
+            for entry in followed:
+                files, finished, closed = entry
+                # Checked before reading so output written before the exit is not missed
+                exited = finished()
+                for f, buf in files:
+                    while True:
+                        data = f.read(READ_CHUNK_SIZE)
+                        if not data:
+                            break
+                        buf.append(data)
+                if exited:
+                    for f, buf in files:
+                        f.close()
+                        buf.close()
+                    closed.set()
+                    done.append(entry)
+            if done:
+                with self._condition:
+                    self._followed = [entry for entry in self._followed
+                                      if not any(entry is ended for ended in done)]
+            time.sleep(self.interval)
@@ -0,0 +1,299 @@
+"""
+Resource limits and accounting for command sessions.
+
+Limits are applied in the child between fork and exec: rlimits for CPU time,
+address space and open files, and, when a writable cgroup v2 hierarchy is
+available, membership of a per-command cgroup that caps memory for the whole
+process tree. Processes are reaped with os.wait4 so every session can report
+its rusage.
+"""
+
+import itertools
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Per-call limits accepted by execute_command
+LIMIT_KEYS = ("cpu_seconds", "memory_bytes", "open_files", "wall_time")
+
+# Name of the sub-tree created below the server's own cgroup
+CGROUP_SUBTREE = "mcp-sessions"
+
+# returncode of a child whose exit status was lost. It only marks the child
+# as exited: results report the exit code as None, never as a success.
+LOST_RETURNCODE = -(1 << 16)
+
+
+def validate_limits(limits: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Return an error message for malformed limits, or None."""
+    if not limits:
+        return None
+    for key, value in limits.items():
+        if key not in LIMIT_KEYS:
+            return f"Unknown limit '{key}' (expected one of {', '.join(LIMIT_KEYS)})"
+        if not isinstance(value, (int, float)) or value <= 0:
+            return f"Limit '{key}' must be a positive number"
+    return None
+
+
+def rlimit_settings(limits: Optional[Dict[str, Any]]) -> List[Tuple[int, Tuple[int, int]]]:
+    """The (resource, (soft, hard)) pairs that enforce a limits dict."""
+    limits = limits or {}
+    rlimits = []
+    if "cpu_seconds" in limits:
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        seconds = max(1, int(limits["cpu_seconds"]))
+        rlimits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+    if "memory_bytes" in limits:
+        size = int(limits["memory_bytes"])
+        rlimits.append((resource.RLIMIT_AS, (size, size)))
+    if "open_files" in limits:
+        count = int(limits["open_files"])
+        rlimits.append((resource.RLIMIT_NOFILE, (count, count)))
+    return rlimits
+
+
+def preexec_limits(limits: Optional[Dict[str, Any]],
+                   cgroup_procs_fd: Optional[int] = None) -> Optional[Callable[[], None]]:
+    """Build a preexec_fn applying rlimits and joining a cgroup.
+
+    Everything is prepared in the parent so the child only makes syscalls.
+    """
+    rlimits = rlimit_settings(limits)
+    if not rlimits and cgroup_procs_fd is None:
+        return None
+
+    def apply():
+        if cgroup_procs_fd is not None:
+            try:
+                os.write(cgroup_procs_fd, b"0")
+            except OSError:
+                # Run unconfined rather than fail the command
+                pass
+        for which, value in rlimits:
+            resource.setrlimit(which, value)
+
+    return apply
+
+
+def rusage_dict(usage: resource.struct_rusage) -> Dict[str, Any]:
+    """Pick the figures reported for a finished command."""
+    return {
+        "user_time": usage.ru_utime,
+        "system_time": usage.ru_stime,
+        "max_rss_kb": usage.ru_maxrss,
+        "inblock": usage.ru_inblock,
+        "oublock": usage.ru_oublock
+    }
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_keyed(path: str) -> Dict[str, int]:
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if value.strip().isdigit():
+                    values[key] = int(value)
+    except OSError:
+        pass
+    return values
+
+
+def _find_cgroup_root() -> Optional[str]:
+    """Directory of this process's cgroup in the cgroup v2 hierarchy."""
+    mount = None
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "cgroup2":
+                    mount = fields[1]
+                    break
+        with open("/proc/self/cgroup") as f:
+            relative = next(
+                (line.strip()[3:] for line in f if line.startswith("0::")), None
+            )
+    except OSError:
+        return None
+    if mount is None or relative is None:
+        return None
+    return os.path.join(mount, relative.lstrip("/"))
+
+
+class CgroupSubtree:
+    """Per-command cgroups below a writable cgroup v2 directory.
+
+    Controllers are enabled on a best-effort basis; without the memory
+    controller, cgroups still group each command's process tree but memory
+    caps are left to RLIMIT_AS.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._counter = itertools.count(1)
+        self._enable_controllers(os.path.dirname(path))
+        self._enable_controllers(path)
+
+    @classmethod
+    def detect(cls) -> Optional["CgroupSubtree"]:
+        """Create the sub-tree under MCP_CGROUP_ROOT or the current cgroup, if writable."""
+        root = os.environ.get("MCP_CGROUP_ROOT") or _find_cgroup_root()
+        if not root or not os.path.exists(os.path.join(root, "cgroup.controllers")):
+            return None
+        path = os.path.join(root, CGROUP_SUBTREE)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            return None
+        if not os.access(os.path.join(path, "cgroup.procs"), os.W_OK):
+            return None
+        return cls(path)
+
+    @staticmethod
+    def _enable_controllers(path: str) -> None:
+        try:
+            with open(os.path.join(path, "cgroup.controllers")) as f:
+                available = f.read().split()
+        except OSError:
+            return
+        for controller in ("memory", "pids", "cpu", "io"):
+            if controller not in available:
+                continue
+            try:
+                with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+                    f.write(f"+{controller}")
+            except OSError:
+                pass
+
+    def create(self, limits: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Create a cgroup for one command and apply the memory limit to it."""
+        path = os.path.join(self.path, f"cmd-{os.getpid()}-{next(self._counter)}")
+        try:
+            os.mkdir(path)
+        except OSError:
+            return None
+        if limits and "memory_bytes" in limits:
+            try:
+                with open(os.path.join(path, "memory.max"), "w") as f:
+                    f.write(str(int(limits["memory_bytes"])))
+            except OSError:
+                pass
+        return path
+
+    @staticmethod
+    def open_procs(path: str) -> Optional[int]:
+        """Open a cgroup's cgroup.procs for the child to write itself into."""
+        try:
+            return os.open(os.path.join(path, "cgroup.procs"), os.O_WRONLY)
+        except OSError:
+            return None
+
+    @staticmethod
+    def stats(path: str) -> Dict[str, Any]:
+        """Accounting for the whole process tree of a command."""
+        cpu = _read_keyed(os.path.join(path, "cpu.stat"))
+        stats = {
+            "cpu_usage_usec": cpu.get("usage_usec"),
+            "memory_peak": _read_int(os.path.join(path, "memory.peak")),
+            "oom_kills": _read_keyed(os.path.join(path, "memory.events")).get("oom_kill")
+        }
+        return {key: value for key, value in stats.items() if value is not None}
+
+    @staticmethod
+    def remove(path: str) -> bool:
+        """Remove a command's cgroup; fails while descendants are still alive."""
+        try:
+            os.rmdir(path)
+            return True
+        except OSError:
+            return False
+
+
+class AccountedProcess:
+    """Popen wrapper that reaps its child with os.wait4 to collect rusage.
+
+    Popen.poll() and Popen.wait() reap with waitpid and discard the child's
+    resource usage, so they must not be called on the wrapped process.
+    """
+
+    def __init__(self, popen: subprocess.Popen):
+        self.popen = popen
+        self.pid = popen.pid
+        self.stdout = popen.stdout
+        self.stdin = popen.stdin
+        self.stderr = popen.stderr
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[resource.struct_rusage] = None
+        # True when the child was reaped by someone else and its status is lost
+        self.lost = False
+        # Called once, from whichever thread reaps the child
+        self.on_exit: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None or not self._lock.acquire(blocking=False):
+            return self.returncode
+        try:
+            if self.returncode is None:
+                try:
+                    pid, status, usage = os.wait4(self.pid, os.WNOHANG)
+                except ChildProcessError:
+                    self.lost = True
+                    self._set_returncode(LOST_RETURNCODE)
+                else:
+                    if pid:
+                        self.rusage = usage
+                        self._set_returncode(os.waitstatus_to_exitcode(status))
+                exited = self.returncode is not None
+            else:
+                exited = False
+        finally:
+            self._lock.release()
+        if exited and self.on_exit:
+            self.on_exit()
+        return self.returncode
+
+    def _set_returncode(self, returncode: int) -> None:
+        self.returncode = returncode
+        # Keep the Popen object consistent so it doesn't try to reap again
+        self.popen.returncode = returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.popen.args, timeout)
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        # The unreaped child still owns its pid, so signalling it is safe
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
@@ -0,0 +1,545 @@
+"""
+Output capture for command sessions.
+
+A single selector thread owns the stdout/stderr pipes of every session and
+feeds whatever is ready into per-session callbacks, instead of one blocking
+reader thread per process. Each stream lands in an OutputBuffer that keeps a
+bounded tail in memory and spills older bytes to a temporary file.
+
+Buffers are append-only logs addressed by byte offset, so any number of
+readers can follow the same stream with their own cursors. Output is kept as
+raw bytes and only decoded (with replacement) or split into lines when read.
+"""
+
+import asyncio
+import bisect
+import codecs
+import io
+import mmap
+import os
+import selectors
+import tempfile
+import threading
+from array import array
+from typing import Callable, Dict, Optional, Tuple
+
+# Size of each non-blocking read from a ready pipe
+READ_CHUNK_SIZE = 64 * 1024
+
+# Default number of bytes of each stream kept in memory
+DEFAULT_MEMORY_CAP = 256 * 1024
+
+# Smallest slice handed out by a bounded read
+MIN_READ_BYTES = 8
+
+# One line-index checkpoint is kept for every LINE_INDEX_STRIDE lines
+LINE_INDEX_STRIDE = 128
+
+
+def _text_decoder() -> io.IncrementalNewlineDecoder:
+    """Incremental UTF-8 decoder with universal newlines and replacement."""
+    return io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True
+    )
+
+
+def decode_output(data: bytes) -> str:
+    """Decode a complete slice of captured output."""
+    decoder = _text_decoder()
+    return decoder.decode(data, final=True)
+
+
+def _decodable_length(data: bytes) -> int:
+    """Length of a prefix of data that does not end inside a character or CRLF."""
+    n = len(data)
+    i = n - 1
+    while i >= 0 and n - i < 4 and (data[i] & 0xC0) == 0x80:
+        i -= 1
+    if i >= 0 and data[i] >= 0xC0:
+        needed = 2 if data[i] < 0xE0 else 3 if data[i] < 0xF0 else 4
+        if n - i < needed:
+            n = i
+    if n and data[n - 1] == 0x0D:
+        n -= 1
+    return n
+
+
+class OutputBuffer:
+    """Append-only byte log of one output stream with a bounded memory footprint.
+
+    The newest ``memory_cap`` bytes live in a fixed-size ring. Bytes pushed out
+    of the ring are appended to an anonymous temporary file, which is mapped
+    into memory only while older history is being read back.
+
+    A sparse line index records the byte offset of every LINE_INDEX_STRIDE-th
+    line so line numbers and offsets can be converted without a full scan. It
+    is built lazily, on the first line lookup after new output arrived, so
+    streams nobody asks line numbers of are never scanned.
+    """
+
+    def __init__(self, memory_cap: int = DEFAULT_MEMORY_CAP,
+                 on_change: Optional[Callable[[], None]] = None):
+        if memory_cap <= 0:
+            raise ValueError("memory_cap must be positive")
+        self.memory_cap = memory_cap
+        self.on_change = on_change
+        self.size = 0
+        self.spilled = 0
+        self.closed = False
+        self._ring = bytearray()
+        self._start = 0
+        self._len = 0
+        self._spill_file = None
+        self._lines = 0
+        self._indexed = 0
+        self._line_marks = array("Q", [0])
+        self._drained = 0
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes currently held in memory by the ring."""
+        return len(self._ring)
+
+    @property
+    def lines(self) -> int:
+        """Number of complete lines in the stream."""
+        with self._lock:
+            self._index_lines()
+            return self._lines
+
+    def append(self, data) -> None:
+        """Append a chunk, spilling the oldest in-memory bytes if needed.
+
+        data may be any bytes-like object; it is copied, so a reused read
+        buffer can be passed directly.
+        """
+        if not data:
+            return
+        with self._lock:
+            self._append(memoryview(data))
+        if self.on_change:
+            self.on_change()
+
+    def _index_lines(self) -> None:
+        """Extend the line index over output appended since the last lookup."""
+        marks = self._line_marks
+        next_mark = len(marks) * LINE_INDEX_STRIDE
+        while self._indexed < self.size:
+            chunk_start = self._indexed
+            data = self._read(chunk_start, chunk_start + READ_CHUNK_SIZE)
+            if not data:
+                # Released
+                return
+            count = data.count(b"\n")
+            line, pos = self._lines, -1
+            while self._lines + count >= next_mark:
+                # Advance to the newline that ends line next_mark - 1
+                for _ in range(next_mark - line):
+                    pos = data.find(b"\n", pos + 1)
+                line = next_mark
+                marks.append(chunk_start + pos + 1)
+                next_mark += LINE_INDEX_STRIDE
+            self._lines += count
+            self._indexed += len(data)
+
+    def _append(self, view: memoryview) -> None:
+        cap = self.memory_cap
+        n = len(view)
+        self.size += n
+
+        if len(self._ring) < cap:
+            if self._len + n <= cap:
+                # Still filling the ring linearly, nothing spilled yet
+                self._ring += view
+                self._len += n
+                return
+            self._ring.extend(bytes(cap - len(self._ring)))
+
+        if n > cap:
+            self._spill(self._len)
+            self._write_spill(view[:n - cap])
+            view = view[n - cap:]
+            n = cap
+
+        overflow = self._len + n - cap
+        if overflow > 0:
+            self._spill(overflow)
+
+        end = (self._start + self._len) % cap
+        first = min(n, cap - end)
+        self._ring[end:end + first] = view[:first]
+        self._ring[:n - first] = view[first:]
+        self._len += n
+
+    def _spill(self, count: int) -> None:
+        """Move the oldest ``count`` bytes of the ring to the spill file."""
+        if count <= 0:
+            return
+        cap = len(self._ring)
+        first = min(count, cap - self._start)
+        ring = memoryview(self._ring)
+        self._write_spill(ring[self._start:self._start + first])
+        if count > first:
+            self._write_spill(ring[:count - first])
+        self._start = (self._start + count) % cap
+        self._len -= count
+
+    def _write_spill(self, data: memoryview) -> None:
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="mcp-output-", buffering=0)
+        self._spill_file.write(data)
+        self.spilled += len(data)
+
+    def close(self) -> None:
+        """Mark the stream as finished; no more data will be appended."""
+        with self._lock:
+            self.closed = True
+        if self.on_change:
+            self.on_change()
+
+    def release(self) -> None:
+        """Drop the ring and spill file once the session is gone."""
+        with self._lock:
+            self._ring = bytearray()
+            self._start = self._len = 0
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Return the raw bytes in ``[start, end)`` of the stream."""
+        with self._lock:
+            return self._read(start, end)
+
+    def _read(self, start: int, end: Optional[int]) -> bytes:
+        end = self.size if end is None else min(end, self.size)
+        start = max(0, start)
+        if start >= end:
+            return b""
+
+        parts = []
+        if start < self.spilled:
+            disk_end = min(end, self.spilled)
+            with mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                parts.append(mapped[start:disk_end])
+            start = disk_end
+
+        if start < end and self._ring:
+            ring = self._ring
+            cap = len(ring)
+            offset = (self._start + start - self.spilled) % cap
+            count = end - start
+            first = min(count, cap - offset)
+            parts.append(bytes(ring[offset:offset + first]))
+            if count > first:
+                parts.append(bytes(ring[:count - first]))
+        return b"".join(parts)
+
+    def read_bytes(self, start: int = 0, max_bytes: Optional[int] = None) -> Tuple[bytes, int]:
+        """Return raw output from byte offset ``start`` without consuming it.
+
+        Unlike read_text, a bounded read is cut at exactly max_bytes.
+
+        Returns:
+            The bytes and the cursor to pass on the next read
+        """
+        with self._lock:
+            return self._read_bytes(start, max_bytes)
+
+    def _read_bytes(self, start: int, max_bytes: Optional[int]) -> Tuple[bytes, int]:
+        start = min(max(0, start), self.size)
+        end = self.size if max_bytes is None else start + max(1, max_bytes)
+        data = self._read(start, end)
+        return data, start + len(data)
+
+    def read_text(self, start: int = 0, max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        """Decode output from byte offset ``start`` without consuming it.
+
+        Args:
+            start: Byte offset (cursor) to read from
+            max_bytes: Upper bound on the bytes returned; a cut slice ends at
+                the last complete line when there is one
+
+        Returns:
+            The decoded text and the cursor to pass on the next read
+        """
+        with self._lock:
+            return self._read_text(start, max_bytes)
+
+    def _read_text(self, start: int, max_bytes: Optional[int]) -> Tuple[str, int]:
+        start = min(max(0, start), self.size)
+        if max_bytes is None:
+            end = self.size
+        else:
+            # Large enough to always hold a whole character or CRLF
+            end = min(self.size, start + max(MIN_READ_BYTES, max_bytes))
+        data = self._read(start, end)
+        if end < self.size:
+            newline = data.rfind(b"\n")
+            length = newline + 1 if newline >= 0 else _decodable_length(data)
+        elif self.closed:
+            length = len(data)
+        else:
+            # The writer may still complete a character or CRLF at the end
+            length = _decodable_length(data)
+        return decode_output(data[:length]), start + length
+
+    def drain(self, max_bytes: Optional[int] = None) -> str:
+        """Return output not yet drained and mark it consumed."""
+        with self._lock:
+            text, self._drained = self._read_text(self._drained, max_bytes)
+        return text
+
+    def history(self) -> str:
+        """Return the full output of the stream and mark it consumed."""
+        with self._lock:
+            text, self._drained = self._read_text(0, None)
+        return text
+
+    def drain_bytes(self, max_bytes: Optional[int] = None) -> bytes:
+        """Raw-bytes variant of drain."""
+        with self._lock:
+            data, self._drained = self._read_bytes(self._drained, max_bytes)
+        return data
+
+    def history_bytes(self) -> bytes:
+        """Raw-bytes variant of history."""
+        with self._lock:
+            data, self._drained = self._read_bytes(0, None)
+        return data
+
+    def consume(self, offset: int) -> None:
+        """Advance the default reader to ``offset`` without returning the output."""
+        with self._lock:
+            self._drained = max(self._drained, min(offset, self.size))
+
+    @property
+    def drained(self) -> int:
+        """Cursor of the default, destructive reader."""
+        return self._drained
+
+    def line_at(self, offset: int) -> int:
+        """Number of complete lines before byte ``offset``."""
+        with self._lock:
+            offset = min(max(0, offset), self.size)
+            self._index_lines()
+            mark = bisect.bisect_right(self._line_marks, offset) - 1
+            base = self._line_marks[mark]
+            return mark * LINE_INDEX_STRIDE + self._read(base, offset).count(b"\n")
+
+    def line_offset(self, line: int) -> int:
+        """Byte offset at which (0-based) ``line`` starts, or the end of the log."""
+        with self._lock:
+            self._index_lines()
+            if line > self._lines:
+                return self.size
+            mark = min(max(0, line) // LINE_INDEX_STRIDE, len(self._line_marks) - 1)
+            offset = self._line_marks[mark]
+            for _ in range(max(0, line) - mark * LINE_INDEX_STRIDE):
+                offset = self._find_newline(offset) + 1
+            return offset
+
+    def _find_newline(self, offset: int) -> int:
+        while offset < self.size:
+            chunk = self._read(offset, offset + READ_CHUNK_SIZE)
+            pos = chunk.find(b"\n")
+            if pos >= 0:
+                return offset + pos
+            offset += len(chunk)
+        return self.size
+
+
+class ChangeNotifier:
+    """Wake threads and coroutines waiting for a session to change.
+
+    Waiters pass the version they last saw and return as soon as it moves on,
+    so a change between checking for output and starting to wait is not lost.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._cond = threading.Condition()
+        self._futures = set()
+
+    def notify(self) -> None:
+        """Record a change (new output, EOF or exit) and wake all waiters."""
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+            futures, self._futures = self._futures, set()
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """Block until the version differs from ``version`` or the timeout ends."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != version, timeout)
+
+    async def wait_async(self, version: int, timeout: float) -> bool:
+        """Coroutine variant of wait()."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._cond:
+            if self.version != version:
+                return True
+            self._futures.add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                self._futures.discard(waiter)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _ignore(data: memoryview) -> None:
+    pass
+
+
+class OutputMultiplexer:
+    """Multiplex reads of many pipes onto one background thread.
+
+    Registrations and removals are queued and applied by the loop thread, since
+    selectors are not safe to mutate from other threads while a select() call
+    is in progress. All pipes are read into one preallocated chunk buffer.
+    """
+
+    def __init__(self, chunk_size: int = READ_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._chunk = bytearray(chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._thread: Optional[threading.Thread] = None
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._streams: Dict[int, tuple] = {}
+
+    def register(self, stream, on_data: Callable[[memoryview], None],
+                 on_close: Callable[[], None]) -> None:
+        """Start watching a readable pipe.
+
+        Args:
+            stream: File object (or raw fd) of the read end of a pipe
+            on_data: Called from the loop thread with every chunk read, as a
+                view of the shared read buffer that is only valid during the
+                call; copy whatever must be kept
+            on_close: Called once from the loop thread after EOF or discard
+        """
+        fd = stream if isinstance(stream, int) else stream.fileno()
+        os.set_blocking(fd, False)
+        self._submit(("add", fd, stream, on_data, on_close))
+
+    def watch_exit(self, pid: int, on_exit: Callable[[], None]) -> bool:
+        """Call on_exit from the loop thread once ``pid`` exits.
+
+        The process is not reaped. Returns False when exits cannot be watched
+        (no pidfd support, or the process is already gone).
+        """
+        if not hasattr(os, "pidfd_open"):
+            return False
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            return False
+        # A pidfd turns readable on exit; the read then fails and closes it
+        self._submit(("add", fd, fd, _ignore, on_exit))
+        return True
+
+    def discard(self, stream) -> None:
+        """Stop watching a pipe that may never reach EOF and close it."""
+        try:
+            fd = stream if isinstance(stream, int) else stream.fileno()
+        except ValueError:
+            # Already closed by the loop after EOF
+            return
+        self._submit(("remove", fd, stream))
+
+    @property
+    def watched(self) -> int:
+        """Number of pipes currently owned by the loop."""
+        return len(self._streams)
+
+    def _submit(self, op: tuple) -> None:
+        with self._lock:
+            self._pending.append(op)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="mcp-output-multiplexer", daemon=True
+                )
+                self._thread.start()
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            # Loop is already due to wake up
+            pass
+
+    def _apply_pending(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for op in pending:
+            if op[0] == "add":
+                _, fd, stream, on_data, on_close = op
+                self._streams[fd] = (stream, on_data, on_close)
+                self._selector.register(fd, selectors.EVENT_READ)
+            elif op[1] in self._streams and self._streams[op[1]][0] is op[2]:
+                self._close(op[1])
+
+    def _close(self, fd: int) -> None:
+        stream, _, on_close = self._streams.pop(fd)
+        self._selector.unregister(fd)
+        try:
+            if isinstance(stream, int):
+                os.close(stream)
+            else:
+                stream.close()
+        except OSError:
+            pass
+        try:
+            on_close()
+        except Exception as e:
+            print(f"Error closing output stream: {e}")
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self._selector.select():
+                fd = key.fd
+                if fd == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self._apply_pending()
+                    continue
+
+                if fd not in self._streams:
+                    continue
+                try:
+                    count = os.readv(fd, [self._chunk])
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    count = 0
+
+                if count:
+                    try:
+                        self._streams[fd][1](self._chunk_view[:count])
+                    except Exception as e:
+                        print(f"Error handling command output: {e}")
+                else:
+                    self._close(fd)
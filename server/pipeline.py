@@ -0,0 +1,165 @@
+"""
+Pipelines of commands connected by kernel pipes.
+
+``grep foo log | sort | uniq -c`` is split on unquoted ``|`` into stages that
+are started without a shell, each reading the previous stage's stdout
+directly. The data flowing between stages never passes through the server;
+only the last stage's stdout and the stages' shared stderr are captured.
+"""
+
+import os
+import resource
+import shlex
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+from server.limits import AccountedProcess
+
+PIPE_OPERATOR = "|"
+
+
+def split_pipeline(command: str) -> List[List[str]]:
+    """Split a command line into the argv of each pipeline stage.
+
+    Quoting follows POSIX shell rules, so a quoted or escaped ``|`` is part of
+    an argument.
+
+    Raises:
+        ValueError: Unbalanced quotes, or an empty stage (which includes ``||``)
+    """
+    segments, start, quote, index = [], 0, None, 0
+    while index < len(command):
+        char = command[index]
+        if char == "\\" and quote != "'":
+            index += 1
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == PIPE_OPERATOR:
+            segments.append(command[start:index])
+            start = index + 1
+        index += 1
+    segments.append(command[start:])
+
+    stages = [shlex.split(segment) for segment in segments]
+    if len(stages) > 1 and not all(stages):
+        raise ValueError("Empty pipeline stage (only '|' is supported between commands)")
+    return stages
+
+
+class PipelineProcess:
+    """Popen-like handle of a running pipeline.
+
+    The pipeline exits once every stage has; its return code is the last
+    stage's, as in a shell, with every stage's code in ``pipestatus``.
+    """
+
+    def __init__(self, stages: List[AccountedProcess], stderr):
+        self.stages = stages
+        self.pids = [stage.pid for stage in stages]
+        self.pid = stages[-1].pid
+        self.stdin = stages[0].stdin
+        self.stdout = stages[-1].stdout
+        self.stderr = stderr
+        self.returncode: Optional[int] = None
+        self.pipestatus: Optional[List[int]] = None
+        self.rusage: Optional[resource.struct_rusage] = None
+        self.lost = False
+        # Called once, after the last stage has been reaped
+        self.on_exit: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+        codes = [stage.poll() for stage in self.stages]
+        if None in codes:
+            return None
+        with self._lock:
+            exited = self.returncode is None
+            if exited:
+                self.pipestatus = [None if stage.lost else code
+                                   for stage, code in zip(self.stages, codes)]
+                self.rusage = _combined_rusage([stage.rusage for stage in self.stages])
+                self.lost = any(stage.lost for stage in self.stages)
+                self.returncode = codes[-1]
+        if exited and self.on_exit:
+            self.on_exit()
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for stage in self.stages:
+            stage.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+        return self.poll()
+
+    def send_signal(self, sig: int) -> None:
+        for stage in self.stages:
+            stage.send_signal(sig)
+
+    def terminate(self) -> None:
+        for stage in self.stages:
+            stage.terminate()
+
+    def kill(self) -> None:
+        for stage in self.stages:
+            stage.kill()
+
+
+def _combined_rusage(usages: List[Optional[resource.struct_rusage]]) -> Optional[resource.struct_rusage]:
+    """Sum the stages' usage; peak RSS is the largest single stage's."""
+    usages = [usage for usage in usages if usage is not None]
+    if not usages:
+        return None
+    fields = [sum(values) for values in zip(*usages)]
+    fields[2] = max(usage.ru_maxrss for usage in usages)
+    return resource.struct_rusage(fields)
+
+
+def start_pipeline(stages: List[List[str]],
+                   preexec_fn: Optional[Callable[[], None]] = None,
+                   stdin=None) -> PipelineProcess:
+    """Start the stages of a pipeline, each reading the previous one's stdout.
+
+    The first stage starts a new process group and the others join it, so the
+    pipeline can be signalled as a whole (a group cannot span sessions, so
+    unlike single commands the stages stay in the server's session). stdin is the first
+    stage's stdin, as for Popen. preexec_fn runs in every stage, so rlimits
+    apply per stage.
+    """
+    stderr_r, stderr_w = os.pipe()
+    processes: List[AccountedProcess] = []
+    try:
+        for index, argv in enumerate(stages):
+            popen = subprocess.Popen(
+                argv,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=stderr_w,
+                bufsize=0,
+                process_group=processes[0].pid if index else 0,
+                preexec_fn=preexec_fn
+            )
+            processes.append(AccountedProcess(popen))
+            if index:
+                # The stage owns the pipe now; holding it open would hide EOF
+                stdin.close()
+            stdin = popen.stdout if index < len(stages) - 1 else None
+    except Exception:
+        if processes and stdin is not None:
+            stdin.close()
+        for process in processes:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+            if process.stdin is not None:
+                process.stdin.close()
+        os.close(stderr_r)
+        raise
+    finally:
+        os.close(stderr_w)
+    return PipelineProcess(processes, open(stderr_r, "rb", buffering=0))
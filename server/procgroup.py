@@ -0,0 +1,86 @@
+"""
+Process-group teardown for command sessions.
+
+Every command leads its own session and process group, so the command and
+everything it started (short of processes that call setsid themselves) can be
+signalled at once, including grandchildren that outlive the command and keep
+its output pipes open.
+"""
+
+import os
+import signal
+import time
+from typing import Dict, List, Set
+
+# Seconds to wait for a process group to disappear after SIGKILL
+KILL_WAIT = 1.0
+
+
+def group_members(pgid: int) -> List[int]:
+    """Pids of the live (non-zombie) processes in a process group.
+
+    Returns an empty list where /proc is not available.
+    """
+    members = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return members
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces and parentheses
+        fields = stat[stat.rindex(b")") + 2:].split()
+        if int(fields[2]) == pgid and fields[0] != b"Z":
+            members.append(int(entry))
+    return members
+
+
+def signal_group(pgid: int, sig: int) -> bool:
+    """Send a signal to a process group; False when the group is gone."""
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Members that switched credentials; nothing more we can do
+        return True
+
+
+def _wait_for_empty(pgid: int, timeout: float, seen: Set[int]) -> List[int]:
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while True:
+        members = group_members(pgid)
+        seen.update(members)
+        remaining = deadline - time.monotonic()
+        if not members or remaining <= 0:
+            return members
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+
+def terminate_group(pgid: int, grace: float = 1.0) -> Dict[str, int]:
+    """SIGTERM a process group, then SIGKILL whatever survives grace seconds.
+
+    Returns:
+        Dictionary with the number of processes seen in the group, how many
+        of them are gone ("reaped") and how many are still alive
+    """
+    seen = set(group_members(pgid))
+    remaining: List[int] = []
+    if signal_group(pgid, signal.SIGTERM):
+        remaining = _wait_for_empty(pgid, grace, seen)
+        if remaining and signal_group(pgid, signal.SIGKILL):
+            remaining = _wait_for_empty(pgid, KILL_WAIT, seen)
+    return {
+        "signalled": len(seen),
+        "reaped": len(seen - set(remaining)),
+        "remaining": len(remaining)
+    }
@@ -0,0 +1,98 @@
+"""
+Live resource snapshots of a command session's process tree.
+
+Each session keeps psutil.Process handles for the processes of its tree.
+Reusing a handle matters twice over: psutil measures cpu_percent since the
+previous call on the same handle, so the figure covers the time since the
+last poll, and an existing handle reads /proc directly without the lookup a
+new one costs. The tree is re-discovered at most every REFRESH_INTERVAL
+seconds, since finding children means scanning every process.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List
+
+import psutil
+
+# Seconds between scans for processes that joined or left the tree
+REFRESH_INTERVAL = 1.0
+
+IO_FIELDS = ("read_count", "write_count", "read_bytes", "write_bytes")
+
+
+class ProcessTreeStats:
+    """Cached psutil handles of the processes started from some root pids."""
+
+    def __init__(self, roots: List[int], refresh_interval: float = REFRESH_INTERVAL):
+        self.roots = list(roots)
+        self.refresh_interval = refresh_interval
+        self._handles: Dict[int, psutil.Process] = {}
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self, now: float) -> None:
+        found = {}
+        for pid in self.roots:
+            root = self._handles.get(pid)
+            try:
+                root = root or psutil.Process(pid)
+                found[pid] = root
+                for child in root.children(recursive=True):
+                    found[child.pid] = child
+            except psutil.Error:
+                continue
+        # Keep old handles: they remember the previous CPU times
+        self._handles = {pid: self._handles.get(pid, proc) for pid, proc in found.items()}
+        self._refreshed = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totals over the live processes of the tree.
+
+        cpu_percent is measured since the previous snapshot (0.0 for processes
+        seen for the first time); io is omitted where the platform or
+        permissions do not provide it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._refreshed >= self.refresh_interval:
+                self._refresh(now)
+            totals = {
+                "processes": 0,
+                "cpu_percent": 0.0,
+                "rss_bytes": 0,
+                "threads": 0,
+                "open_fds": 0
+            }
+            io = dict.fromkeys(IO_FIELDS, 0)
+            io_available = False
+            statuses = {}
+            for pid, proc in list(self._handles.items()):
+                try:
+                    with proc.oneshot():
+                        sample = (proc.cpu_percent(None), proc.memory_info().rss,
+                                  proc.num_threads(), proc.num_fds())
+                        statuses[pid] = proc.status()
+                        try:
+                            counters = proc.io_counters()
+                        except (psutil.AccessDenied, AttributeError, NotImplementedError):
+                            counters = None
+                except psutil.NoSuchProcess:
+                    del self._handles[pid]
+                    continue
+                except psutil.Error:
+                    continue
+                totals["processes"] += 1
+                for key, value in zip(("cpu_percent", "rss_bytes", "threads", "open_fds"), sample):
+                    totals[key] += value
+                if counters is not None:
+                    io_available = True
+                    for field in IO_FIELDS:
+                        io[field] += getattr(counters, field)
+            totals["cpu_percent"] = round(totals["cpu_percent"], 1)
+            if io_available:
+                totals["io"] = io
+            root_status = [statuses[pid] for pid in self.roots if pid in statuses]
+            if root_status:
+                totals["status"] = root_status[-1]
+            return totals
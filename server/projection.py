@@ -0,0 +1,183 @@
+"""
+Server-side projection of command output.
+
+Agents often want only part of a stream: the last lines of a build log, the
+lines matching "error|warning", or at most so many bytes. A projection is
+applied while the stream is read from its OutputBuffer, chunk by chunk, so
+only the lines it keeps are held in memory and serialized. Without a grep
+pattern, tail and head seek through the buffer's line index instead of
+scanning the dropped lines.
+"""
+
+import collections
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from server.output import READ_CHUNK_SIZE, OutputBuffer, _decodable_length
+
+
+class OutputProjection:
+    """Which lines of a stream to return.
+
+    head and tail keep the first and last lines (both: the two ends, with
+    the middle dropped); grep keeps only lines matching a regular expression
+    and is applied before head and tail; max_bytes caps the bytes returned,
+    dropping whole lines from the middle outwards (the end of the output is
+    kept when tail is given, otherwise the start).
+    """
+
+    def __init__(self, head: Optional[int] = None, tail: Optional[int] = None,
+                 grep: Optional[str] = None, max_bytes: Optional[int] = None):
+        for name, value in (("head", head), ("tail", tail), ("max_bytes", max_bytes)):
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise ValueError(f"{name} must be a non-negative integer")
+        try:
+            self.pattern = re.compile(grep.encode()) if grep else None
+        except re.error as e:
+            raise ValueError(f"Invalid grep pattern: {e}")
+        self.head = head
+        self.tail = tail
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_params(cls, head: Optional[int] = None, tail: Optional[int] = None,
+                    grep: Optional[str] = None,
+                    max_bytes: Optional[int] = None) -> Optional["OutputProjection"]:
+        """Build a projection from tool parameters; None when none were given.
+
+        Raises:
+            ValueError: A negative count or an invalid pattern
+        """
+        if head is None and tail is None and not grep and max_bytes is None:
+            return None
+        return cls(head, tail, grep, max_bytes)
+
+    def apply(self, buf: OutputBuffer, start: int) -> Tuple[bytes, int, Dict[str, int]]:
+        """Project the output of a stream from byte offset start.
+
+        While the stream is open, a trailing partial line is left for the next
+        read so a pattern never sees half a line.
+
+        Returns:
+            The kept bytes, the cursor after the projected range, and the
+            number of lines and bytes dropped
+        """
+        end = buf.size
+        if not buf.closed:
+            end = max(start, buf.line_offset(buf.line_at(end)))
+        start = min(start, end)
+        if self.pattern is None and self.max_bytes is None:
+            first, last = self._seek_ends(buf, start, end)
+        else:
+            first, last = self._scan(buf, start, end)
+        if self.max_bytes is not None:
+            first, last = self._fit(first, last)
+
+        data = b"".join(first + last)
+        kept = data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+        return data, end, {
+            "lines_dropped": max(0, self._count_lines(buf, start, end) - kept),
+            "bytes_dropped": (end - start) - len(data)
+        }
+
+    def _limits(self) -> Tuple[Optional[int], int]:
+        """Lines kept from the start (None: all) and from the end."""
+        if self.head is None and self.tail is None:
+            return None, 0
+        return self.head or 0, self.tail or 0
+
+    def _seek_ends(self, buf: OutputBuffer, start: int,
+                   end: int) -> Tuple[List[bytes], List[bytes]]:
+        """head/tail without a pattern: read only the lines that are kept."""
+        head, tail = self._limits()
+        if head is None:
+            return [buf.read(start, end)], []
+        first_line = buf.line_at(start)
+        total = self._count_lines(buf, start, end)
+        if head + tail >= total:
+            return [buf.read(start, end)], []
+        head_end = buf.line_offset(first_line + head) if head else start
+        tail_start = buf.line_offset(first_line + total - tail) if tail else end
+        return ([buf.read(start, max(start, head_end))] if head else [],
+                [buf.read(min(tail_start, end), end)] if tail else [])
+
+    def _scan(self, buf: OutputBuffer, start: int,
+              end: int) -> Tuple[List[bytes], List[bytes]]:
+        """Walk the lines once, keeping the matches within the head/tail limits."""
+        head, tail = self._limits()
+        first: List[bytes] = []
+        last = collections.deque(maxlen=tail)
+        budget = self.max_bytes
+        for line in _iter_lines(buf, start, end):
+            if self.pattern is not None and not self.pattern.search(line):
+                continue
+            if head is None:
+                # Without tail, nothing past the byte budget can be kept
+                if budget is not None and budget <= 0:
+                    continue
+                first.append(line)
+                if budget is not None:
+                    budget -= len(line)
+            elif len(first) < head:
+                first.append(line)
+            elif tail:
+                last.append(line)
+        return first, list(last)
+
+    def _fit(self, first: List[bytes], last: List[bytes]) -> Tuple[List[bytes], List[bytes]]:
+        """Drop whole lines until the output fits in max_bytes."""
+        budget = self.max_bytes
+        if sum(map(len, first)) + sum(map(len, last)) <= budget:
+            return first, last
+        kept_first, kept_last = [], []
+        # With tail, the end of the output matters most; otherwise the start
+        order = ([(last, kept_last, True), (first, kept_first, False)] if self.tail
+                 else [(first, kept_first, False), (last, kept_last, True)])
+        for lines, kept, from_end in order:
+            for line in (reversed(lines) if from_end else lines):
+                if len(line) > budget:
+                    break
+                kept.append(line)
+                budget -= len(line)
+            if from_end:
+                kept.reverse()
+        if not kept_first and not kept_last:
+            # Not even one whole line fits: return the start of the first one
+            line = (first or last)[0]
+            return [line[:_decodable_length(line[:budget])]], []
+        return kept_first, kept_last
+
+    @staticmethod
+    def _count_lines(buf: OutputBuffer, start: int, end: int) -> int:
+        if start >= end:
+            return 0
+        lines = buf.line_at(end) - buf.line_at(start)
+        # A final line without a newline still counts
+        if buf.read(end - 1, end) != b"\n":
+            lines += 1
+        return lines
+
+
+def _iter_lines(buf: OutputBuffer, start: int, end: int):
+    """Lines of buf in [start, end), newline included, read a chunk at a time."""
+    partial = b""
+    offset = start
+    while offset < end:
+        chunk = buf.read(offset, min(end, offset + READ_CHUNK_SIZE))
+        if not chunk:
+            break
+        offset += len(chunk)
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if partial:
+        yield partial
+
+
+def projection_info(results: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """Per-stream drop counts plus totals, for a response's "projection" key."""
+    info: Dict[str, Any] = dict(results)
+    info["lines_dropped"] = sum(result["lines_dropped"] for result in results.values())
+    info["bytes_dropped"] = sum(result["bytes_dropped"] for result in results.values())
+    return info
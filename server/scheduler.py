@@ -0,0 +1,234 @@
+"""
+Admission scheduling for command execution.
+
+Commands are admitted against a global budget of concurrently running
+processes. Commands that do not fit are queued per client inside priority
+classes: a freed slot goes to the highest-priority class with waiting
+commands, and within a class clients take turns, so one client's backlog
+cannot hold up everybody else.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from server.output import ChangeNotifier
+
+# Priority classes, highest first
+PRIORITY_CLASSES = ("interactive", "batch")
+
+# Finished tickets remembered for status lookups
+TICKET_HISTORY = 1024
+
+
+class Ticket:
+    """A command's place in the admission queue."""
+
+    def __init__(self, ticket_id: int, command: str, client: str, priority: str):
+        self.id = ticket_id
+        self.command = command
+        self.client = client
+        self.priority = priority
+        self.state = "queued"
+        self.submitted = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.notifier = ChangeNotifier()
+        # Set for queued commands whose caller stopped waiting; starts the
+        # command on a thread of its own once admitted
+        self.on_admit: Optional[Callable[["Ticket"], None]] = None
+        self.pid: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    @property
+    def wait_time(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return end - self.submitted
+
+
+class CommandScheduler:
+    """Global concurrency budget with per-client, per-priority queues.
+
+    Args:
+        max_running: Commands allowed to run at the same time
+        observe_depth: Called with (delta, priority) whenever the queue grows or shrinks
+        observe_wait: Called with (seconds, priority) when a command is admitted
+    """
+
+    def __init__(self, max_running: int,
+                 observe_depth: Callable[[int, str], None] = None,
+                 observe_wait: Callable[[float, str], None] = None):
+        self.max_running = max(1, max_running)
+        self.running = 0
+        self.admitted_total = 0
+        self.total_wait = 0.0
+        self._observe_depth = observe_depth
+        self._observe_wait = observe_wait
+        # priority -> client -> deque of tickets; client order is the rotation
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {
+            priority: OrderedDict() for priority in PRIORITY_CLASSES
+        }
+        self._tickets: "OrderedDict[int, Ticket]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, command: str, client: str, priority: str) -> Ticket:
+        """Admit a command now if the budget allows, otherwise queue it."""
+        if priority not in self._queues:
+            raise ValueError(
+                f"Unknown priority '{priority}' (expected one of {', '.join(PRIORITY_CLASSES)})"
+            )
+        with self._lock:
+            ticket = Ticket(next(self._ids), command, client, priority)
+            self._remember(ticket)
+            if self.running < self.max_running and not self.depth():
+                self._admit(ticket)
+            else:
+                self._queues[priority].setdefault(client, deque()).append(ticket)
+        if not ticket.admitted and self._observe_depth:
+            self._observe_depth(1, priority)
+        self._observe(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket, state: str = "finished") -> None:
+        """Give an admitted command's slot back and admit whoever is next."""
+        with self._lock:
+            if ticket.state not in ("admitted", "running"):
+                return
+            ticket.state = state
+            self.running -= 1
+            admitted = []
+            while self.running < self.max_running:
+                queued = self._next()
+                if queued is None:
+                    break
+                self._admit(queued)
+                admitted.append(queued)
+        for queued in admitted:
+            if self._observe_depth:
+                self._observe_depth(-1, queued.priority)
+            self._observe(queued)
+            queued.notifier.notify()
+            if queued.on_admit:
+                # release() runs on whichever thread saw the previous command
+                # exit, often the output multiplexer; starting a command there
+                # would stall output capture and any reply it waits for
+                threading.Thread(target=queued.on_admit, args=(queued,),
+                                 name=f"mcp-admit-{queued.id}", daemon=True).start()
+
+    def detach(self, ticket: Ticket, on_admit: Callable[[Ticket], None]) -> bool:
+        """Have a queued command started by the scheduler once it is admitted.
+
+        Returns False when the ticket was admitted in the meantime, in which
+        case the caller still owns the slot and must start the command itself.
+        """
+        with self._lock:
+            if ticket.state != "queued":
+                return False
+            ticket.on_admit = on_admit
+            return True
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """Drop a command from the queue; fails once it has been admitted."""
+        with self._lock:
+            if ticket.state != "queued":
+                return False
+            clients = self._queues[ticket.priority]
+            clients[ticket.client].remove(ticket)
+            if not clients[ticket.client]:
+                del clients[ticket.client]
+            ticket.state = "cancelled"
+        if self._observe_depth:
+            self._observe_depth(-1, ticket.priority)
+        ticket.notifier.notify()
+        return True
+
+    def get(self, ticket_id: int) -> Optional[Ticket]:
+        with self._lock:
+            return self._tickets.get(ticket_id)
+
+    def position(self, ticket: Ticket) -> Optional[int]:
+        """1-based position in admission order, or None if not queued."""
+        with self._lock:
+            if ticket.state != "queued":
+                return None
+            for index, queued in enumerate(self._order(), 1):
+                if queued is ticket:
+                    return index
+        return None
+
+    def depth(self) -> int:
+        return sum(len(tickets) for clients in self._queues.values()
+                   for tickets in clients.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_running': self.max_running,
+                'running': self.running,
+                'queued': self.depth(),
+                'queued_by_priority': {
+                    priority: sum(len(tickets) for tickets in clients.values())
+                    for priority, clients in self._queues.items()
+                },
+                'queued_by_client': self._client_depths(),
+                'admitted': self.admitted_total,
+                'average_wait': self.total_wait / self.admitted_total if self.admitted_total else 0.0
+            }
+
+    def _client_depths(self) -> Dict[str, int]:
+        depths: Dict[str, int] = {}
+        for clients in self._queues.values():
+            for client, tickets in clients.items():
+                depths[client] = depths.get(client, 0) + len(tickets)
+        return depths
+
+    def _admit(self, ticket: Ticket) -> None:
+        ticket.state = "admitted"
+        ticket.admitted_at = time.monotonic()
+        self.running += 1
+        self.admitted_total += 1
+        self.total_wait += ticket.wait_time
+
+    def _observe(self, ticket: Ticket) -> None:
+        if ticket.admitted and self._observe_wait:
+            self._observe_wait(ticket.wait_time, ticket.priority)
+
+    def _next(self) -> Optional[Ticket]:
+        for clients in self._queues.values():
+            if not clients:
+                continue
+            client, tickets = next(iter(clients.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            return ticket
+        return None
+
+    def _order(self) -> List[Ticket]:
+        """Queued tickets in the order they would be admitted."""
+        order = []
+        for clients in self._queues.values():
+            iterators = deque(iter(tickets) for tickets in clients.values())
+            while iterators:
+                tickets = iterators.popleft()
+                ticket = next(tickets, None)
+                if ticket is not None:
+                    order.append(ticket)
+                    iterators.append(tickets)
+        return order
+
+    def _remember(self, ticket: Ticket) -> None:
+        self._tickets[ticket.id] = ticket
+        while len(self._tickets) > TICKET_HISTORY:
+            oldest = next(iter(self._tickets.values()))
+            if oldest.state == "queued":
+                break
+            self._tickets.popitem(last=False)
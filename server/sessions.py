@@ -0,0 +1,179 @@
+"""
+Registry of command sessions.
+
+Sessions are spread over lock stripes by pid, so concurrent pollers only
+contend when their pids land on the same stripe, and the number of sessions
+is kept in an atomic counter rather than counted under a lock. Session
+records use __slots__: one is created for every command, and the reaper and
+pollers read their fields constantly.
+"""
+
+import threading
+import time
+from typing import Any, Iterator, List, Optional, Tuple
+
+# Number of lock stripes; a power of two so a pid maps to a stripe with a mask
+DEFAULT_STRIPES = 16
+
+
+class AtomicCounter:
+    """An integer updated under its own small lock."""
+
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self, value: int = 0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    def add(self, delta: int) -> int:
+        with self._lock:
+            self._value += delta
+            return self._value
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Session:
+    """State of one command session.
+
+    Fields that only exist for some commands (stdin, cgroup, wall_timer, ...)
+    default to None. Item access (session["process"]) is kept for callers
+    written against the old dictionary sessions.
+    """
+
+    __slots__ = (
+        "process", "command", "start_time", "notifier", "stdout_buffer", "stderr_buffer",
+        "output_closed", "exit_watched", "exit_time", "orphaned", "usage", "limits",
+        "limit_exceeded", "cgroup", "pgid", "wall_timer", "stdin", "stdin_lock",
+        "process_stats", "journal_entry", "lock"
+    )
+
+    def __init__(self, process, command: str, notifier, stdout_buffer, stderr_buffer):
+        self.process = process
+        self.command = command
+        self.start_time = time.time()
+        self.notifier = notifier
+        self.stdout_buffer = stdout_buffer
+        self.stderr_buffer = stderr_buffer
+        # Set once both output pipes have reached EOF
+        self.output_closed: Optional[threading.Event] = None
+        self.exit_watched = False
+        self.exit_time: Optional[float] = None
+        self.orphaned = False
+        self.usage: Optional[dict] = None
+        self.limits: dict = {}
+        self.limit_exceeded: Optional[str] = None
+        self.cgroup: Optional[str] = None
+        self.pgid: Optional[int] = None
+        self.wall_timer: Optional[threading.Timer] = None
+        self.stdin = None
+        # Serializes writers of stdin
+        self.stdin_lock: Optional[threading.Lock] = None
+        # Cached psutil handles of the process tree, created on first use
+        self.process_stats = None
+        # Journal entry of a durable session (see server.journal)
+        self.journal_entry: Optional[dict] = None
+        # Guards changes to this session's own fields
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+
+class SessionRegistry:
+    """Sessions by pid, behind striped locks.
+
+    Supports the read side of a dict (get, in, [], len, items, values) so it
+    can stand in for the old active_sessions dictionary. Iteration takes a
+    snapshot one stripe at a time, so it never holds more than one lock.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        if stripes < 1 or stripes & (stripes - 1):
+            raise ValueError("stripes must be a power of two")
+        self._mask = stripes - 1
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._maps = [{} for _ in range(stripes)]
+        self._count = AtomicCounter()
+
+    def _stripe(self, pid: int) -> Tuple[threading.Lock, dict]:
+        index = pid & self._mask
+        return self._locks[index], self._maps[index]
+
+    def add(self, pid: int, session: Session) -> Optional[Session]:
+        """Register a pid's session; returns the session it replaced, if any.
+
+        A pid is only replaced when it was reused while the exited session
+        that had it was still kept for late readers.
+        """
+        lock, sessions = self._stripe(pid)
+        with lock:
+            replaced = sessions.get(pid)
+            sessions[pid] = session
+        if replaced is None:
+            self._count.add(1)
+        return replaced
+
+    def remove(self, pid: int, session: Optional[Session] = None) -> bool:
+        """Remove a pid's session, only if it is still session when one is given."""
+        lock, sessions = self._stripe(pid)
+        with lock:
+            current = sessions.get(pid)
+            if current is None or (session is not None and current is not session):
+                return False
+            del sessions[pid]
+        self._count.add(-1)
+        return True
+
+    def get(self, pid: int, default: Optional[Session] = None) -> Optional[Session]:
+        lock, sessions = self._stripe(pid)
+        with lock:
+            return sessions.get(pid, default)
+
+    def __getitem__(self, pid: int) -> Session:
+        session = self.get(pid)
+        if session is None:
+            raise KeyError(pid)
+        return session
+
+    def __contains__(self, pid: object) -> bool:
+        return isinstance(pid, int) and self.get(pid) is not None
+
+    def __len__(self) -> int:
+        return self._count.value
+
+    @property
+    def count(self) -> int:
+        return self._count.value
+
+    def items(self) -> List[Tuple[int, Session]]:
+        snapshot = []
+        for lock, sessions in zip(self._locks, self._maps):
+            with lock:
+                snapshot.extend(sessions.items())
+        return snapshot
+
+    def values(self) -> List[Session]:
+        return [session for _, session in self.items()]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([pid for pid, _ in self.items()])
+
+    def clear(self) -> int:
+        """Drop every session; returns how many were removed."""
+        removed = 0
+        for lock, sessions in zip(self._locks, self._maps):
+            with lock:
+                removed += len(sessions)
+                sessions.clear()
+        self._count.add(-removed)
+        return removed
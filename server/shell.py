@@ -0,0 +1,275 @@
+"""
+Persistent shells on a pseudo-terminal.
+
+A shell keeps its working directory, variables and functions between
+commands, and the commands it runs see a terminal. Each command is followed
+by a printf of a sentinel that carries a per-shell nonce, the command's exit
+status and the working directory; the terminal output up to the sentinel is
+that command's output.
+"""
+
+import asyncio
+import fcntl
+import itertools
+import os
+import re
+import secrets
+import shutil
+import signal
+import subprocess
+import termios
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from server.limits import AccountedProcess
+from server.output import ChangeNotifier, OutputBuffer, OutputMultiplexer, decode_output
+
+# Seconds to wait for the sentinel after Ctrl-C before requesting a new one,
+# and for the new one before the call gives up
+INTERRUPT_PROMPT = 0.1
+INTERRUPT_GRACE = 1.0
+
+# Record separator around sentinels; does not occur in ordinary output
+SENTINEL_MARK = b"\x1e"
+
+
+class ShellBusyError(RuntimeError):
+    """Raised when a shell is still running a previous command."""
+
+
+def _shell_argv(shell: Optional[str]) -> list:
+    shell = shell or shutil.which("bash") or "/bin/sh"
+    if os.path.basename(shell) == "bash":
+        # No startup files, no readline (it would re-enable echo), interactive
+        return [shell, "--noprofile", "--norc", "--noediting", "-i"]
+    return [shell, "-i"]
+
+
+def _configure_tty(fd: int) -> None:
+    """Raw-ish terminal: no echo, no line editing limits, no CRLF translation."""
+    attrs = termios.tcgetattr(fd)
+    attrs[1] &= ~termios.OPOST
+    attrs[3] &= ~(termios.ECHO | termios.ICANON)
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+
+def _take_controlling_tty() -> None:
+    # Runs after setsid(): make the pty the session's terminal so Ctrl-C and
+    # job control reach the foreground command
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class PtyShell:
+    """A long-lived interactive shell whose terminal output feeds an OutputBuffer."""
+
+    def __init__(self, multiplexer: OutputMultiplexer, memory_cap: int,
+                 shell: str = None, cwd: str = None, env: Dict[str, str] = None):
+        master, slave = os.openpty()
+        try:
+            _configure_tty(slave)
+            environ = dict(os.environ)
+            environ.update(env or {})
+            environ.update(TERM="dumb", PS1="", PS2="", PROMPT_COMMAND="", HISTFILE="/dev/null")
+            self.process = AccountedProcess(subprocess.Popen(
+                _shell_argv(shell),
+                stdin=slave,
+                stdout=slave,
+                stderr=slave,
+                cwd=cwd,
+                env=environ,
+                start_new_session=True,
+                preexec_fn=_take_controlling_tty
+            ))
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+
+        self.pid = self.process.pid
+        self.fd = master
+        self.cwd = cwd or os.getcwd()
+        self.started = self.last_used = time.time()
+        self.commands = 0
+        self.notifier = ChangeNotifier()
+        self.memory_cap = memory_cap
+        self.buffer = OutputBuffer(memory_cap, on_change=self.notifier.notify)
+        self._multiplexer = multiplexer
+        self._nonce = secrets.token_hex(8)
+        self._stray = re.compile(
+            re.escape(SENTINEL_MARK + self._nonce.encode()) + rb"-\d+:[^\x1e]*" + re.escape(SENTINEL_MARK)
+        )
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        # Offset where the next command's output starts, how far output has
+        # been searched for the current sentinel, and where it was found
+        self._offset = 0
+        self._scanned = 0
+        self._sentinel_at: Optional[int] = None
+        # Sentinel of a timed-out command that has not finished yet
+        self._pending: Optional[bytes] = None
+        self._closed = False
+
+        multiplexer.register(master, self._on_data, self._on_close)
+        multiplexer.watch_exit(self.pid, self._on_exit)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _on_data(self, data: memoryview) -> None:
+        with self._buffer_lock:
+            self.buffer.append(data)
+
+    def _on_close(self) -> None:
+        with self._buffer_lock:
+            self._closed = True
+            self.buffer.close()
+
+    def _on_exit(self) -> None:
+        self.process.poll()
+        self.notifier.notify()
+
+    async def run(self, command: str, timeout: float = 10) -> Dict[str, Any]:
+        """Run one command line in the shell and return its output and exit code.
+
+        A command still running at the timeout is sent Ctrl-C; if the shell
+        does not come back within INTERRUPT_GRACE the shell stays busy until
+        the command finishes.
+
+        Raises:
+            ShellBusyError: Another command is still running in this shell
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ShellBusyError(f"Shell {self.pid} is busy")
+        try:
+            if self._pending is not None and await self._collect(self._pending, 0) is None:
+                raise ShellBusyError(f"Shell {self.pid} is still running a timed-out command")
+
+            start_time = time.time()
+            self.last_used = start_time
+            self.commands += 1
+            marker = self._start(command)
+            result = await self._collect(marker, timeout)
+            timed_out = result is None
+            if timed_out and self.alive:
+                os.write(self.fd, b"\x03")
+                result = await self._collect(marker, INTERRUPT_PROMPT)
+                if result is None and self.alive:
+                    # Ctrl-C also discards a half-parsed command line along
+                    # with the sentinel, so ask for a fresh one
+                    marker = self._start(None)
+                    result = await self._collect(marker, INTERRUPT_GRACE)
+            if result is None:
+                self._pending = marker
+                result = {
+                    "status": "error",
+                    "error": "Command timed out" if self.alive else "Shell exited",
+                    "exit_code": None,
+                    "output": self._read_text(self._offset, self.buffer.size),
+                    "cwd": self.cwd
+                }
+            elif timed_out:
+                result["status"] = "error"
+                result["error"] = "Command timed out"
+            result["shell_id"] = self.pid
+            result["runtime"] = time.time() - start_time
+            return result
+        finally:
+            self._lock.release()
+
+    def _start(self, command: Optional[str]) -> bytes:
+        """Send a command line (if any) followed by a new sentinel."""
+        with self._buffer_lock:
+            if self._offset == self.buffer.size and self.buffer.size:
+                # Everything so far has been handed out; start a fresh log
+                self.buffer.release()
+                self.buffer = OutputBuffer(self.memory_cap, on_change=self.notifier.notify)
+                self._offset = self._scanned = 0
+        self._sentinel_at = None
+        marker = f"{self._nonce}-{next(self._ids)}".encode()
+        script = "printf '\\036%s:%d:%s\\036' " + marker.decode() + ' "$?" "$PWD"\n'
+        if command is not None:
+            script = command.rstrip("\n") + "\n" + script
+        else:
+            # The shell may drop the first byte read after an interrupt
+            script = "\n" + script
+        view = memoryview(script.encode())
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                time.sleep(0.001)
+        return marker
+
+    async def _collect(self, marker: bytes, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait up to timeout seconds for a command's sentinel and build its result."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            version = self.notifier.version
+            found = self._find(marker)
+            if found is not None:
+                return self._finish(*found)
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self._closed:
+                return None
+            await self.notifier.wait_async(version, remaining)
+
+    def _find(self, marker: bytes) -> Optional[tuple]:
+        """Locate a complete sentinel, scanning only output not searched before."""
+        buffer = self.buffer
+        prefix = SENTINEL_MARK + marker + b":"
+        if self._sentinel_at is None:
+            size = buffer.size
+            start = max(self._offset, self._scanned - len(prefix) + 1)
+            index = buffer.read(start, size).find(prefix)
+            self._scanned = size
+            if index < 0:
+                return None
+            self._sentinel_at = start + index
+        body_start = self._sentinel_at + len(prefix)
+        body = buffer.read(body_start, buffer.size)
+        length = body.find(SENTINEL_MARK)
+        if length < 0:
+            return None
+        return self._sentinel_at, body_start + length + 1, body[:length]
+
+    def _finish(self, begin: int, end: int, body: bytes) -> Dict[str, Any]:
+        output = self._read_text(self._offset, begin)
+        self._offset = self._scanned = end
+        self._sentinel_at = None
+        self._pending = None
+        status, _, cwd = body.partition(b":")
+        exit_code = int(status)
+        self.cwd = cwd.decode(errors="replace")
+        return {
+            "status": "success" if exit_code == 0 else "error",
+            "exit_code": exit_code,
+            "output": output,
+            "cwd": self.cwd
+        }
+
+    def _read_text(self, start: int, end: int) -> str:
+        # Drop sentinels of interrupted commands that turned up late
+        return decode_output(self._stray.sub(b"", self.buffer.read(start, end)))
+
+    def close(self, timeout: float = 1.0) -> Optional[int]:
+        """Hang up the shell and everything started from it."""
+        for sig in (signal.SIGHUP, signal.SIGKILL):
+            try:
+                os.killpg(self.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+            try:
+                self.process.wait(timeout)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        if not self._closed:
+            # A process that escaped the hangup may still hold the terminal open
+            self._multiplexer.discard(self.fd)
+        self.buffer.release()
+        return self.process.returncode
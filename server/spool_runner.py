@@ -0,0 +1,97 @@
+"""
+Parent process of a durable command session.
+
+Started by server.core as a standalone script (it must not import the server
+package) with its stdout and stderr redirected to the session's spool files.
+It runs the command's pipeline stages, waits for them and records how the
+command ended in a status file, so a server that restarted and is no longer
+the parent can still learn the exit code and rusage.
+
+    spool_runner.py STATUS_PATH STAGES_JSON
+
+The status file holds {"exit_code", "pipestatus", "rusage"} and is written
+atomically once every stage has exited. The runner then exits the way the
+last stage did, so a server that is still its parent sees the same status.
+"""
+
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+
+# Exit code of a stage whose program could not be started, as in a shell
+NOT_FOUND = 127
+
+FORWARDED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+def _write_status(path: str, status: dict) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(status, f)
+    os.replace(temporary, path)
+
+
+def main() -> int:
+    status_path, stages = sys.argv[1], json.loads(sys.argv[2])
+    processes = []
+
+    def forward(sig, frame):
+        for process in processes:
+            if process.returncode is None:
+                try:
+                    process.send_signal(sig)
+                except ProcessLookupError:
+                    pass
+
+    for sig in FORWARDED_SIGNALS:
+        signal.signal(sig, forward)
+
+    stdin = subprocess.DEVNULL
+    failed = None
+    for index, argv in enumerate(stages):
+        last = index == len(stages) - 1
+        try:
+            process = subprocess.Popen(argv, stdin=stdin,
+                                       stdout=None if last else subprocess.PIPE)
+        except OSError as e:
+            sys.stderr.write(f"{argv[0]}: {e.strerror}\n")
+            failed = index
+            break
+        if index:
+            # The stage owns the pipe now; holding it open would hide EOF
+            stdin.close()
+        stdin = process.stdout
+        processes.append(process)
+    if failed is not None and stdin not in (None, subprocess.DEVNULL):
+        stdin.close()
+
+    codes = []
+    for process in processes:
+        while True:
+            try:
+                codes.append(process.wait())
+                break
+            except InterruptedError:
+                continue
+    if failed is not None:
+        codes.append(NOT_FOUND)
+
+    exit_code = codes[-1] if codes else NOT_FOUND
+    _write_status(status_path, {
+        "exit_code": exit_code,
+        "pipestatus": codes,
+        "rusage": list(resource.getrusage(resource.RUSAGE_CHILDREN))
+    })
+    sys.stdout.flush()
+    if exit_code < 0:
+        # Die of the same signal
+        signal.signal(-exit_code, signal.SIG_DFL)
+        os.kill(os.getpid(), -exit_code)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
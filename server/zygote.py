@@ -0,0 +1,167 @@
+"""
+Forkserver process for run_python.
+
+Started by server.forkserver as a standalone script (it must not import the
+server package). It preloads modules once, then forks a child per request,
+so each Python command starts from a warm interpreter instead of paying for
+interpreter startup and imports.
+
+Every message on the SOCK_SEQPACKET control socket is one JSON object:
+
+    server -> zygote  {"id", "kind", "target", "args", "cwd", "env", "rlimits"}
+                      with the child's stdout and stderr fds attached
+    zygote -> server  {"ready": true, "preloaded": [...], "failed": [...]}
+                      {"id", "pid"} or {"id", "error"}
+                      {"exit": pid, "status": wait status, "rusage": [...]}
+"""
+
+import importlib
+import json
+import os
+import resource
+import runpy
+import select
+import signal
+import socket
+import sys
+import traceback
+import types
+
+MAX_MESSAGE = 1 << 20
+
+
+def _run(request: dict) -> int:
+    """Run the requested code in this (forked) process and return its exit code."""
+    kind, target, args = request["kind"], request["target"], request.get("args", [])
+    main = types.ModuleType("__main__")
+    sys.modules["__main__"] = main
+    try:
+        if kind == "code":
+            sys.argv = ["-c"] + args
+            sys.path[0] = ""
+            exec(compile(target, "<string>", "exec"), main.__dict__)
+        elif kind == "script":
+            sys.argv = [target] + args
+            sys.path[0] = os.path.dirname(os.path.abspath(target))
+            runpy.run_path(target, run_name="__main__")
+        else:
+            sys.argv = [target] + args
+            sys.path[0] = os.getcwd()
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+def _child(request: dict, stdout_fd: int, stderr_fd: int, control: socket.socket,
+           wake_fds: tuple) -> None:
+    os.setsid()
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    control.close()
+    for fd in wake_fds:
+        os.close(fd)
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    for fd in (devnull, stdout_fd, stderr_fd):
+        os.close(fd)
+
+    code = 1
+    try:
+        for which, soft, hard in request.get("rlimits", []):
+            resource.setrlimit(which, (soft, hard))
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        code = _run(request)
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code)
+
+
+def _reap(control: socket.socket) -> None:
+    while True:
+        try:
+            pid, status, usage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        _send(control, {"exit": pid, "status": status, "rusage": list(usage)})
+
+
+def _send(control: socket.socket, message: dict) -> None:
+    control.send(json.dumps(message).encode())
+
+
+def serve(control: socket.socket, preload: list) -> None:
+    preloaded, failed = [], []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            preloaded.append(name)
+        except Exception:
+            failed.append(name)
+
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    _send(control, {"ready": True, "preloaded": preloaded, "failed": failed})
+
+    while True:
+        try:
+            readable, _, _ = select.select([control, wake_r], [], [])
+        except InterruptedError:
+            continue
+        if wake_r in readable:
+            try:
+                while os.read(wake_r, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            _reap(control)
+        if control not in readable:
+            continue
+
+        data, fds, _, _ = socket.recv_fds(control, MAX_MESSAGE, 2)
+        if not data:
+            # The server went away
+            return
+        request = json.loads(data)
+        if len(fds) != 2:
+            for fd in fds:
+                os.close(fd)
+            _send(control, {"id": request.get("id"), "error": "Missing output pipes"})
+            continue
+        try:
+            pid = os.fork()
+        except OSError as e:
+            pid = None
+            _send(control, {"id": request["id"], "error": str(e)})
+        if pid == 0:
+            _child(request, fds[0], fds[1], control, (wake_r, wake_w))
+        for fd in fds:
+            os.close(fd)
+        if pid:
+            _send(control, {"id": request["id"], "pid": pid})
+
+
+if __name__ == "__main__":
+    # Resolve imports like a fresh interpreter, not from this script's directory
+    sys.path[0] = os.getcwd()
+    serve(socket.socket(fileno=int(sys.argv[1])), sys.argv[2:])
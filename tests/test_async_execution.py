@@ -0,0 +1,179 @@
+"""Tests for the asyncio command execution engine."""
+
+import asyncio
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+
+
+def test_execute_command_async_completes():
+    """A quick command returns the same shape as the sync engine."""
+    result = asyncio.run(core.execute_command_async("echo 'hello world'", timeout=5))
+
+    assert result["status"] == "success"
+    assert result["pid"] is None
+    assert result["exit_code"] == 0
+    assert result["stdout"] == "hello world\n"
+    assert result["stderr"] == ""
+    assert result["complete"] is True
+
+
+def test_execute_command_async_blocked():
+    """Blocked commands are rejected before spawning."""
+    result = asyncio.run(core.execute_command_async("rm -rf /"))
+
+    assert result["status"] == "error"
+    assert result["pid"] is None
+    assert "blocked" in result["stderr"].lower()
+
+
+def test_execute_command_async_timeout_without_background():
+    """A command that outlives its timeout is terminated."""
+    result = asyncio.run(core.execute_command_async("sleep 5", timeout=0.2, allow_background=False))
+
+    assert result["status"] == "error"
+    assert result["error"] == "Command timed out"
+    assert result["pid"] is None
+
+
+def test_background_session_read_async():
+    """Background commands are followed with the async read_output tool."""
+    async def scenario():
+        result = await core.execute_command_async(
+            "sh -c 'echo start; sleep 0.3; echo done'", timeout=0.1
+        )
+        assert result["status"] == "running"
+        pid = result["pid"]
+        output = result["stdout"]
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            chunk = await core.read_output_async(pid)
+            output += chunk["stdout"]
+            if chunk["complete"]:
+                return chunk, output
+            await asyncio.sleep(0.05)
+        pytest.fail("session did not complete")
+
+    final, output = asyncio.run(scenario())
+    assert final["exit_code"] == 0
+    assert output == "start\ndone\n"
+
+
+def test_concurrent_commands_overlap():
+    """Slow commands run concurrently on one event loop."""
+    async def scenario():
+        return await asyncio.gather(*[
+            core.execute_command_async("sleep 0.5", timeout=5) for _ in range(10)
+        ])
+
+    start = time.time()
+    results = asyncio.run(scenario())
+
+    assert all(result["exit_code"] == 0 for result in results)
+    assert time.time() - start < 3
+
+
+def test_read_output_wait_returns_on_new_output():
+    """A long-poll returns as soon as output arrives, not at the deadline."""
+    async def scenario():
+        result = await core.execute_command_async(
+            "sh -c 'sleep 0.3; echo ready; sleep 5'", timeout=0.05
+        )
+        pid = result["pid"]
+        start = time.time()
+        output = await core.read_output_async(pid, wait=5)
+        elapsed = time.time() - start
+        os.kill(pid, 9)
+        return output, elapsed
+
+    output, elapsed = asyncio.run(scenario())
+    assert output["stdout"] == "ready\n"
+    assert elapsed < 2
+
+
+def test_read_output_wait_returns_on_exit():
+    """A long-poll on a silent command returns when the process exits."""
+    result = core.execute_command("sleep 0.3", timeout=0)
+    start = time.time()
+    output = core.read_output(result["pid"], wait=5)
+
+    assert output["complete"] is True
+    assert output["exit_code"] == 0
+    assert time.time() - start < 2
+
+
+class RecordingContext:
+    """Stand-in for the MCP request context that records notifications."""
+
+    def __init__(self):
+        self.logs = []
+        self.progress = []
+
+    async def log(self, level, message, logger_name=None):
+        self.logs.append((logger_name, message))
+
+    async def report_progress(self, progress, total=None):
+        self.progress.append(progress)
+
+
+def test_read_output_stream_pushes_chunks():
+    """Streaming mode pushes every chunk as a notification until completion."""
+    async def scenario():
+        result = await core.execute_command_async(
+            "sh -c 'echo one; sleep 0.2; echo two; sleep 0.2; echo three'", timeout=0.05
+        )
+        ctx = RecordingContext()
+        final = await core.read_output_async(result["pid"], wait=5, stream=True, ctx=ctx)
+        return result, ctx, final
+
+    result, ctx, final = asyncio.run(scenario())
+    pid = result["pid"]
+    pushed = "".join(message for name, message in ctx.logs if name == f"session.{pid}.stdout")
+
+    assert result["stdout"] + pushed == "one\ntwo\nthree\n"
+    assert final["complete"] is True
+    assert final["stdout"] == ""
+    assert final["streamed"]["stdout"] == len(pushed)
+    assert ctx.progress[-1] == len(pushed)
+
+
+def test_execute_commands_batch():
+    """A batch runs concurrently and returns results in input order."""
+    commands = ["sh -c 'sleep 0.4; echo a'", "echo b", "sh -c 'sleep 0.4; echo c'", "exit 1"]
+    start = time.time()
+    batch = asyncio.run(core.execute_commands(commands, max_parallel=4, timeout=5))
+
+    assert [result["command"] for result in batch["results"]] == commands
+    assert [result["stdout"] for result in batch["results"][:3]] == ["a\n", "b\n", "c\n"]
+    assert batch["succeeded"] == 3
+    assert batch["failed"] == 1
+    assert batch["status"] == "error"
+    assert batch["wall_time"] < batch["total_runtime"]
+    assert time.time() - start < 2
+
+
+def test_execute_commands_respects_parallelism():
+    """No more than max_parallel commands run at once."""
+    commands = ["sleep 0.2"] * 4
+    batch = asyncio.run(core.execute_commands(commands, max_parallel=2, timeout=5))
+
+    assert batch["status"] == "success"
+    assert batch["wall_time"] >= 0.4
+
+
+def test_execute_commands_counts_background_commands_as_pending():
+    """Commands still running in the background are neither succeeded nor failed."""
+    commands = ["echo done", "sleep 5"]
+    batch = asyncio.run(core.execute_commands(commands, timeout=0.2, allow_background=True))
+
+    assert (batch["succeeded"], batch["failed"], batch["pending"]) == (1, 0, 1)
+    assert batch["status"] == "running"
+    asyncio.run(core.force_terminate(batch["results"][1]["pid"]))
@@ -0,0 +1,89 @@
+"""Tests for the command result cache."""
+
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.cache import CommandCache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    core.command_cache.clear()
+    yield
+    core.command_cache.clear()
+
+
+def test_cache_ttl_and_lru():
+    """Entries expire after their TTL and the oldest entry is evicted first."""
+    cache = CommandCache(max_entries=2)
+    cache.put(("a",), {"stdout": "a"}, ttl=60)
+    cache.put(("b",), {"stdout": "b"}, ttl=60)
+    assert cache.get(("a",)) == {"stdout": "a"}
+
+    cache.put(("c",), {"stdout": "c"}, ttl=60)
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) is not None
+
+    cache.put(("d",), {"stdout": "d"}, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get(("d",)) is None
+    assert cache.stats()["evictions"] >= 1
+
+
+def test_execute_command_cache_hit():
+    """A repeated invocation is served from the cache."""
+    command = f'{sys.executable} -c "import time; print(time.time())"'
+    first = core.execute_command(command, timeout=5, cache_ttl=60)
+    second = core.execute_command(command, timeout=5, cache_ttl=60)
+    uncached = core.execute_command(command, timeout=5)
+
+    assert "cached" not in first
+    assert second["cached"] is True
+    assert second["stdout"] == first["stdout"]
+    assert uncached["stdout"] != first["stdout"]
+    assert core.command_cache.stats()["hits"] == 1
+
+
+def test_execute_command_cache_invalidated_by_input(temp_dir):
+    """Changing a declared input file changes the cache key."""
+    path = os.path.join(temp_dir, "input.txt")
+    with open(path, "w") as f:
+        f.write("one")
+
+    first = core.execute_command(f"cat {path}", timeout=5, cache_ttl=60, cache_inputs=[path])
+    with open(path, "w") as f:
+        f.write("second")
+    second = core.execute_command(f"cat {path}", timeout=5, cache_ttl=60, cache_inputs=[path])
+
+    assert first["stdout"] == "one"
+    assert second["stdout"] == "second"
+    assert "cached" not in second
+
+
+def test_limits_are_part_of_the_key():
+    """A result produced under limits is not replayed for an unlimited run."""
+    command = f'{sys.executable} -c "x = bytearray(256 << 20); print(len(x) >> 20)"'
+    limited = core.execute_command(command, timeout=10, cache_ttl=60,
+                                   limits={"memory_bytes": 128 << 20})
+    unlimited = core.execute_command(command, timeout=10, cache_ttl=60)
+
+    assert limited["exit_code"] != 0
+    assert "cached" not in unlimited
+    assert unlimited["stdout"] == "256\n"
+    again = core.execute_command(command, timeout=10, cache_ttl=60,
+                                 limits={"memory_bytes": float(128 << 20)})
+    assert again["cached"] is True and again["exit_code"] == limited["exit_code"]
+
+
+def test_signalled_results_are_not_stored():
+    """A command killed by a signal is run again rather than replayed."""
+    first = core.execute_command("sh -c 'kill -9 $$'", timeout=5, cache_ttl=60)
+    second = core.execute_command("sh -c 'kill -9 $$'", timeout=5, cache_ttl=60)
+
+    assert first["exit_code"] == -9
+    assert "cached" not in second
@@ -0,0 +1,168 @@
+"""Tests for the compiled command policy."""
+
+import os
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.policy import CommandPolicy
+
+
+@pytest.fixture
+def policy():
+    return CommandPolicy(deny=["rm -rf /", "mkfs*"])
+
+
+@pytest.mark.parametrize("command", [
+    "rm -rf /",
+    "rm   -rf   /",
+    "rm -fr /",
+    "rm -r -f /",
+    "/bin/rm -rf //",
+    "rm -rf -- /",
+    "sudo rm -rf /",
+    "cd /tmp; rm -rf / && echo done",
+    "echo $(rm -rf /)",
+    "rm '-rf' \"/\"",
+    "rm --recursive --force /",
+    "rm --recur --force /",
+    "rm -R --force /",
+    "rm -rf /*",
+    'sh -c "rm -rf /*"',
+    'sh -c "cd / && rm -rf ."',
+    "rm -r -f ~/../../",
+    "cd / && rm -rf *",
+    "rm -rf ../..",
+])
+def test_respellings_are_blocked(policy, command):
+    assert policy.check(command) == "rm -rf /"
+
+
+@pytest.mark.parametrize("command", [
+    "rm -rf /tmp/build",
+    "rm -f /",
+    "ls -la /",
+    "rm -rf /tmp/*",
+    "rm -rf *",
+    "rm -rf ../build",
+    "cd /tmp && rm -rf .",
+])
+def test_other_arguments_are_allowed(policy, command):
+    assert policy.check(command) is None
+
+
+@pytest.mark.parametrize("command,rule", [
+    ('sh -c "rm -rf /"', "rm -rf /"),
+    ("bash -c 'rm -rf /'", "rm -rf /"),
+    ('sh -c "mkfs.ext4 /dev/sda"', "mkfs*"),
+    ("bash -o pipefail -ec 'cd /tmp && rm -rf /'", "rm -rf /"),
+    ("zsh -c 'sh -c \"rm -rf /\"'", "rm -rf /"),
+    ('env rm -rf /', "rm -rf /"),
+    ('env -S "rm -rf /"', "rm -rf /"),
+    ('echo x | xargs sh -c "rm -rf /"', "rm -rf /"),
+    ('nohup sh -c "rm -rf /" &', "rm -rf /"),
+    ('timeout 5 bash -c "rm -rf /"', "rm -rf /"),
+    ('sudo -u root sh -c "rm -rf /"', "rm -rf /"),
+    ('su -c "rm -rf /" root', "rm -rf /"),
+    ("eval 'rm -rf /'", "rm -rf /"),
+])
+def test_scripts_passed_to_shells_are_checked(policy, command, rule):
+    assert policy.check(command) == rule
+
+
+def test_prefix_rule_matches_variants(policy):
+    assert policy.check("mkfs") == "mkfs*"
+    assert policy.check("mkfs.ext4 /dev/sdb1") == "mkfs*"
+    assert policy.check("echo hi | /sbin/mkfs.xfs /dev/null") == "mkfs*"
+
+
+def test_allow_rule_is_an_exception(policy):
+    policy.block("git push --force")
+    policy.allow("git push --force origin scratch")
+
+    assert policy.check("git push -v --force origin main") == "git push --force"
+    assert policy.check("git push --force origin scratch") is None
+
+
+@pytest.mark.parametrize("command", [
+    "ls && rm -rf /",
+    "ls; rm -rf /",
+    "ls | xargs rm -rf /",
+    "ls -la $(rm -rf /)",
+    "sh -c 'ls && rm -rf /'",
+])
+def test_allow_rule_only_exempts_the_denied_command(policy, command):
+    policy.allow("ls")
+
+    assert policy.check(command) == "rm -rf /"
+
+
+def test_substring_allow_rule_must_cover_the_denied_text(policy):
+    policy.block("DROP TABLE", match="substring")
+    policy.allow("DROP TABLE scratch", match="substring")
+
+    assert policy.check("psql -c 'DROP TABLE scratch'") is None
+    assert policy.check("psql -c 'DROP TABLE users; DROP TABLE scratch'") == "DROP TABLE"
+
+
+def test_updates_are_incremental(policy):
+    assert policy.check("shutdown -h now") is None
+    assert policy.block("shutdown")
+    assert not policy.block("shutdown")
+    assert policy.check("shutdown -h now") == "shutdown"
+
+    assert policy.unblock("shutdown")
+    assert not policy.unblock("shutdown")
+    assert policy.check("shutdown -h now") is None
+
+
+def test_substring_rules(policy):
+    policy.block(":(){ :|:& };:", match="substring")
+    policy.block("DROP TABLE", match="substring")
+
+    assert policy.check("psql -c 'DROP   TABLE users'") == "DROP TABLE"
+    assert policy.check(":(){ :|:& };:") == ":(){ :|:& };:"
+    assert policy.check("psql -c 'SELECT 1'") is None
+
+    policy.unblock("DROP TABLE")
+    assert policy.check("psql -c 'DROP TABLE users'") is None
+
+
+def test_behaves_as_a_set_of_deny_rules(policy):
+    policy.add("halt")
+    assert "halt" in policy
+    assert set(policy) == {"rm -rf /", "mkfs*", "halt"}
+
+    policy.remove("halt")
+    assert "halt" not in policy
+    with pytest.raises(KeyError):
+        policy.remove("halt")
+
+
+def test_many_rules_stay_exact():
+    policy = CommandPolicy(deny=[f"tool{i} --flag /data{i}" for i in range(5000)])
+
+    assert policy.check("tool4999 --flag /data4999") == "tool4999 --flag /data4999"
+    assert policy.check("tool4999 --flag /data4998") is None
+
+
+def test_block_and_unblock_tools():
+    rule = "test-policy-tool --dangerous"
+    try:
+        result = core.block_command(rule)
+        assert result["status"] == "success"
+        assert not core.is_command_safe("test-policy-tool -v --dangerous x")
+
+        assert core.unblock_command(rule)["status"] == "success"
+        assert core.is_command_safe("test-policy-tool -v --dangerous x")
+    finally:
+        core.command_policy.unblock(rule)
+
+
+def test_block_rejects_unknown_match_kind():
+    result = core.block_command("anything", match="regex")
+
+    assert result["status"] == "error"
+    assert "Unknown match kind" in result["error"]
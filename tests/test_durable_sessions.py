@@ -0,0 +1,122 @@
+"""Tests for durable command sessions and their reattachment after a restart."""
+
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.journal import SessionJournal
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = SessionJournal(str(tmp_path / "journal"))
+    monkeypatch.setattr(core, "session_journal", journal)
+    return journal
+
+
+def read_until_complete(pid, timeout=10):
+    deadline = time.monotonic() + timeout
+    stdout = ""
+    while time.monotonic() < deadline:
+        result = core.read_output(pid)
+        stdout += result["stdout"]
+        if result["complete"]:
+            return stdout, result
+        time.sleep(0.05)
+    raise AssertionError(f"session {pid} did not complete")
+
+
+def test_durable_command_output_and_exit_code(journal):
+    result = core.execute_command("sh -c 'echo out; echo err >&2; exit 3'", durable=True)
+
+    assert result["stdout"] == "out\n"
+    assert result["stderr"] == "err\n"
+    assert result["exit_code"] == 3
+
+
+def test_durable_pipeline_reports_pipestatus(journal):
+    result = core.execute_command("sh -c 'echo a; exit 2' | cat", durable=True)
+
+    assert result["stdout"] == "a\n"
+    assert result["pipestatus"] == [2, 0]
+
+
+def test_journal_is_cleaned_up_with_the_session(journal):
+    pid = core.execute_command("sleep 0.2", timeout=0, durable=True)["pid"]
+    assert [entry["pid"] for entry in journal.entries()] == [pid]
+
+    # Reading the final output releases the session
+    read_until_complete(pid)
+
+    assert os.listdir(journal.directory) == []
+
+
+def test_durable_rejects_open_stdin(journal):
+    result = core.execute_command("cat", durable=True, open_stdin=True)
+    assert result["status"] == "error"
+
+
+def test_reattach_after_restart(journal):
+    # A separate server process starts the command and exits without waiting
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {ROOT!r})
+        from server import core
+        result = core.execute_command(
+            sys.executable + " -c \\"import time; time.sleep(1); print('done')\\"",
+            timeout=0, durable=True)
+        print(result["pid"])
+    """)
+    env = dict(os.environ, MCP_SESSION_JOURNAL=journal.directory)
+    server = subprocess.run([sys.executable, "-c", script], env=env,
+                            capture_output=True, text=True, timeout=60)
+    pid = int(server.stdout.split()[-1])
+
+    summary = core.reattach_sessions()
+    assert summary["reattached"] == 1
+
+    stdout, result = read_until_complete(pid)
+    assert stdout == "done\n"
+    assert result["exit_code"] == 0
+
+
+def test_killed_durable_command_is_lost(journal):
+    entry = journal.create("sleep 30")
+    runner = subprocess.Popen(["sleep", "30"], start_new_session=True)
+    entry.update(pid=runner.pid, create_time=core.psutil.Process(runner.pid).create_time())
+    journal.record(entry)
+    open(entry["stdout"], "w").close()
+    open(entry["stderr"], "w").close()
+
+    assert core.reattach_sessions()["reattached"] == 1
+    runner.send_signal(signal.SIGKILL)
+    runner.wait()
+
+    _, result = read_until_complete(runner.pid)
+    assert result["lost"] is True
+    assert result["status"] == "error"
+    assert result["exit_code"] is None
+
+
+def test_core_server_reattaches_before_serving(monkeypatch):
+    import run_servers
+
+    calls = []
+    monkeypatch.setattr(core, "reattach_sessions",
+                        lambda: calls.append("reattach") or {"reattached": 0, "exited": 0})
+    monkeypatch.setattr(run_servers.uvicorn, "run", lambda app, **kwargs: calls.append("serve"))
+
+    run_servers.run_core_server()
+
+    assert calls == ["reattach", "serve"]
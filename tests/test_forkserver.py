@@ -0,0 +1,115 @@
+"""Tests for run_python and the forkserver it uses."""
+
+import asyncio
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses fork")
+
+
+def run_python(**kwargs):
+    return asyncio.run(core.run_python(**kwargs))
+
+
+def test_code_output_and_exit_code():
+    result = run_python(code="import sys; print('hello', sys.argv[1:]); sys.exit(3)", args=["a", "b"])
+
+    assert result["status"] == "error"
+    assert result["exit_code"] == 3
+    assert result["stdout"] == "hello ['a', 'b']\n"
+    assert result["complete"] is True
+    assert result["rusage"]["max_rss_kb"] > 0
+
+
+def test_script_and_module(temp_dir):
+    script = os.path.join(temp_dir, "script.py")
+    with open(script, "w") as f:
+        f.write("import sys\nprint(__name__, sys.argv[1])\n")
+
+    result = run_python(script=script, args=["x"])
+    assert result["exit_code"] == 0
+    assert result["stdout"] == "__main__ x\n"
+
+    result = run_python(module="json.tool", args=["--help"])
+    assert result["exit_code"] == 0
+    assert "usage" in result["stdout"]
+
+
+def test_uncaught_exception_goes_to_stderr():
+    result = run_python(code="raise ValueError('boom')")
+
+    assert result["exit_code"] == 1
+    assert "ValueError: boom" in result["stderr"]
+
+
+def test_exactly_one_target_required():
+    assert run_python()["status"] == "error"
+    assert run_python(code="pass", module="json")["status"] == "error"
+
+
+def test_timing_reports_saved_startup():
+    run_python(code="pass")
+    result = run_python(code="pass")
+
+    timing = result["timing"]
+    assert timing["warm"] is True
+    assert timing["cold_start_ms"] > 0
+    assert timing["saved_ms"] == pytest.approx(timing["cold_start_ms"] - timing["spawn_ms"])
+
+
+def test_background_command_is_reaped():
+    result = run_python(code="import time; time.sleep(0.5); print('done')", timeout=0.1)
+    assert result["status"] == "running"
+
+    time.sleep(1)
+    output = core.read_output(result["pid"])
+    assert output["exit_code"] == 0
+    assert output["stdout"] == "done\n"
+
+
+def test_cpu_limit_applies_to_forked_process():
+    result = run_python(code="while True: pass", limits={"cpu_seconds": 1}, timeout=5)
+
+    assert result["exit_code"] < 0
+    assert result["limit_exceeded"] == "cpu_seconds"
+
+
+def test_lost_forkserver_does_not_hang_commands():
+    result = run_python(code="import time; time.sleep(30)", timeout=0.1)
+    assert result["status"] == "running"
+
+    core.python_forkserver.stop()
+    os.kill(result["pid"], 9)
+    output = core.read_output(result["pid"], wait=5)
+    assert output["complete"] is True
+    assert output["exit_code"] is None
+    assert run_python(code="print('again')")["stdout"] == "again\n"
+
+
+def test_queued_run_python_starts_when_admitted(monkeypatch):
+    """A queued run_python is forked once a slot frees, without stalling on its reply."""
+    monkeypatch.setattr(core, "command_scheduler", core.CommandScheduler(1))
+    first = core.execute_command("sleep 0.3", timeout=0)
+    queued = run_python(code="print('later')", timeout=0)
+    assert queued["status"] == "queued"
+
+    deadline = time.time() + 5
+    status = core.queue_status(queued["ticket"])
+    while status["pid"] is None and status["state"] != "failed" and time.time() < deadline:
+        time.sleep(0.05)
+        status = core.queue_status(queued["ticket"])
+
+    assert status["state"] in ("running", "finished"), status
+    stdout = ""
+    output = {"complete": False}
+    while not output["complete"] and time.time() < deadline + 5:
+        output = core.read_output(status["pid"], wait=1)
+        stdout += output["stdout"]
+    assert stdout == "later\n"
+    core.read_output(first["pid"], wait=5)
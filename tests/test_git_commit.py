@@ -0,0 +1,66 @@
+"""Tests for batched staging in git_operation('commit')."""
+
+import os
+import subprocess
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+
+pytestmark = pytest.mark.skipif(
+    subprocess.run(["git", "--version"], capture_output=True).returncode != 0,
+    reason="git is not installed"
+)
+
+
+def git(repo, *args):
+    return subprocess.run(["git", *args], cwd=repo, check=True,
+                          capture_output=True, text=True).stdout
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    git(path, "init", "-q")
+    git(path, "config", "user.name", "Ada")
+    git(path, "config", "user.email", "ada@example.com")
+    monkeypatch.chdir(path)
+    return path
+
+
+def test_commit_stages_many_files_at_once(repo):
+    # Long names: together they are far beyond a single argv's length limit
+    names = [f"generated/{'x' * 200}-{i}.txt" for i in range(2000)]
+    os.makedirs("generated")
+    for name in names:
+        with open(name, "w") as f:
+            f.write(name)
+
+    result = core.git_operation("commit", {"message": "Add generated files", "files": names})
+
+    assert result["status"] == "success"
+    assert result["files_staged"] == 2000
+    assert set(result["timing"]) == {"stage_seconds", "commit_seconds"}
+    assert len(git(repo, "ls-files").splitlines()) == 2000
+
+
+def test_commit_handles_unusual_names_and_messages(repo):
+    for name in ("-n", "with space.txt"):
+        with open(name, "w") as f:
+            f.write("x")
+    message = "Subject | with pipe\n\n-m is not an option here"
+
+    result = core.git_operation("commit", {"message": message, "files": ["-n", "with space.txt"]})
+
+    assert result["status"] == "success"
+    assert git(repo, "log", "-1", "--format=%B").strip() == message
+    assert sorted(git(repo, "ls-files").splitlines()) == ["-n", "with space.txt"]
+
+
+def test_commit_reports_missing_paths(repo):
+    result = core.git_operation("commit", {"message": "nothing", "files": "missing.txt"})
+
+    assert result["status"] == "error"
+    assert "missing.txt" in result["error"]
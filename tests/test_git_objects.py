@@ -0,0 +1,180 @@
+"""Tests for the long-lived git cat-file object readers."""
+
+import io
+import os
+import subprocess
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server import gitobjects
+from server.gitobjects import GitError, ObjectReader, ObjectReaderPool, iter_records
+
+pytestmark = pytest.mark.skipif(
+    subprocess.run(["git", "--version"], capture_output=True).returncode != 0,
+    reason="git is not installed"
+)
+
+
+def git(repo, *args, date=None):
+    env = dict(os.environ, GIT_AUTHOR_NAME="Ada", GIT_AUTHOR_EMAIL="ada@example.com",
+               GIT_COMMITTER_NAME="Ada", GIT_COMMITTER_EMAIL="ada@example.com")
+    if date:
+        env["GIT_AUTHOR_DATE"] = env["GIT_COMMITTER_DATE"] = date
+    return subprocess.run(["git", *args], cwd=repo, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def commit(repo, name, content, message, date):
+    with open(os.path.join(repo, name), "w") as f:
+        f.write(content)
+    git(repo, "add", name)
+    git(repo, "commit", "-q", "-m", message, date=date)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """A history with a merge: main has a, c, merge; topic has b."""
+    path = str(tmp_path)
+    git(path, "init", "-q", "-b", "main")
+    commit(path, "a.txt", "a\n", "feat: first", "1700000000 +0200")
+    git(path, "checkout", "-q", "-b", "topic")
+    commit(path, "b.txt", "b\n", "fix: second\n\nwith a body", "1700000100 -0500")
+    git(path, "checkout", "-q", "main")
+    commit(path, "c.txt", "c\n", "docs: third | with a pipe", "1700000200 +0000")
+    git(path, "tag", "v1")
+    git(path, "merge", "-q", "--no-ff", "-m", "Merge topic", "topic", date="1700000300 +0000")
+    return path
+
+
+def test_read_reuses_one_process(repo):
+    reader = ObjectReader(repo)
+    try:
+        blob = reader.read("HEAD:a.txt")
+        pid = reader._idle[False][0].process.pid
+        assert (blob.type, blob.size, blob.data) == ("blob", 2, b"a\n")
+        assert reader.read("v1:c.txt").data == b"c\n"
+        assert reader._idle[False][0].process.pid == pid
+        assert reader.read("HEAD:missing.txt") is None
+        assert reader.info("HEAD").type == "commit"
+    finally:
+        reader.close()
+    assert reader.processes == 0
+
+
+def test_log_matches_git_log(repo):
+    expected = git(repo, "log", "--pretty=format:%H|%an|%ad|%s").split("\n")
+    reader = ObjectReader(repo)
+    try:
+        commits = reader.log()
+    finally:
+        reader.close()
+
+    assert [f"{c['hash']}|{c['author']}|{c['date']}|{c['subject']}" for c in commits] == expected
+
+
+def test_log_range_matches_git_log(repo):
+    expected = git(repo, "log", "--pretty=format:%H", "v1..main").split("\n")
+    reader = ObjectReader(repo)
+    try:
+        assert [c["hash"] for c in reader.log("main", exclude="v1")] == expected
+        assert len(reader.log(limit=2)) == 2
+        with pytest.raises(GitError):
+            reader.log("no-such-branch")
+    finally:
+        reader.close()
+
+
+def test_pool_evicts_idle_readers(repo):
+    pool = ObjectReaderPool(idle_timeout=0)
+    reader = pool.get(os.path.join(repo, "."))
+    assert pool.get(repo) is reader
+    process = reader.read("HEAD") and reader._idle[False][0].process
+
+    assert pool.evict_idle() == 1
+    assert len(pool) == 0
+    assert process.poll() is not None
+    assert pool.get(repo) is not reader
+    pool.close()
+
+
+def test_git_operation_log_and_show(repo, monkeypatch):
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(core, "git_readers", ObjectReaderPool())
+
+    log = core.git_operation("log", {"limit": "2"})
+    assert [c["message"] for c in log["commits"]] == ["Merge topic", "docs: third | with a pipe"]
+
+    shown = core.git_operation("show", {"rev": "v1", "file": "c.txt"})
+    assert shown["type"] == "blob"
+    assert shown["content"] == "c\n"
+    assert core.git_operation("show", {"rev": "HEAD"})["commit"]["subject"] == "Merge topic"
+    assert core.git_operation("show", {"rev": "nope"})["status"] == "error"
+    core.git_readers.close()
+
+
+def test_log_pages_follow_git_log(repo):
+    expected = git(repo, "log", "--pretty=format:%H").split("\n")
+    reader = ObjectReader(repo)
+    try:
+        hashes, cursor = [], None
+        for _ in expected:
+            commits, cursor = reader.log_page(1, cursor)
+            hashes += [commit["hash"] for commit in commits]
+        assert cursor is None
+    finally:
+        reader.close()
+
+    assert hashes == expected
+
+
+def test_log_pages_with_equal_dates_do_not_repeat(tmp_path):
+    """Pages resumed from the frontier skip commits returned earlier."""
+    path = str(tmp_path)
+    date = "1700000000 +0000"
+    git(path, "init", "-q", "-b", "main")
+    commit(path, "y.txt", "y\n", "Y", date)
+    commit(path, "p1.txt", "p1\n", "P1", date)
+    git(path, "checkout", "-q", "-b", "topic")
+    commit(path, "p2.txt", "p2\n", "P2", date)
+    git(path, "checkout", "-q", "main")
+    git(path, "merge", "-q", "--no-ff", "-m", "M", "topic", date=date)
+    expected = git(path, "log", "--pretty=format:%s").split("\n")
+
+    reader = ObjectReader(path)
+    try:
+        subjects, cursor = [], None
+        while True:
+            commits, cursor = reader.log_page(2, cursor)
+            subjects += [commit["subject"] for commit in commits]
+            if cursor is None:
+                break
+    finally:
+        reader.close()
+
+    assert subjects == expected
+
+
+def test_iter_records_across_chunks(monkeypatch):
+    monkeypatch.setattr(gitobjects, "READ_SIZE", 3)
+    stream = io.BytesIO(b"a1\0Ada\0fix | pipes\0a2\0Bob\0last")
+
+    assert list(iter_records(stream, 3)) == [["a1", "Ada", "fix | pipes"], ["a2", "Bob", "last"]]
+
+
+def test_git_operation_log_pages_by_file(repo, monkeypatch):
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(core, "git_readers", ObjectReaderPool())
+    commit(repo, "c.txt", "c2\n", "docs: c | again", "1700000400 +0000")
+
+    first = core.git_operation("log", {"file": "c.txt", "limit": "1"})
+    second = core.git_operation("log", {"file": "c.txt", "limit": "1", "after": first["next_cursor"]})
+
+    assert [c["message"] for c in first["commits"]] == ["docs: c | again"]
+    assert [c["message"] for c in second["commits"]] == ["docs: third | with a pipe"]
+    assert second["next_cursor"] is None
+    whole = core.git_operation("log", {})
+    assert len(whole["commits"]) == 5 and whole["next_cursor"] is None
+    core.git_readers.close()
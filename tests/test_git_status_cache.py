@@ -0,0 +1,134 @@
+"""Tests for the inotify-invalidated git status cache."""
+
+import errno
+import os
+import subprocess
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core, inotify
+from server.gitstatus import GitStatusCache
+
+pytestmark = pytest.mark.skipif(not inotify.available(), reason="Needs inotify")
+
+
+def git(repo, *args):
+    subprocess.run(["git", "-c", "user.name=Ada", "-c", "user.email=ada@example.com", *args],
+                   cwd=repo, check=True, capture_output=True)
+
+
+def write(repo, name, content):
+    path = os.path.join(repo, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = str(tmp_path)
+    git(path, "init", "-q")
+    write(path, ".gitignore", "build/\n")
+    write(path, "src/app.py", "print('hi')\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "initial")
+    os.makedirs(os.path.join(path, "build"))
+    return path
+
+
+@pytest.fixture
+def cache():
+    cache = GitStatusCache()
+    yield cache
+    cache.close()
+
+
+def test_unchanged_tree_is_served_from_cache(repo, cache):
+    assert cache.status(repo) == ("", False)
+    assert cache.status(repo) == ("", True)
+    assert cache.stats()["hit_ratio"] == 0.5
+
+
+def test_edits_invalidate(repo, cache):
+    cache.status(repo)
+
+    write(repo, "src/app.py", "print('bye')\n")
+    assert cache.status(repo) == (" M src/app.py\n", False)
+
+    # A new directory is watched before status runs again
+    write(repo, "docs/new/readme.md", "x\n")
+    assert cache.status(repo)[0] == " M src/app.py\n?? docs/\n"
+    write(repo, "docs/new/more.md", "y\n")
+    assert cache.status(repo)[1] is False
+
+
+def test_index_and_ref_changes_invalidate(repo, cache):
+    write(repo, "src/app.py", "print('bye')\n")
+    cache.status(repo)
+
+    git(repo, "add", "src/app.py")
+    assert cache.status(repo) == ("M  src/app.py\n", False)
+    git(repo, "reset", "-q", "--soft", "HEAD")
+    git(repo, "commit", "-q", "-m", "second")
+    assert cache.status(repo) == ("", False)
+    git(repo, "update-ref", "HEAD", "HEAD~1")
+    assert cache.status(repo)[0] != ""
+
+
+def test_ignored_directories_are_not_watched(repo, cache):
+    cache.status(repo)
+
+    write(repo, "build/out.o", "binary")
+    assert cache.status(repo) == ("", True)
+
+    # Un-ignoring build/ rebuilds the watches
+    write(repo, ".gitignore", "")
+    assert cache.status(repo) == (" M .gitignore\n?? build/\n", False)
+    write(repo, "build/other.o", "binary")
+    assert cache.status(repo)[1] is False
+
+
+def test_new_ignored_directories_are_not_watched(repo, cache):
+    cache.status(repo)
+
+    write(repo, "lib/build/out.o", "binary")
+    assert cache.status(repo) == ("", False)
+    watches = cache.stats()["watches"]
+
+    write(repo, "lib/build/more/other.o", "binary")
+    assert cache.status(repo) == ("", True)
+    assert cache.stats()["watches"] == watches
+
+
+def test_watch_limit_falls_back_to_uncached_status(repo, cache):
+    cache.status(repo)
+    watcher = cache._repos[repo].watcher
+
+    def add_watch(path, mask):
+        raise OSError(errno.ENOSPC, "inotify_add_watch: No space left on device")
+
+    watcher._inotify.add_watch = add_watch
+    write(repo, "docs/readme.md", "x\n")
+
+    assert cache.status(repo) == ("?? docs/\n", False)
+    assert cache.stats()["unwatchable"] == 1
+    write(repo, "docs/more.md", "y\n")
+    assert cache.status(repo) == ("?? docs/\n", False)
+    write(repo, "notes.txt", "z\n")
+    assert cache.status(repo) == ("?? docs/\n?? notes.txt\n", False)
+
+
+def test_git_operation_status_reports_cache(repo, monkeypatch):
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(core, "git_status_cache", GitStatusCache())
+    write(repo, "notes.txt", "x\n")
+
+    first = core.git_operation("status")
+    second = core.git_operation("status")
+
+    assert first["changes"]["untracked"] == ["notes.txt"]
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert core.session_stats()["git_status_cache"]["hits"] == 1
+    core.git_status_cache.close()
@@ -0,0 +1,241 @@
+"""Tests for session output capture."""
+
+import base64
+import os
+import sys
+import threading
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.output import OutputBuffer, OutputMultiplexer
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX pipes")
+
+
+def test_multiplexer_reads_pipe_until_eof():
+    """Chunks are delivered and the close callback fires on EOF."""
+    mux = OutputMultiplexer(chunk_size=4)
+    r, w = os.pipe()
+    chunks = []
+    closed = threading.Event()
+    # Chunks are views of a reused read buffer
+    mux.register(r, lambda data: chunks.append(bytes(data)), closed.set)
+
+    os.write(w, b"hello world")
+    os.close(w)
+
+    assert closed.wait(2)
+    assert b"".join(chunks) == b"hello world"
+    assert mux.watched == 0
+
+
+def test_multiplexer_discard_releases_open_pipe():
+    """Discarding a pipe that never reaches EOF still closes it."""
+    mux = OutputMultiplexer()
+    r, w = os.pipe()
+    closed = threading.Event()
+    mux.register(r, lambda data: None, closed.set)
+    mux.discard(r)
+
+    assert closed.wait(2)
+    os.close(w)
+
+
+def test_execute_command_captures_both_streams():
+    """Large output on both pipes does not deadlock the capture."""
+    script = (
+        "import sys; "
+        "sys.stdout.write('o' * 200000); "
+        "sys.stderr.write('e' * 200000)"
+    )
+    result = core.execute_command(f'{sys.executable} -c "{script}"', timeout=10)
+
+    assert result["exit_code"] == 0
+    assert len(result["stdout"]) == 200000
+    assert len(result["stderr"]) == 200000
+
+
+def test_concurrent_sessions_share_one_thread():
+    """Background sessions do not each get their own reader thread."""
+    pids = []
+    before = threading.active_count()
+    for _ in range(10):
+        result = core.execute_command("sleep 1", timeout=0)
+        pids.append(result["pid"])
+
+    assert all(pids)
+    assert threading.active_count() <= before + 1
+
+    deadline = time.time() + 5
+    while pids and time.time() < deadline:
+        pids = [pid for pid in pids if not core.read_output(pid)["complete"]]
+        time.sleep(0.1)
+    assert not pids
+
+
+def test_invalid_utf8_is_replaced():
+    """Undecodable output is replaced rather than raising."""
+    result = core.execute_command(
+        f"{sys.executable} -c \"import sys; sys.stdout.buffer.write(b'ok\\xff')\"",
+        timeout=5
+    )
+
+    assert result["exit_code"] == 0
+    assert result["stdout"] == "ok�"
+
+
+def test_output_buffer_spills_beyond_memory_cap():
+    """Only the newest bytes stay in memory; history remains readable."""
+    buf = OutputBuffer(memory_cap=16)
+    data = b"".join(str(i).encode() + b"\n" for i in range(1000))
+    for start in range(0, len(data), 7):
+        buf.append(data[start:start + 7])
+
+    assert buf.memory_bytes == 16
+    assert buf.spilled == len(data) - 16
+    assert buf.read() == data
+    assert buf.read(100, 130) == data[100:130]
+    assert buf.read(len(data) - 20) == data[-20:]
+
+
+def test_output_buffer_drain_and_history():
+    """drain() returns only new output while history() returns everything."""
+    buf = OutputBuffer(memory_cap=8)
+    buf.append(b"first line\n")
+    assert buf.drain() == "first line\n"
+
+    buf.append(b"second\r\n")
+    buf.append("caf\u00e9".encode()[:-1])
+    assert buf.drain() == "second\ncaf"
+    buf.append("caf\u00e9".encode()[-1:])
+    buf.close()
+    assert buf.drain() == "\u00e9"
+    assert buf.history() == "first line\nsecond\ncaf\u00e9"
+
+
+def test_read_output_full_history(monkeypatch):
+    """A session's full history survives spilling and earlier reads."""
+    monkeypatch.setattr(core, "output_memory_cap", 1024)
+    script = "import sys, time; sys.stdout.write('x' * 50000); sys.stdout.flush(); time.sleep(0.5)"
+    result = core.execute_command(f'{sys.executable} -c "{script}"', timeout=0.3)
+    assert result["status"] == "running"
+    pid = result["pid"]
+
+    session = core.active_sessions[pid]
+    assert session["stdout_buffer"].memory_bytes <= 1024
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        output = core.read_output(pid, full=True)
+        if output["complete"]:
+            break
+        time.sleep(0.1)
+
+    assert output["exit_code"] == 0
+    assert output["stdout"] == "x" * 50000
+
+
+def test_output_buffer_line_index():
+    """Line numbers and byte offsets convert both ways."""
+    buf = OutputBuffer(memory_cap=64)
+    lines = [f"line {i}\n".encode() for i in range(1000)]
+    buf.append(b"".join(lines))
+    buf.append(b"partial")
+
+    assert buf.lines == 1000
+    assert buf.line_offset(0) == 0
+    assert buf.line_offset(500) == sum(len(line) for line in lines[:500])
+    assert buf.line_offset(1000) == buf.size - len(b"partial")
+    assert buf.line_at(buf.line_offset(777)) == 777
+    assert buf.line_at(buf.size) == 1000
+
+
+def test_output_buffer_bounded_reads_split_on_lines():
+    """A bounded read ends on a line boundary and never splits a character."""
+    buf = OutputBuffer()
+    buf.append("one\ntwo\nthree café".encode())
+
+    text, cursor = buf.read_text(0, max_bytes=10)
+    assert text == "one\ntwo\n"
+    text, cursor = buf.read_text(cursor)
+    assert text == "three café"
+    assert cursor == buf.size
+
+
+def test_read_output_cursor_readers_are_independent():
+    """Several readers can follow a session, and a retry returns the same slice."""
+    result = core.execute_command(
+        "sh -c 'for i in 1 2 3 4 5; do echo line $i; done; sleep 0.3'", timeout=0.2
+    )
+    pid = result["pid"]
+    assert pid is not None
+
+    first = core.read_output(pid, since={"stdout": 0, "stderr": 0}, max_bytes=14)
+    assert first["stdout"] == "line 1\nline 2\n"
+    assert first["cursor"]["stdout"] == 14
+    assert first["lines"]["stdout"] == 2
+
+    retry = core.read_output(pid, since={"stdout": 0, "stderr": 0}, max_bytes=14)
+    assert retry["stdout"] == first["stdout"]
+
+    rest = core.read_output(pid, since=first["cursor"])
+    assert rest["stdout"] == "line 3\nline 4\nline 5\n"
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        final = core.read_output(pid)
+        if final["complete"]:
+            break
+        time.sleep(0.1)
+    assert final["exit_code"] == 0
+    assert pid not in core.active_sessions
+
+
+def test_output_buffer_line_index_is_built_lazily():
+    buf = OutputBuffer(memory_cap=64)
+    buf.append(memoryview(b"a\nb\n" * 100))
+
+    assert buf._indexed == 0
+    assert buf.line_at(buf.size) == 200
+    buf.append(b"c\n")
+    assert buf.lines == 201
+
+
+def test_base64_output_is_byte_exact():
+    """Binary output round-trips, including invalid UTF-8 and NUL bytes."""
+    payload = bytes(range(256)) * 64
+    script = "import sys; sys.stdout.buffer.write(bytes(range(256)) * 64)"
+    result = core.execute_command(f'{sys.executable} -c "{script}"', timeout=10, encoding="base64")
+
+    assert result["exit_code"] == 0
+    assert result["encoding"] == "base64"
+    assert base64.b64decode(result["stdout"]) == payload
+
+
+def test_read_output_base64_chunks_reassemble():
+    script = "import sys, time; sys.stdout.buffer.write(bytes(range(256)) * 16); time.sleep(0.2)"
+    started = core.execute_command(f'{sys.executable} -c "{script}"', timeout=0)
+    pid = started["pid"]
+
+    data, cursor = b"", {"stdout": 0, "stderr": 0}
+    for _ in range(100):
+        result = core.read_output(pid, since=cursor, max_bytes=1000, wait=1, encoding="base64")
+        chunk = base64.b64decode(result["stdout"])
+        assert len(chunk) <= 1000
+        data += chunk
+        cursor = result["cursor"]
+        if result["complete"]:
+            break
+    core.read_output(pid)
+
+    assert data == bytes(range(256)) * 16
+
+
+def test_unknown_encoding_is_rejected():
+    result = core.execute_command("echo hi", encoding="utf-16")
+
+    assert result["status"] == "error"
+    assert "encoding" in result["error"]
@@ -0,0 +1,114 @@
+"""Tests for server-side tail/head/grep projection of command output."""
+
+import asyncio
+import os
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.output import OutputBuffer
+from server.projection import OutputProjection
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+
+# 1000 lines, every tenth one flagged as an error
+BUILD_LOG = (
+    f"{sys.executable} -c \"[print(f'line {{i}}' + (' error' if i % 10 == 0 else '')) "
+    "for i in range(1000)]\""
+)
+
+
+def buffer_with(data: bytes, memory_cap: int = 64, closed: bool = True) -> OutputBuffer:
+    buf = OutputBuffer(memory_cap)
+    buf.append(data)
+    if closed:
+        buf.close()
+    return buf
+
+
+def test_tail_seeks_past_spilled_output():
+    data = b"".join(b"line %d\n" % i for i in range(500))
+    buf = buffer_with(data)
+
+    kept, cursor, dropped = OutputProjection(tail=2).apply(buf, 0)
+
+    assert kept == b"line 498\nline 499\n"
+    assert cursor == len(data)
+    assert dropped == {"lines_dropped": 498, "bytes_dropped": len(data) - len(kept)}
+
+
+def test_head_and_tail_keep_both_ends():
+    buf = buffer_with(b"a\nb\nc\nd\ne")
+
+    kept, _, dropped = OutputProjection(head=1, tail=2).apply(buf, 0)
+
+    assert kept == b"a\nd\ne"
+    assert dropped["lines_dropped"] == 2
+
+
+def test_grep_applies_before_tail():
+    buf = buffer_with(b"ok 1\nWARN 2\nok 3\nERROR 4\nok 5\nWARN 6\n")
+
+    kept, _, dropped = OutputProjection(tail=2, grep="ERROR|WARN").apply(buf, 0)
+
+    assert kept == b"ERROR 4\nWARN 6\n"
+    assert dropped["lines_dropped"] == 4
+
+
+def test_max_bytes_drops_whole_lines():
+    buf = buffer_with(b"first line\nsecond line\nthird line\n")
+
+    assert OutputProjection(max_bytes=20).apply(buf, 0)[0] == b"first line\n"
+    assert OutputProjection(max_bytes=20, tail=3).apply(buf, 0)[0] == b"third line\n"
+
+
+def test_partial_line_waits_while_stream_is_open():
+    buf = buffer_with(b"done\nhalf a li", closed=False)
+
+    kept, cursor, _ = OutputProjection(grep="li").apply(buf, 0)
+
+    assert kept == b""
+    assert cursor == len(b"done\n")
+
+
+def test_execute_command_tail():
+    result = core.execute_command(BUILD_LOG, tail=3)
+
+    assert result["stdout"] == "line 997\nline 998\nline 999\n"
+    assert result["projection"]["stdout"]["lines_dropped"] == 997
+    assert result["projection"]["bytes_dropped"] > 0
+
+
+def test_execute_command_grep_async():
+    result = asyncio.run(core.execute_command_async(BUILD_LOG, grep=r"error$", head=2))
+
+    assert result["stdout"] == "line 0 error\nline 10 error\n"
+    assert result["projection"]["stdout"]["lines_dropped"] == 998
+
+
+def test_read_output_projects_from_cursor():
+    # The command waits for stdin to close, so it is still running when
+    # execute_command returns
+    pid = core.execute_command("sh -c 'cat >/dev/null; seq 1 1000'", timeout=0,
+                               open_stdin=True)["pid"]
+    session = core.active_sessions[pid]
+    asyncio.run(core.write_input(pid, eof=True))
+    assert core._wait_for_exit(session, 5)
+    core.finish_output_capture(session)
+
+    result = core.read_output(pid, since={"stdout": 0, "stderr": 0}, grep="0$", tail=2)
+    assert result["stdout"] == "990\n1000\n"
+    assert result["projection"]["stdout"]["lines_dropped"] == 998
+    # Cursor readers consume nothing; the default reader still sees everything
+    assert core.read_output(pid)["stdout"].count("\n") == 1000
+
+
+def test_invalid_projection_is_rejected():
+    result = core.execute_command("echo hi", grep="(")
+    assert result["status"] == "error"
+    assert "Invalid grep pattern" in result["error"]
+
+    result = core.execute_command("echo hi", tail=-1)
+    assert result["status"] == "error"
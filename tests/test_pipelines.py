@@ -0,0 +1,77 @@
+"""Tests for shell-free command pipelines."""
+
+import os
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.pipeline import split_pipeline
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX pipes")
+
+
+def test_split_pipeline_respects_quoting():
+    assert split_pipeline("grep foo | sort | uniq -c") == [["grep", "foo"], ["sort"], ["uniq", "-c"]]
+    assert split_pipeline("echo '|' \"a|b\" c\\|d") == [["echo", "|", "a|b", "c|d"]]
+    assert split_pipeline("echo a|wc -c") == [["echo", "a"], ["wc", "-c"]]
+
+
+@pytest.mark.parametrize("command", ["echo a || echo b", "echo a |", "| sort", "echo 'a | sort"])
+def test_malformed_pipelines_are_rejected(command):
+    result = core.execute_command(command)
+
+    assert result["status"] == "error"
+    assert result["pid"] is None
+
+
+def test_pipeline_output_comes_from_last_stage():
+    result = core.execute_command("printf 'b\\na\\nb\\n' | sort | uniq -c", timeout=10)
+
+    assert result["exit_code"] == 0
+    assert result["stdout"].split() == ["1", "a", "2", "b"]
+    assert result["pipestatus"] == [0, 0, 0]
+    assert result["rusage"] is not None
+
+
+def test_pipeline_exit_code_is_last_stage_and_stderr_is_shared():
+    result = core.execute_command("ls /nonexistent-path | grep nothing", timeout=10)
+
+    assert result["exit_code"] == 1
+    assert result["pipestatus"][0] != 0
+    assert "nonexistent-path" in result["stderr"]
+
+
+def test_every_stage_is_checked_against_the_blacklist():
+    result = core.execute_command("echo hi | mkfs /dev/null")
+
+    assert result["status"] == "error"
+    assert result["error"] == "Command blocked"
+
+
+def test_missing_stage_executable_fails_cleanly():
+    result = core.execute_command("echo hi | /nonexistent/binary")
+
+    assert result["status"] == "error"
+    assert result["pid"] is None
+
+
+def test_large_stream_between_stages():
+    """Data flows stage to stage without the server buffering it."""
+    script = "import sys; sys.stdout.write('x' * 10_000_000)"
+    result = core.execute_command(f'{sys.executable} -c "{script}" | wc -c', timeout=20)
+
+    assert result["exit_code"] == 0
+    assert int(result["stdout"]) == 10_000_000
+
+
+def test_background_pipeline_can_be_read_later():
+    started = core.execute_command("sleep 0.3 | cat", timeout=0)
+    assert started["status"] == "running"
+
+    result = core.read_output(started["pid"], wait=5)
+    while not result["complete"]:
+        result = core.read_output(started["pid"], wait=5)
+    assert result["exit_code"] == 0
+    assert result["pipestatus"] == [0, 0]
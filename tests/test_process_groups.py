@@ -0,0 +1,93 @@
+"""Tests for process-group teardown of command sessions."""
+
+import asyncio
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.procgroup import group_members
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc"), reason="Counts processes via /proc")
+
+# Starts two grandchildren that would outlive the command and hold its pipes
+SPAWNER = (
+    f"{sys.executable} -c \"import subprocess, time; "
+    "[subprocess.Popen(['sleep', '30']) for _ in range(2)]; time.sleep(30)\""
+)
+
+
+def wait_for_members(pgid, count, timeout=5):
+    deadline = time.time() + timeout
+    while len(group_members(pgid)) < count and time.time() < deadline:
+        time.sleep(0.02)
+    return group_members(pgid)
+
+
+def test_commands_lead_their_own_process_group():
+    result = core.execute_command("sleep 1", timeout=0)
+    pid = result["pid"]
+    try:
+        assert os.getpgid(pid) == pid
+        assert os.getsid(pid) == pid
+    finally:
+        asyncio.run(core.force_terminate(pid))
+
+
+def test_timeout_kills_grandchildren():
+    start = time.time()
+    result = core.execute_command(SPAWNER, timeout=1, allow_background=False)
+
+    assert result["error"] == "Command timed out"
+    assert result["reaped"] == 3
+    assert time.time() - start < 5
+
+
+def test_force_terminate_reports_reaped_processes():
+    started = core.execute_command(SPAWNER, timeout=0)
+    pid = started["pid"]
+    assert len(wait_for_members(pid, 3)) == 3
+
+    result = asyncio.run(core.force_terminate(pid, grace=0.5))
+
+    assert result["status"] == "success"
+    assert result["signalled"] == 3
+    assert result["reaped"] == 3
+    assert result["remaining"] == 0
+    assert result["exit_code"] is not None
+    assert group_members(pid) == []
+    assert core.read_output(pid, wait=2)["complete"] is True
+
+
+def test_pipeline_stages_share_a_group():
+    started = core.execute_command("sleep 30 | sleep 30", timeout=0)
+    pid = started["pid"]
+    pgid = os.getpgid(pid)
+    assert len(wait_for_members(pgid, 2)) == 2
+
+    result = asyncio.run(core.force_terminate(pid))
+    assert result["reaped"] == 2
+
+
+def test_force_terminate_unknown_session():
+    result = asyncio.run(core.force_terminate(999999))
+
+    assert result["status"] == "error"
+
+
+def test_force_terminate_leaves_a_finished_group_alone(monkeypatch):
+    started = core.execute_command("sleep 0.2", timeout=0)
+    pid = started["pid"]
+    core.active_sessions[pid].process.wait(timeout=5)
+    signalled = []
+    monkeypatch.setattr(core, "terminate_group", lambda *args: signalled.append(args))
+
+    result = asyncio.run(core.force_terminate(pid))
+
+    assert result["status"] == "success"
+    assert result["exit_code"] == 0
+    assert result["signalled"] == 0
+    assert signalled == []
@@ -0,0 +1,59 @@
+"""Tests for live process-tree snapshots in read_output."""
+
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.procstats import ProcessTreeStats
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+
+BUSY = f"{sys.executable} -c \"import time; t = time.time()\nwhile time.time() - t < 2: pass\""
+
+
+def test_cpu_percent_covers_time_since_previous_poll():
+    pid = core.execute_command(BUSY, timeout=0)["pid"]
+    try:
+        first = core.read_output(pid, process_stats=True)["process_stats"]
+        time.sleep(0.3)
+        second = core.read_output(pid, process_stats=True)["process_stats"]
+
+        assert first["cpu_percent"] == 0.0
+        assert second["cpu_percent"] > 50
+        assert second["processes"] == 1
+        assert second["rss_bytes"] > 0 and second["threads"] >= 1 and second["open_fds"] >= 3
+        assert second["status"] == "running"
+    finally:
+        os.kill(pid, 9)
+
+
+def test_snapshot_includes_children():
+    pid = core.execute_command("sh -c 'sleep 3 & sleep 3 & wait'", timeout=0)["pid"]
+    try:
+        time.sleep(0.2)
+        stats = core.read_output(pid, process_stats=True)["process_stats"]
+        assert stats["processes"] == 3
+        assert stats["status"] == "sleeping"
+    finally:
+        os.killpg(pid, 9)
+
+
+def test_handles_are_cached_and_exited_processes_dropped():
+    stats = ProcessTreeStats([os.getpid()], refresh_interval=60)
+    stats.snapshot()
+    handle = stats._handles[os.getpid()]
+    stats.snapshot()
+    assert stats._handles[os.getpid()] is handle
+
+    gone = ProcessTreeStats([2 ** 22 + 1])
+    assert gone.snapshot()["processes"] == 0
+
+
+def test_exited_session_reports_none():
+    pid = core.execute_command("sleep 0.1", timeout=0)["pid"]
+    time.sleep(0.3)
+    assert core.read_output(pid, process_stats=True)["process_stats"] is None
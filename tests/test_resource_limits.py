@@ -0,0 +1,118 @@
+"""Tests for per-command resource limits and rusage accounting."""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.limits import AccountedProcess, validate_limits
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX rlimits")
+
+
+def read_until_complete(pid, timeout=5):
+    deadline = time.time() + timeout
+    output = core.read_output(pid, wait=timeout)
+    while not output["complete"] and time.time() < deadline:
+        output = core.read_output(pid, wait=deadline - time.time())
+    return output
+
+
+def test_completed_command_reports_rusage():
+    """Finished commands report rusage collected by wait4."""
+    result = asyncio.run(core.execute_command_async(
+        "python3 -c 'sum(range(3000000))'", timeout=10
+    ))
+
+    assert result["status"] == "success"
+    assert result["rusage"]["user_time"] + result["rusage"]["system_time"] > 0
+    assert result["rusage"]["max_rss_kb"] > 0
+    assert "inblock" in result["rusage"] and "oublock" in result["rusage"]
+
+
+def test_background_command_reports_rusage_on_read():
+    """rusage is None while running and filled in once the command exits."""
+    result = core.execute_command("sh -c 'sleep 0.2; echo done'", timeout=0)
+    assert result["rusage"] is None
+
+    output = read_until_complete(result["pid"])
+    assert output["complete"]
+    assert output["rusage"]["max_rss_kb"] > 0
+
+
+def test_open_files_limit():
+    """open_files is applied as RLIMIT_NOFILE in the child."""
+    result = core.execute_command("sh -c 'ulimit -n'", limits={"open_files": 64})
+
+    assert result["stdout"].strip() == "64"
+
+
+def test_cpu_seconds_limit_kills_busy_loop():
+    """A command spinning past its CPU budget is killed and flagged."""
+    result = asyncio.run(core.execute_command_async(
+        "python3 -c 'while True: pass'", timeout=10, limits={"cpu_seconds": 1}
+    ))
+
+    assert result["status"] == "error"
+    assert result["limit_exceeded"] == "cpu_seconds"
+    assert result["rusage"]["user_time"] >= 0.9
+
+
+def test_wall_time_limit_kills_background_command():
+    """wall_time kills a command even after it was backgrounded."""
+    result = core.execute_command("sleep 5", timeout=0, limits={"wall_time": 0.3})
+    start = time.time()
+
+    output = read_until_complete(result["pid"])
+    assert time.time() - start < 2
+    assert output["complete"]
+    assert output["limit_exceeded"] == "wall_time"
+
+
+def test_child_reaped_elsewhere_is_lost_not_successful():
+    """A child reaped behind our back has no exit code rather than 0."""
+    process = AccountedProcess(subprocess.Popen(["true"]))
+    os.waitpid(process.pid, 0)
+
+    assert process.poll() is not None
+    assert process.lost
+
+
+def test_lost_command_reports_no_exit_code(monkeypatch):
+    """read_output reports a lost exit status as an error without an exit code."""
+    pid = core.execute_command("sleep 30", timeout=0)["pid"]
+    wait4 = os.wait4
+
+    def reaped_elsewhere(child, options):
+        if child == pid:
+            raise ChildProcessError
+        return wait4(child, options)
+
+    monkeypatch.setattr(os, "wait4", reaped_elsewhere)
+    try:
+        os.kill(pid, signal.SIGKILL)
+        output = read_until_complete(pid)
+    finally:
+        monkeypatch.undo()
+        os.waitpid(pid, 0)
+
+    assert output["complete"]
+    assert output["status"] == "error"
+    assert output["exit_code"] is None
+    assert output["lost"] is True
+
+
+def test_invalid_limits_rejected():
+    """Unknown or non-positive limits are rejected before anything is spawned."""
+    assert validate_limits({"cpu_seconds": 1, "wall_time": 0.5}) is None
+    assert "Unknown limit" in validate_limits({"threads": 4})
+
+    result = core.execute_command("echo hi", limits={"memory_bytes": -1})
+    assert result["status"] == "error"
+    assert "positive" in result["error"]
@@ -0,0 +1,143 @@
+"""Tests for the command admission scheduler."""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.scheduler import CommandScheduler
+
+
+def test_clients_take_turns_within_a_priority():
+    """A client with a long backlog does not delay another client's command."""
+    scheduler = CommandScheduler(1)
+    first = scheduler.submit("first", "a", "batch")
+    flood = [scheduler.submit(f"a{i}", "a", "batch") for i in range(3)]
+    other = scheduler.submit("b0", "b", "batch")
+
+    assert scheduler.position(flood[0]) == 1
+    assert scheduler.position(other) == 2
+    assert scheduler.position(flood[1]) == 3
+
+    scheduler.release(first)
+    assert flood[0].admitted
+    scheduler.release(flood[0])
+    assert other.admitted
+
+
+def test_interactive_commands_jump_batch_queue():
+    """Queued interactive commands are admitted before queued batch commands."""
+    depth = []
+    waits = []
+    scheduler = CommandScheduler(1, observe_depth=lambda delta, priority: depth.append(delta),
+                                 observe_wait=lambda seconds, priority: waits.append(priority))
+    running = scheduler.submit("running", "a", "batch")
+    batch = scheduler.submit("batch", "a", "batch")
+    interactive = scheduler.submit("interactive", "b", "interactive")
+
+    assert scheduler.position(interactive) == 1
+    scheduler.release(running)
+    scheduler.release(running)
+    assert interactive.admitted and not batch.admitted
+    assert sum(depth) == 1
+    assert waits == ["batch", "interactive"]
+
+
+def test_cancel_removes_from_queue():
+    scheduler = CommandScheduler(1)
+    scheduler.submit("running", "a", "batch")
+    queued = scheduler.submit("queued", "a", "batch")
+
+    assert scheduler.cancel(queued)
+    assert queued.state == "cancelled"
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_unknown_priority_rejected():
+    result = core.execute_command("echo hi", priority="urgent")
+
+    assert result["status"] == "error"
+    assert "Unknown priority" in result["error"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+def test_queued_command_starts_when_slot_frees(monkeypatch):
+    """Commands over the budget return queued and start once a slot is free."""
+    monkeypatch.setattr(core, "command_scheduler", CommandScheduler(1))
+    first = core.execute_command("sleep 0.3", timeout=0)
+    queued = core.execute_command("echo later", timeout=0)
+
+    assert first["status"] == "running"
+    assert queued["status"] == "queued"
+    assert queued["position"] == 1
+
+    deadline = time.time() + 5
+    status = core.queue_status(queued["ticket"])
+    while status["pid"] is None and time.time() < deadline:
+        time.sleep(0.05)
+        status = core.queue_status(queued["ticket"])
+    assert status["state"] in ("running", "finished")
+    assert status["queue_wait"] >= 0.2
+
+    output = core.read_output(status["pid"], wait=5)
+    assert output["stdout"] == "later\n"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+def test_queue_timeout_without_background(monkeypatch):
+    """Commands that may not run in the background give up their queue slot."""
+    monkeypatch.setattr(core, "command_scheduler", CommandScheduler(1))
+    first = core.execute_command("sleep 0.5", timeout=0)
+    result = core.execute_command("echo never", timeout=0.1, allow_background=False)
+
+    assert result["status"] == "error"
+    assert "waiting for admission" in result["error"]
+    assert core.command_scheduler.stats()["queued"] == 0
+    os.kill(first["pid"], 9)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+def test_cancelled_queued_call_gives_up_its_place(monkeypatch):
+    """A request cancelled while queued does not keep a slot once admitted."""
+    monkeypatch.setattr(core, "command_scheduler", CommandScheduler(1))
+    first = core.execute_command("sleep 0.3", timeout=0)
+
+    async def cancel_queued():
+        task = asyncio.ensure_future(core.execute_command_async("echo never", timeout=5))
+        while not core.command_scheduler.stats()["queued"]:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_queued())
+    assert core.command_scheduler.stats()["queued"] == 0
+
+    core.read_output(first["pid"], wait=5)
+    result = core.execute_command("echo next", timeout=5)
+    assert result["stdout"] == "next\n"
+    assert core.command_scheduler.stats()["running"] == 0
+
+
+def test_admitted_command_starts_off_the_releasing_thread():
+    """on_admit runs on a thread of its own, not the one calling release()."""
+    scheduler = CommandScheduler(1)
+    running = scheduler.submit("running", "a", "batch")
+    queued = scheduler.submit("queued", "a", "batch")
+    started = []
+    done = threading.Event()
+
+    def on_admit(ticket):
+        started.append(threading.current_thread())
+        done.set()
+
+    assert scheduler.detach(queued, on_admit)
+    scheduler.release(running)
+
+    assert done.wait(5)
+    assert started[0] is not threading.current_thread()
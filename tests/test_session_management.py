@@ -0,0 +1,129 @@
+"""Tests for command session lifecycle management."""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import psutil
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+from server.sessions import Session, SessionRegistry
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX commands")
+
+
+def test_reaper_keeps_output_for_grace_period(monkeypatch):
+    """Unobserved exited sessions stay readable until the grace period ends."""
+    monkeypatch.setattr(core, "SESSION_GRACE_PERIOD", 0.3)
+    result = core.execute_command("sh -c 'echo unobserved; sleep 0.2'", timeout=0)
+    pid = result["pid"]
+    time.sleep(0.5)
+
+    core.reap_sessions()
+    assert pid in core.active_sessions
+    assert core.active_sessions[pid]["exit_time"]
+
+    output = core.read_output(pid, since={"stdout": 0, "stderr": 0})
+    assert output["stdout"] == "unobserved\n"
+
+    time.sleep(0.35)
+    before = core.reaper_stats["reclaimed_memory_bytes"]
+    core.reap_sessions()
+    assert pid not in core.active_sessions
+    assert core.reaper_stats["reclaimed_memory_bytes"] >= before + len("unobserved\n")
+
+
+def test_reaper_evicts_session_after_event_loop_ends(monkeypatch):
+    """A session whose event loop ended before the process exited is reaped and evicted."""
+    monkeypatch.setattr(core, "SESSION_GRACE_PERIOD", 0)
+    before = core.reaper_stats["evicted"]
+    result = asyncio.run(core.execute_command_async("sleep 0.2", timeout=0))
+    pid = result["pid"]
+    time.sleep(0.5)
+
+    core.reap_sessions()
+    core.reap_sessions()
+    assert pid not in core.active_sessions
+    assert core.reaper_stats["evicted"] > before
+    assert not psutil.pid_exists(pid)
+
+
+def test_session_stats_reports_counts():
+    """session_stats reports running sessions and reaper totals."""
+    result = core.execute_command("sleep 1", timeout=0)
+    stats = core.session_stats()
+
+    assert stats["status"] == "success"
+    assert stats["sessions"]["running"] >= 1
+    assert "reclaimed_memory_bytes" in stats["reaper"]
+    os.kill(result["pid"], 9)
+
+
+def test_registry_counts_and_conditional_remove():
+    registry = SessionRegistry(stripes=4)
+    first, second = (Session(None, "true", None, None, None) for _ in range(2))
+    assert registry.add(1, first) is None
+    assert registry.add(5, first) is None
+    assert registry.add(5, second) is first
+
+    assert len(registry) == 2
+    assert registry[5] is second and 5 in registry
+    assert not registry.remove(5, first)
+    assert registry.remove(5, second)
+    assert 5 not in registry and len(registry) == 1
+    assert [pid for pid, _ in registry.items()] == [1]
+
+
+def test_reused_pid_releases_the_replaced_session(monkeypatch):
+    """Re-registering a pid closes the old session and keeps the gauge exact."""
+    class Exited:
+        returncode = 0
+
+    changes = []
+    monkeypatch.setattr(core.active_sessions_counter, "add", lambda delta, *args: changes.append(delta))
+    pid = 2 ** 22 + 7
+    old, new = core._new_session(Exited(), "old"), core._new_session(Exited(), "new")
+    old.stdout_buffer.append(b"kept for late readers")
+    version = old.notifier.version
+    try:
+        core._register_session(pid, old)
+        core._register_session(pid, new)
+
+        assert changes == [1]
+        assert core.active_sessions[pid] is new
+        assert old.stdout_buffer.memory_bytes == 0
+        assert old.notifier.version > version
+    finally:
+        core._remove_session(pid)
+
+
+def test_registry_concurrent_updates():
+    registry = SessionRegistry()
+
+    def churn(base):
+        for pid in range(base, base + 500):
+            registry.add(pid, Session(None, "true", None, None, None))
+        for pid in range(base, base + 500, 2):
+            registry.remove(pid)
+
+    threads = [threading.Thread(target=churn, args=(n * 1000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(registry) == len(registry.items()) == 8 * 250
+
+
+def test_session_records_use_slots():
+    session = Session(None, "true", None, None, None)
+
+    assert not hasattr(session, "__dict__")
+    assert session["command"] == "true"
+    assert session.get("cgroup", "none") == "none"
+    with pytest.raises(AttributeError):
+        session.unknown_field = 1
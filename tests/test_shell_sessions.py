@@ -0,0 +1,88 @@
+"""Tests for persistent PTY shell sessions."""
+
+import asyncio
+import os
+import sys
+import time
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses pseudo-terminals")
+
+
+def run_in_shell(*commands, timeout=5, **kwargs):
+    async def scenario():
+        shell = await core.open_shell(**kwargs)
+        assert shell["status"] == "success"
+        try:
+            return [await core.shell_exec(shell["shell_id"], command, timeout) for command in commands]
+        finally:
+            core.close_shell(shell["shell_id"])
+    return asyncio.run(scenario())
+
+
+def test_state_persists_between_commands(temp_dir):
+    """cd and exported variables carry over to later commands."""
+    results = run_in_shell(f"cd {temp_dir}", "export GREETING=hello", "echo $GREETING; pwd")
+
+    assert all(result["exit_code"] == 0 for result in results)
+    assert results[2]["output"] == f"hello\n{os.path.realpath(temp_dir)}\n"
+    assert results[2]["cwd"] == os.path.realpath(temp_dir)
+
+
+def test_each_call_returns_its_own_output_and_exit_code():
+    results = run_in_shell("echo one", "ls /nonexistent-path", "printf partial", "echo two")
+
+    assert results[0]["output"] == "one\n"
+    assert results[1]["exit_code"] != 0
+    assert "nonexistent-path" in results[1]["output"]
+    assert results[2]["output"] == "partial"
+    assert results[3]["output"] == "two\n"
+
+
+def test_commands_see_a_terminal():
+    results = run_in_shell("test -t 1 && echo tty")
+
+    assert results[0]["output"] == "tty\n"
+
+
+def test_timeout_interrupts_and_shell_recovers():
+    """A timed-out command is interrupted and the shell stays usable."""
+    results = run_in_shell("sleep 10", "echo 'unterminated", "echo still here", timeout=0.3)
+
+    assert results[0]["error"] == "Command timed out"
+    assert results[0]["exit_code"] == 130
+    assert results[1]["error"] == "Command timed out"
+    assert results[2]["output"] == "still here\n"
+
+
+def test_step_latency_is_low():
+    """Running a builtin costs milliseconds, not a process start."""
+    async def scenario():
+        shell = await core.open_shell()
+        start = time.perf_counter()
+        for _ in range(50):
+            await core.shell_exec(shell["shell_id"], "echo hi")
+        elapsed = time.perf_counter() - start
+        core.close_shell(shell["shell_id"])
+        return elapsed / 50
+
+    assert asyncio.run(scenario()) < 0.02
+
+
+def test_close_shell_and_blocked_commands():
+    async def scenario():
+        shell = await core.open_shell()
+        blocked = await core.shell_exec(shell["shell_id"], "rm -rf /")
+        closed = core.close_shell(shell["shell_id"])
+        missing = await core.shell_exec(shell["shell_id"], "echo hi")
+        return blocked, closed, missing
+
+    blocked, closed, missing = asyncio.run(scenario())
+    assert blocked["status"] == "error"
+    assert closed["status"] == "success"
+    assert closed["commands"] == 1
+    assert "No open shell" in missing["error"]
@@ -0,0 +1,98 @@
+"""Tests for feeding stdin of running sessions."""
+
+import asyncio
+import base64
+import os
+import signal
+import sys
+import pytest
+
+# Import the server module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from server import core
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Uses POSIX pipes")
+
+
+async def read_until(pid, text, output=""):
+    for _ in range(20):
+        if text in output:
+            break
+        result = await core.read_output_async(pid, wait=0.5)
+        output += result["stdout"]
+        if result["complete"]:
+            break
+    return output
+
+
+def test_drive_an_interactive_prompt():
+    script = "name = input('name? '); print('hello ' + name); print(input() * 2)"
+
+    async def scenario():
+        started = await core.execute_command_async(
+            f'{sys.executable} -u -c "{script}"', timeout=0.2, open_stdin=True
+        )
+        pid = started["pid"]
+        assert await read_until(pid, "name? ", started["stdout"]) == "name? "
+
+        result = await core.write_input(pid, "world\n")
+        assert result["status"] == "success"
+        assert result["bytes_written"] == 6
+        assert "hello world" in await read_until(pid, "hello world")
+
+        await core.write_input(pid, "ab\n", eof=True)
+        return await read_until(pid, "abab")
+
+    assert "abab" in asyncio.run(scenario())
+
+
+def test_eof_ends_a_reader():
+    async def scenario():
+        started = await core.execute_command_async("cat", timeout=0.1, open_stdin=True)
+        pid = started["pid"]
+        payload = bytes(range(256))
+        result = await core.write_input(pid, base64.b64encode(payload).decode(), eof=True,
+                                        encoding="base64")
+        assert result["stdin_open"] is False
+        final = await core.read_output_async(pid, wait=5, encoding="base64")
+        while not final["complete"]:
+            final = await core.read_output_async(pid, wait=5, encoding="base64")
+        return base64.b64decode(final["stdout"]), final["exit_code"]
+
+    assert asyncio.run(scenario()) == (bytes(range(256)), 0)
+
+
+def test_full_pipe_times_out_without_blocking():
+    async def scenario():
+        # sleep never reads, so the pipe fills up
+        started = await core.execute_command_async("sleep 5", timeout=0.1, open_stdin=True)
+        pid = started["pid"]
+        try:
+            return await core.write_input(pid, "x" * (4 << 20), timeout=0.2)
+        finally:
+            os.kill(pid, signal.SIGKILL)
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "error"
+    assert 0 < result["bytes_written"] < 4 << 20
+    assert result["pending"] == (4 << 20) - result["bytes_written"]
+
+
+def test_stdin_is_not_inherited_by_default():
+    result = core.execute_command("cat", timeout=5)
+
+    assert result["exit_code"] == 0
+    assert result["stdout"] == ""
+
+
+def test_write_to_session_without_stdin():
+    async def scenario():
+        started = await core.execute_command_async("sleep 1", timeout=0.1)
+        try:
+            return await core.write_input(started["pid"], "x")
+        finally:
+            os.kill(started["pid"], signal.SIGKILL)
+
+    result = asyncio.run(scenario())
+    assert result["status"] == "error"
+    assert "no open stdin" in result["error"]